@@ -1 +1,9 @@
+import os, sys
+
+# This directory is also a package, so "flask --app dinosaur" imports the app as <package>.dinosaur, whose own imports (dinosaur_cache, ...) are top-level. The directory goes on sys.path so they resolve, and the one dinosaur module is registered under both names so the app is never imported twice.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dinosaur
 from dinosaur import app
+
+sys.modules[__name__ + '.dinosaur'] = dinosaur
@@ -1,15 +1,22 @@
-from flask import Flask, request, session, g, redirect, url_for, abort, render_template, flash
+from flask import Flask, request, session, g, redirect, url_for, abort, render_template, stream_template, stream_with_context, flash, jsonify
 import os
-import json, requests, sys, random
+import json, requests, sys, random, time, codecs, gzip, hashlib, bisect, collections, contextlib, cProfile, io, itertools, math, pickle, queue, threading, uuid, functools, concurrent.futures
+import requests.adapters, urllib3.exceptions
 from sqlite3 import dbapi2 as sqlite3
-from wtforms import RadioField, SubmitField,IntegerField,TextAreaField,SelectField
-from flask_wtf import Form
-import urllib.request
-from flask_googlemaps import GoogleMaps # https://pypi.python.org/pypi/Flask-GoogleMaps/
-from flask_googlemaps import Map, icons
-import geocoder # https://pypi.python.org/pypi/geocoder
-import pycountry # https://pypi.python.org/pypi/pycountry
+import urllib.request, urllib.parse
 from flask_sqlalchemy import SQLAlchemy
+from dinosaur_cache import createResponseCache, normaliseQueryURL, CachingReader
+from dinosaur_geocode import createGeocoder
+from dinosaur_cluster import MarkerClusterIndex
+from dinosaur_mirror import createOccurrenceMirror
+from dinosaur_location import getLocation, getLocations
+from dinosaur_metrics import MetricsRegistry
+from dinosaur_export import exportFormats, getContentEncodings, compressChunks
+import click
+from sqlalchemy import event, inspect, text, select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine
+from markupsafe import Markup
 
 app = Flask(__name__)
 
@@ -18,24 +25,152 @@ app.config.update(dict(
 	DATABASE=os.path.join(app.root_path, 'paleozoic.db'),
 	DEBUG=True,
 	SECRET_KEY='development key',
+	PALEOBIODB_BASE_URL='https://paleobiodb.org/data1.2', # Point this at a local stand-in server for testing
+	SEARCH_JOB_WORKERS=2, # Searches running at once; more wait in the pool's queue
+	SEARCH_JOB_TTL=60 * 60, # Seconds a finished job's status is kept for its browser to collect
+	SEARCH_JOB_STALE_AFTER=60.0, # Seconds an unfinished job may go without a heartbeat (see syncSearchJob()) before it is taken to have died with its process and marked failed
+	SEARCH_JOB_SYNC_INTERVAL=1.0, # Seconds between a running job saving its progress to the database and checking whether it has been cancelled
+	PBDB_PAGE_SIZE=5000, # Records per limit/offset page request
+	PBDB_FETCH_THREADS=4, # Pages downloaded at once
+	PBDB_FETCH_BUFFER=1000, # Records each fetch thread may parse ahead of the search using them; beyond that its download waits
+	PBDB_FETCH_RETRIES=3, # Extra attempts for a failed page, PBDB_FETCH_BACKOFF * 2^attempt seconds apart
+	PBDB_FETCH_BACKOFF=0.5,
+	PBDB_FETCH_TIMEOUT=60, # Seconds to wait for PBDB to start answering a page
+	PALEOBIODB_CACHE='memory', # 'memory' (in-process LRU), 'sqlite' (on disk, at PALEOBIODB_CACHE_PATH) or None to always go upstream
+	PALEOBIODB_CACHE_PATH=os.path.join(app.root_path, 'pbdb_cache.db'),
+	PALEOBIODB_CACHE_MAX_BYTES=256 * 1024 * 1024,
+	PALEOBIODB_CACHE_TTL=24 * 60 * 60, # Seconds a cached response is served as-is
+	PALEOBIODB_CACHE_STALE=7 * 24 * 60 * 60, # Further seconds it is still served, while being refreshed in the background
+	GEOTIME_SNAPSHOT=os.path.join(app.root_path, 'geotime.json'), # Bundled geologic timescale, loaded at startup; "flask --app dinosaur refresh-timescale", run in this directory, updates it from PBDB
+	GEOTIME_SNAPSHOT_MAX_AGE=90 * 24 * 60 * 60, # refresh-timescale leaves younger snapshots alone unless forced
+	PBDB_MIRROR_PATH=os.path.join(app.root_path, 'pbdb_mirror.db'), # Local copy of the taxon presets' occurrences, filled by "flask --app dinosaur sync-mirror" (run in this directory); None turns it off
+	PBDB_MIRROR_MAX_AGE=7 * 24 * 60 * 60, # Seconds after its last sync that a preset is still answered from the mirror
+	GEOCODE_CACHE_PATH=os.path.join(app.root_path, 'geocode_cache.db'), # Persistent store of geocoded places; None keeps them in memory only
+	GEOCODE_CACHE_MAX_ENTRIES=10000,
+	GAZETTEER_FILE=None, # Optional CSV of name,lat,lng consulted before Google, for offline/instant geocoding of known places
+	RESULT_TTL=60 * 60, # Seconds a search's stored results are kept before expire_old_searches() removes them
+	RESULT_EXPIRY_INTERVAL=5 * 60, # Seconds between runs of the background expiry thread
+	RESULTS_PAGE_SIZE=500, # Fossils listed per page under the results map
+	COMPRESS_RESPONSES=True, # Results pages and exports are gzip-compressed (brotli if the brotli package is installed) for browsers that accept it
+	COMPRESSION_LEVEL=6,
+	MARKER_CLUSTER_MAX_ZOOM=14, # Beyond this zoom level every fossil gets its own pin
+	MARKER_CLUSTER_CACHE_SIZE=32, # Result sets whose marker clusters are kept in memory per process
+	MARKER_CLUSTER_CACHE_MARKERS=250000, # ...and the most markers they may hold between them (about 600 bytes each); the latest result set is kept whatever its size
+	LOG_LEVEL='INFO', # DEBUG also logs each search's PBDB URL and geocoding
+	PROFILE_REQUESTS=None, # 'cprofile' or 'pyinstrument' to save a profile of every request and search job in PROFILE_DIR
+	PROFILE_DIR=os.path.join(app.root_path, 'profiles'),
+	SQLALCHEMY_DATABASE_URI='sqlite:///dinosaur.db',
+	SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30, 'check_same_thread': False}}, # Lets concurrent workers wait for SQLite's write lock instead of failing
 ))
 app.config.from_envvar('DINOSAUR_SETTINGS', silent=True)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///dinosaur.db'
+app.logger.setLevel(app.config['LOG_LEVEL'])
 db = SQLAlchemy(app)
 
-# Initialize GoogleMaps extension
+@event.listens_for(Engine, 'connect')
+def setSQLitePragmas(dbapiConnection, connectionRecord):
+	# WAL lets readers keep going while one search is writing, across threads and across worker processes
+	if isinstance(dbapiConnection, sqlite3.Connection):
+		dbapiConnection.execute('pragma journal_mode=WAL')
+
 # Pass API key to Google Maps
 google_maps_api_key = open('static/secret/google_maps_api_key.txt').read()
-GoogleMaps(app, key=google_maps_api_key)
 
+# Cache of PaleoBioDB responses, shared by every search (see dinosaur_cache.py)
+paleobiodbCache = createResponseCache(app.config)
+
+# Memoising geocoder for the location search box (see dinosaur_geocode.py)
+placeGeocoder = createGeocoder(app.config)
+
+# Counters and stage timings served at /metrics (see dinosaur_metrics.py)
+metrics = MetricsRegistry()
+metrics.describe('dinosaur_stage_seconds', 'histogram', 'Time spent in each stage of a search or request.')
+metrics.describe('dinosaur_searches_total', 'counter', 'Search jobs finished, by outcome.')
+metrics.describe('dinosaur_search_records_total', 'counter', 'Fossil records ingested by searches.')
+metrics.describe('dinosaur_search_db_statements_total', 'counter', 'Database statements run by searches.')
+metrics.describe('dinosaur_search_upstream_fetches_total', 'counter', 'PBDB requests made by searches.')
+metrics.describe('dinosaur_search_cache_hits_total', 'counter', 'PBDB pages served from the response cache.')
+metrics.describe('dinosaur_search_mirror_hits_total', 'counter', 'Searches answered from the local PBDB mirror.')
+
+# Synced taxon presets are searched locally instead of on PBDB (see dinosaur_mirror.py)
+occurrenceMirror = createOccurrenceMirror(app.config)
+
+# Pooled HTTP connections to PaleoBioDB, shared by the page-fetching threads of every search running at once
+paleobiodbSession = requests.Session()
+paleobiodbSession.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=app.config['PBDB_FETCH_THREADS'] * app.config['SEARCH_JOB_WORKERS']))
+paleobiodbSession.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=app.config['PBDB_FETCH_THREADS'] * app.config['SEARCH_JOB_WORKERS']))
+
+# Searches run as background jobs (see SearchJob) on this pool; its work queue holds the jobs waiting for a free worker
+searchJobPool = concurrent.futures.ThreadPoolExecutor(max_workers=app.config['SEARCH_JOB_WORKERS'])
+
+@app.before_request
+def ensureClientId():
+	if ('client_id' not in session):
+		session['client_id'] = uuid.uuid4().hex
+
+def startProfiler():
+	# Starts profiling the current thread when PROFILE_REQUESTS is set; pyinstrument is optional and only imported when asked for. cProfile allows one active profiler per thread, so nested or clashing starts just go unprofiled.
+	profilerName = app.config['PROFILE_REQUESTS']
+	if not profilerName:
+		return None
+	try:
+		if (profilerName == 'pyinstrument'):
+			import pyinstrument
+			profiler = pyinstrument.Profiler()
+			profiler.start()
+		else:
+			profiler = cProfile.Profile()
+			profiler.enable()
+	except (ImportError, ValueError, RuntimeError) as error:
+		app.logger.warning("Profiling unavailable: %s", error)
+		return None
+	return profiler
+
+def saveProfile(profiler, name):
+	# Writes PROFILE_DIR/<time>-<name>.prof (cProfile, for pstats/snakeviz) or .html (pyinstrument)
+	if (profiler == None):
+		return
+	os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+	profilePath = os.path.join(app.config['PROFILE_DIR'], '%d-%s' % (time.time() * 1000, name))
+	if isinstance(profiler, cProfile.Profile):
+		profiler.disable()
+		profiler.dump_stats(profilePath + '.prof')
+	else:
+		profiler.stop()
+		with open(profilePath + '.html', 'w') as profileFile:
+			profileFile.write(profiler.output_html())
+
+@app.before_request
+def startRequestProfile():
+	g.profiler = startProfiler()
+
+@app.teardown_request
+def saveRequestProfile(error):
+	# A teardown handler, so requests that raised are profiled (and their profiler stopped) too
+	saveProfile(g.pop('profiler', None), (request.endpoint or 'request').replace('.', '-'))
+
+
+class Taxon(db.Model):
+	# One row per distinct (phylum, class, order, family, genus) combination seen in a search; Fossil rows point here instead of each carrying a pickled taxonomy dict. Missing ranks are stored as '' so the unique constraint treats them as equal.
+	__table_args__ = (db.UniqueConstraint('phylum', 'class_', 'order_', 'family', 'genus'),)
+	id = db.Column(db.Integer, primary_key=True)
+	phylum = db.Column(db.String(80), nullable=False, default='')
+	class_ = db.Column(db.String(80), nullable=False, default='')
+	order_ = db.Column(db.String(80), nullable=False, default='')
+	family = db.Column(db.String(80), nullable=False, default='')
+	genus = db.Column(db.String(80), nullable=False, default='')
+
+class SearchRun(db.Model):
+	# One stored result set. Every Fossil row belongs to a SearchRun via search_id, so concurrent searches never see or delete each other's rows; expire_old_searches() drops runs older than RESULT_TTL.
+	id = db.Column(db.String(32), primary_key=True)
+	created_at = db.Column(db.Float, index=True)
 
 class Fossil(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
+	search_id = db.Column(db.String(32), index=True)
 	fossilName = db.Column(db.String(80))
-	taxonomy = db.Column(db.PickleType)
+	taxon_id = db.Column(db.Integer, db.ForeignKey('taxon.id'))
 	location = db.Column(db.String(100))
 	age = db.Column(db.String(50))
-	coordinatePairs = db.Column(db.PickleType)
 	paleoenv = db.Column(db.String(30))
 	geocomments = db.Column(db.String(200))
 	nation = db.Column(db.String(40))
@@ -44,15 +179,80 @@ class Fossil(db.Model):
 	geologicAge = db.Column(db.String(30))
 	max_ma = db.Column(db.Float)
 	min_ma = db.Column(db.Float)
+	lat = db.Column(db.Float)
+	lng = db.Column(db.Float)
+
+taxonRanks = ('phylum', 'class', 'order', 'family', 'genus')
+taxonColumnNames = ('phylum', 'class_', 'order_', 'family', 'genus')
+taxonRankColumns = (Taxon.phylum, Taxon.class_, Taxon.order_, Taxon.family, Taxon.genus)
+
+# Read-only, tuple-backed view of one stored fossil with its taxonomy joined in, as used by the map and the results list. Built by loadFossilRecords().
+class FossilRecord(collections.namedtuple('FossilRecord', ['id', 'fossilName', 'location', 'age', 'lat', 'lng', 'paleoenv', 'geocomments', 'nation', 'state', 'county', 'geologicAge', 'max_ma', 'min_ma', 'phylum', 'class_', 'order_', 'family', 'genus'])):
+	__slots__ = ()
+
+fossilRecordColumns = [Fossil.id, Fossil.fossilName, Fossil.location, Fossil.age, Fossil.lat, Fossil.lng, Fossil.paleoenv, Fossil.geocomments, Fossil.nation, Fossil.state, Fossil.county, Fossil.geologicAge, Fossil.max_ma, Fossil.min_ma] + [func.nullif(rankColumn, '') for rankColumn in taxonRankColumns]
+
+def loadFossilRecords(searchId, *criteria, limit=None, offset=0):
+	# Reads the fossils of one search (optionally narrowed by further SQLAlchemy criteria, or just one limit/offset page of them) straight into FossilRecords, in one joined SELECT
+	fossilQuery = select(*fossilRecordColumns).outerjoin(Taxon, Fossil.taxon_id == Taxon.id).where(Fossil.search_id == searchId, *criteria).order_by(Fossil.id).limit(limit).offset(offset)
+	return [FossilRecord._make(row) for row in db.session.execute(fossilQuery)]
+
+def iterFossilRecords(searchId, limit=None, offset=0, batchSize=1000):
+	# loadFossilRecords() as a generator: rows are fetched from SQLite batchSize at a time, so streaming a whole result set takes constant memory
+	fossilQuery = select(*fossilRecordColumns).outerjoin(Taxon, Fossil.taxon_id == Taxon.id).where(Fossil.search_id == searchId).order_by(Fossil.id).limit(limit).offset(offset).execution_options(yield_per=batchSize)
+	for row in db.session.execute(fossilQuery):
+		yield FossilRecord._make(row)
+
+# SQLite R*Tree over Fossil.lat/lng, so stored results can be searched by bounding box without another PBDB request. It is created and dropped along with the fossil table, and refilled by refresh_spatial_index() after each ingest.
+@event.listens_for(Fossil.__table__, 'after_create')
+def create_spatial_index(target, connection, **kw):
+	try:
+		connection.exec_driver_sql('create virtual table if not exists fossil_rtree using rtree(id, minLat, maxLat, minLng, maxLng)')
+	except OperationalError as error: # SQLite built without the R*Tree module: fossilsInBox() falls back to plain column filters
+		app.logger.warning("No R*Tree spatial index: %s", error)
 
-	def __init__(self, fossilName, taxonomy, location, age, coordinatePairs, paleoenv, geocomments):
-		self.fossilName = fossilName
-		self.taxonomy = taxonomy
-		self.location = location
-		self.age = age
-		self.coordinatePairs = coordinatePairs
-		self.paleoenv = paleoenv
-		self.geocomments = geocomments
+@event.listens_for(Fossil.__table__, 'before_drop')
+def drop_spatial_index(target, connection, **kw):
+	connection.exec_driver_sql('drop table if exists fossil_rtree')
+
+def hasSpatialIndex(connection=None):
+	if (connection == None):
+		connection = db.session
+	return connection.execute(text("select count(*) from sqlite_master where name = 'fossil_rtree'")).scalar() > 0
+
+def migrate_fossil_table():
+	# Brings a fossil table from before the columnar schema up to date. The pickled taxonomy dicts and [lat, lng] lists are unpickled once, and the rows go through the same staging table as a search's (see store_staged_fossils()), which fills in the taxon table and the lat/lng columns. The rows become one search, 'migrated', which expires like any other.
+	oldColumns = [column['name'] for column in inspect(db.engine).get_columns('fossil')]
+	if (not oldColumns) or ('search_id' in oldColumns):
+		return
+	if ('taxonomy' not in oldColumns): # Unpickled but unscoped results from an interim schema: nothing worth keeping, so just rebuild the table
+		Fossil.__table__.drop(db.engine)
+		Fossil.__table__.create(db.engine)
+		return
+	with db.engine.begin() as connection:
+		oldRows = connection.exec_driver_sql('select * from fossil order by id').mappings().all()
+		connection.exec_driver_sql('drop table if exists fossil_rtree')
+		connection.exec_driver_sql('drop table fossil')
+	Fossil.__table__.create(db.engine)
+	fossilColumns = {name: [oldRow[name] if name in oldColumns else None for oldRow in oldRows] for name in ('fossilName', 'location', 'age', 'paleoenv', 'geocomments', 'nation', 'state', 'county', 'geologicAge', 'max_ma', 'min_ma')}
+	fossilColumns['search_id'] = ['migrated'] * len(oldRows)
+	fossilColumns['taxonomy'] = [pickle.loads(oldRow['taxonomy']) if oldRow.get('taxonomy') else getTaxonomy(None, None, None, None, None) for oldRow in oldRows]
+	coordinatePairs = [pickle.loads(oldRow['coordinatePairs'])[:2] if oldRow.get('coordinatePairs') else (None, None) for oldRow in oldRows]
+	fossilColumns['lat'] = [coordinatePair[0] for coordinatePair in coordinatePairs]
+	fossilColumns['lng'] = [coordinatePair[1] for coordinatePair in coordinatePairs]
+	with db.engine.connect() as connection:
+		create_staging_table(connection)
+		stage_fossil_columns(connection, fossilColumns)
+		store_staged_fossils(connection, 'migrated')
+	app.logger.info("Migrated %d fossils to the columnar schema", len(oldRows))
+
+def migrate_search_job_table():
+	# Adds the columns SearchJob has gained since the table was created; create_all() only creates missing tables
+	jobColumns = [column['name'] for column in inspect(db.engine).get_columns('search_job')]
+	if jobColumns and ('heartbeat_at' not in jobColumns):
+		with db.engine.begin() as connection:
+			connection.exec_driver_sql('alter table search_job add column heartbeat_at float')
+			connection.execute(SearchJob.__table__.update().values(heartbeat_at=time.time())) # Unfinished jobs get SEARCH_JOB_STALE_AFTER to show they are still alive
 
 class GeoTime(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
@@ -74,47 +274,235 @@ class GeoTime(db.Model):
 		self.parent_no = parent_no
 
 
-def create_GeoTime_objects():
-	paleobiodbResponse = urllib.request.urlopen('https://paleobiodb.org/data1.2/intervals/list.json?scale=1')
-	paleobiodbResponseJSONString = paleobiodbResponse.read().decode('UTF-8')
-	paleobiodbResponseJson = json.loads(paleobiodbResponseJSONString)
-	paleobiodbRecordsJson = paleobiodbResponseJson['records']
+geoTimeColumns = ('interval_no', 'scale_level', 'interval_name', 'color', 'max_ma', 'min_ma', 'parent_no')
+
+def create_GeoTime_objects(geoTimeRows):
+	# Replaces the whole GeoTime table with geoTimeRows (lists in geoTimeColumns order) in one bulk insert and one commit, then rebuilds the GeoTimeIndex
+	db.session.execute(GeoTime.__table__.delete())
+	db.session.execute(GeoTime.__table__.insert(), [dict(zip(geoTimeColumns, geoTimeRow)) for geoTimeRow in geoTimeRows])
+	db.session.commit()
+	buildGeoTimeIndex()
+	resetHomePage()
+
+def parseGeoTimeRecords(paleobiodbRecordsJson):
+	# PBDB intervals/list.json records -> GeoTime rows. Top-level intervals have no pid, so their parent_no is None.
+	geoTimeRows = []
 	for line in paleobiodbRecordsJson:
 		interval_no = int(str(line['oid']).strip('int:'))
-		scale_level = int(line['lvl'])
 		if ('nam' in line):
 			interval_name = str(line['nam'])
-		elif ('oei' in line):
-			interval_name = str(line['oei'])
-		color = str(line['col'])
-		max_ma = float(line['eag'])
-		min_ma = float(line['lag'])
+		else:
+			interval_name = str(line.get('oei'))
 		if ('pid' in line):
 			parent_no = int(str(line['pid']).strip('int:'))
-		newGeoTime = GeoTime(interval_no, scale_level, interval_name, color, max_ma, min_ma, parent_no)
-		db.session.add(newGeoTime)
-		db.session.commit()
-		print(interval_name + " " + str(interval_no) + " " + str(parent_no))
+		else:
+			parent_no = None
+		geoTimeRows.append([interval_no, int(line['lvl']), interval_name, str(line['col']), float(line['eag']), float(line['lag']), parent_no])
+	return geoTimeRows
 
+def fetchGeoTimeRows():
+	# Downloads the current timescale from PBDB
+	paleobiodbResponse = paleobiodbSession.get(app.config['PALEOBIODB_BASE_URL'] + '/intervals/list.json?scale=1', timeout=app.config['PBDB_FETCH_TIMEOUT'])
+	paleobiodbResponse.raise_for_status()
+	return parseGeoTimeRecords(paleobiodbResponse.json()['records'])
 
+def readGeoTimeRows(path):
+	# The timescale from a saved intervals/list.json?scale=1 response, such as the benchmark's recorded intervals.json.gz
+	with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as responseFile:
+		return parseGeoTimeRecords(json.loads(responseFile.read().decode('UTF-8'))['records'])
 
-def clear_db():
-	allFossils = Fossil.query.all()
-	for fossilInstance in allFossils:
-		db.session.delete(fossilInstance)
-		db.session.commit()
+def getGeoTimeChecksum(geoTimeRows):
+	return hashlib.sha256(json.dumps(geoTimeRows, separators=(',', ':')).encode('UTF-8')).hexdigest()
+
+def readGeoTimeSnapshot(path):
+	# The bundled timescale: {version, fetched_at, source, sha256, columns, intervals}. Raises ValueError if the intervals don't match their checksum.
+	with open(path, encoding='UTF-8') as snapshotFile:
+		snapshot = json.load(snapshotFile)
+	if (getGeoTimeChecksum(snapshot['intervals']) != snapshot['sha256']):
+		raise ValueError("Timescale snapshot " + path + " is corrupt (checksum mismatch)")
+	return snapshot
+
+def writeGeoTimeSnapshot(path, geoTimeRows, version, source):
+	snapshot = {'version': version, 'fetched_at': time.time(), 'source': source, 'sha256': getGeoTimeChecksum(geoTimeRows), 'columns': geoTimeColumns, 'intervals': geoTimeRows}
+	with open(path + '.tmp', 'w', encoding='UTF-8') as snapshotFile:
+		snapshotFile.write(json.dumps(snapshot, separators=(',', ':')).replace('],[', '],\n['))
+	os.replace(path + '.tmp', path) # Never leaves a half-written snapshot behind
+	return snapshot
+
+def loadGeoTimeSnapshot():
+	# Startup: fills the GeoTime table from the bundled snapshot, with no network access
+	snapshot = readGeoTimeSnapshot(app.config['GEOTIME_SNAPSHOT'])
+	create_GeoTime_objects(snapshot['intervals'])
+	return snapshot
+
+@app.cli.command('refresh-timescale')
+@click.option('--force', is_flag=True, help='Download even if the snapshot is younger than GEOTIME_SNAPSHOT_MAX_AGE.')
+@click.option('--from-file', 'responsePath', default=None, help='Read the intervals from a saved intervals/list.json?scale=1 response (optionally gzipped) instead of downloading them.')
+def refreshTimescaleCommand(force, responsePath):
+	# Re-downloads the timescale from PBDB when the snapshot is stale. The snapshot only gets a new version if the intervals actually changed. A missing or unreadable snapshot counts as stale, version 0, and is written afresh.
+	path = app.config['GEOTIME_SNAPSHOT']
+	try:
+		snapshot = readGeoTimeSnapshot(path)
+	except (OSError, ValueError, KeyError) as error: # Missing, not JSON, no checksum, or a checksum mismatch
+		click.echo("Timescale snapshot %s can't be used (%s); rewriting it." % (path, error))
+		snapshot = {'version': 0, 'fetched_at': 0.0, 'source': None, 'sha256': None}
+	snapshotAge = time.time() - snapshot['fetched_at']
+	if (snapshotAge < app.config['GEOTIME_SNAPSHOT_MAX_AGE']) and not force:
+		click.echo("Timescale snapshot version %d is %.0f days old; not refreshing (use --force)." % (snapshot['version'], snapshotAge / 86400))
+		return
+	if (responsePath != None):
+		geoTimeRows = readGeoTimeRows(responsePath)
+		source = os.path.basename(responsePath)
+	else:
+		geoTimeRows = fetchGeoTimeRows()
+		source = app.config['PALEOBIODB_BASE_URL'] + '/intervals/list.json?scale=1'
+	if (getGeoTimeChecksum(geoTimeRows) == snapshot['sha256']):
+		writeGeoTimeSnapshot(path, geoTimeRows, snapshot['version'], snapshot['source'])
+		click.echo("Timescale unchanged (version %d, %d intervals)." % (snapshot['version'], len(geoTimeRows)))
+		return
+	snapshot = writeGeoTimeSnapshot(path, geoTimeRows, snapshot['version'] + 1, source)
+	db.create_all()
+	create_GeoTime_objects(geoTimeRows)
+	click.echo("Timescale updated to version %d (%d intervals)." % (snapshot['version'], len(geoTimeRows)))
+
+
+def clear_db(searchId):
+	delete_search_results(searchId)
+	db.session.commit()
+
+def delete_search_results(searchId):
+	# Removes one search's fossils, their R*Tree entries and its SearchRun, one DELETE statement each. The caller commits.
+	if hasSpatialIndex():
+		db.session.execute(text('delete from fossil_rtree where id in (select id from fossil where search_id = :searchId)'), {'searchId': searchId})
+	Fossil.query.filter_by(search_id=searchId).delete()
+	SearchRun.query.filter_by(id=searchId).delete()
+
+def expire_old_searches():
+	# Deletes every result set older than RESULT_TTL seconds, plus any fossils left without a SearchRun
+	expiredIds = db.session.execute(select(SearchRun.id).where(SearchRun.created_at < time.time() - app.config['RESULT_TTL'])).scalars().all()
+	expiredIds += db.session.execute(select(Fossil.search_id).distinct().where(Fossil.search_id.not_in(select(SearchRun.id)))).scalars().all()
+	for searchId in expiredIds:
+		delete_search_results(searchId)
+	db.session.commit()
+	return len(expiredIds)
+
+resultExpiryThread = None
 
+def startResultExpiry():
+	# Starts (once per process) a daemon thread that runs expire_old_searches() every RESULT_EXPIRY_INTERVAL seconds
+	global resultExpiryThread
+	if resultExpiryThread != None:
+		return
+	def expireForever():
+		while True:
+			time.sleep(app.config['RESULT_EXPIRY_INTERVAL'])
+			try:
+				with app.app_context():
+					expire_old_searches()
+			except Exception as error:
+				app.logger.warning("Result expiry failed: %s", error)
+	resultExpiryThread = threading.Thread(target=expireForever, daemon=True)
+	resultExpiryThread.start()
 
+@app.before_request
+def ensureResultExpiry():
+	startResultExpiry()
+
+def refresh_spatial_index(searchId, connection=None):
+	# Adds one search's fossils to fossil_rtree with a single INSERT ... SELECT, on the session or on the given connection. The caller commits.
+	if (connection == None):
+		connection = db.session
+	if hasSpatialIndex(connection):
+		connection.execute(text('insert into fossil_rtree select id, lat, lat, lng, lng from fossil where search_id = :searchId and lat is not null and lng is not null'), {'searchId': searchId})
+
+def fossilsInBox(searchId, latmin, latmax, lngmin, lngmax):
+	# A search's stored fossils inside a lat/lng box. A box with lngmin > lngmax wraps across the antimeridian.
+	if (lngmin > lngmax):
+		return fossilsInBox(searchId, latmin, latmax, lngmin, 180.0) + fossilsInBox(searchId, latmin, latmax, -180.0, lngmax)
+	if hasSpatialIndex(): # The R*Tree stores float32 boxes, rounded outwards, so a point on the box's edge can stick out of it: candidates are the boxes that overlap, and the real lat/lng columns decide
+		boxIds = text('select id from fossil_rtree where maxLat >= :latmin and minLat <= :latmax and maxLng >= :lngmin and minLng <= :lngmax').bindparams(latmin=latmin, latmax=latmax, lngmin=lngmin, lngmax=lngmax).columns(id=db.Integer)
+		return loadFossilRecords(searchId, Fossil.id.in_(boxIds), Fossil.lat.between(latmin, latmax), Fossil.lng.between(lngmin, lngmax))
+	return loadFossilRecords(searchId, Fossil.lat.between(latmin, latmax), Fossil.lng.between(lngmin, lngmax))
+
+def fossilsInRadius(searchId, centerLat, centerLng, radiusKm):
+	# Stored fossils within radiusKm (great-circle distance) of a point: an R*Tree box query narrows the candidates, then haversine distance decides
+	latDelta = radiusKm / kmPerDegree
+	latmin = max(centerLat - latDelta, -90.0)
+	latmax = min(centerLat + latDelta, 90.0)
+	if (latmin <= -90.0) or (latmax >= 90.0): # The circle covers a pole, so every longitude is in range
+		lngmin, lngmax = -180.0, 180.0
+	else:
+		lngDelta = min(latDelta / math.cos(math.radians(max(abs(latmin), abs(latmax)))), 180.0)
+		lngmin = ((centerLng - lngDelta + 180.0) % 360.0) - 180.0
+		lngmax = ((centerLng + lngDelta + 180.0) % 360.0) - 180.0
+		if (lngDelta >= 180.0):
+			lngmin, lngmax = -180.0, 180.0
+	return [fossil for fossil in fossilsInBox(searchId, latmin, latmax, lngmin, lngmax) if haversineKm(centerLat, centerLng, fossil.lat, fossil.lng) <= radiusKm]
+
+kmPerDegree = 111.195 # Great-circle km per degree, on a sphere of radius 6371 km
+
+def haversineKm(lat1, lng1, lat2, lng2):
+	lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+	a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+	return 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
+
+
+
+# The landing page only changes when the timescale is reloaded, so its content (home_fragment.html) is rendered once per load. create_GeoTime_objects() drops it via resetHomePage().
+homePage = None
+homePageLock = threading.Lock()
+
+def getHomeGeoTimes():
+	# The timescale rows home_fragment.html lists, with their labels worked out here rather than per row in the template
+	homeGeoTimes = []
+	for line in GeoTime.query.order_by(GeoTime.min_ma,GeoTime.scale_level).all():
+		if (line.max_ma < 1):
+			ageScale, ageUnit = 1000, 'thousand'
+		else:
+			ageScale, ageUnit = 1, 'million'
+		if (line.min_ma == 0):
+			timelineAges = 'present-%s %s years ago' % (round(line.max_ma*ageScale,1), ageUnit)
+		else:
+			timelineAges = '%s-%s %s years ago' % (round(line.min_ma*ageScale,1), round(line.max_ma*ageScale,1), ageUnit)
+		homeGeoTimes.append({'interval_name': line.interval_name, 'color': line.color, 'scale_level': line.scale_level, 'max_ma': line.max_ma,
+			'divisionName': timeScaleDivisionNames.get(line.scale_level), 'radioAges': '%s-%s' % (round(line.max_ma,1), round(line.min_ma,1)), 'timelineAges': timelineAges,
+			'inRadioList': (1 < line.scale_level < 4) and (line.max_ma < 550), 'inTimeline': line.scale_level < 6})
+	return homeGeoTimes
+
+def getHomePage(withBody=True):
+	# The cached landing page: its fragment and, unless withBody is False, the whole page's body and ETag, each built once under homePageLock so no request sees one without the other. The body is left out while the request has flashed messages, as rendering it would take them into the shared page.
+	global homePage
+	with homePageLock:
+		if (homePage == None):
+			homePage = {'fragment': Markup(render_template('home_fragment.html', taxonRadioButtonList=taxonRadioButtonList, homeGeoTimes=getHomeGeoTimes())), 'body': None, 'etag': None, 'lastModified': int(time.time())}
+		if withBody and (homePage['body'] == None):
+			body = render_template('home.html', homeFragment=homePage['fragment']).encode('UTF-8')
+			homePage['etag'] = hashlib.sha1(body).hexdigest()
+			homePage['body'] = body
+		return homePage
+
+def resetHomePage():
+	global homePage
+	with homePageLock:
+		homePage = None
 
 @app.route('/')
 def start_here():
-	taxonRadioButtonList = getTaxonRadioButtonList()
-	allGeoTimes = GeoTime.query.order_by(GeoTime.min_ma,GeoTime.scale_level).all()
-	return render_template('home.html', searchresults=None, taxonRadioButtonList=taxonRadioButtonList,allGeoTimes=allGeoTimes,getTimeScaleDivisionName=getTimeScaleDivisionName,round=round)
+	if ('_flashes' in session): # A message to show (e.g. after a failed search) makes this one response different, so it is rendered around the cached content
+		return render_template('home.html', homeFragment=getHomePage(withBody=False)['fragment'])
+	page = getHomePage()
+	# The ETag comes from the content, so it is the same in every worker process and across restarts; browsers and proxies revalidate each time and usually get a 304
+	response = app.response_class(page['body'], mimetype='text/html')
+	response.set_etag(page['etag'])
+	response.last_modified = page['lastModified']
+	response.cache_control.no_cache = True
+	return response.make_conditional(request)
 
 def getTaxonRadioButtonList():
-	#('id', 'value', 'displayname', 'indent','searchterm')
-	taxonRadioButtonList = [
+	return taxonRadioButtonList
+
+#('id', 'value', 'displayname', 'indent','searchterm')
+taxonRadioButtonList = [
 		('chkDinosAndFriends', 'dinosaursandfriends', 'Dinosaurs and their close relatives',0,'saurischia,ornithischia,plesiosauria,ichthyosauria,pterosauria'),
 		('chkDinos', 'dinosaurs', 'All dinosaurs',1,'saurischia,ornithischia'),
 		('chkSauropods', 'sauropods', 'Sauropods (Brachiosaurus, etc.)',2,'sauropoda'),
@@ -131,155 +519,478 @@ def getTaxonRadioButtonList():
 		('chkTrilobites', 'trilobites', 'Trilobites',0,'trilobita'),
 		('chkChordates', 'chordates', 'All chordates (animals with backbones)',0,'chordata'),
 		]
-	return taxonRadioButtonList
 
 
-def paleoSearch(paleobiodbURL):
-	clear_db() # Cleans out old search results so that the new search begins on a fresh slate
-	paleobiodbResponse = urllib.request.urlopen(paleobiodbURL)
-	paleobiodbResponseJSONString = paleobiodbResponse.read().decode('UTF-8')
-	paleobiodbResponseJson = json.loads(paleobiodbResponseJSONString)
-	if ('warnings' in paleobiodbResponseJson): # Catches problems like typos in dinosaur names, i.e. "tircratops"
-		warning = paleobiodbResponseJson['warnings'][0]
-		print(warning)
-		ResultsFound = None
-	else:
-		warning = None
-		paleobiodbRecordsJson = paleobiodbResponseJson['records']
-		ResultsFound = paleobiodbResponseJson['records_found']
-		for taxonResult in paleobiodbRecordsJson:
-			filterPaleobiodbResponseJson(taxonResult)
-	allFossils = Fossil.query.all()
-	markers = get_markers(allFossils)
-	return {'ResultsFound': ResultsFound, 'markers': markers, 'allFossils': allFossils, 'warning': warning}
-
-def filterPaleobiodbResponseJson(taxonResult):
-	lat = float(taxonResult['lat'])
-	lng = float(taxonResult['lng'])
-	if ('tna' in taxonResult):
-		taxonName = str(taxonResult['tna'])
-	else:
-		taxonName = None
-	if ('phl' in taxonResult):
-		trank_phylum = str(taxonResult['phl'])
-	else:
-		trank_phylum = None
-	if ('cll' in taxonResult):
-		trank_class = str(taxonResult['cll'])
-	else:
-		trank_class = None
-	if ('odl' in taxonResult):
-		trank_order = str(taxonResult['odl'])
-	else:
-		trank_order = None
-	if ('fml' in taxonResult):
-		trank_family = str(taxonResult['fml'])
-	else:
-		trank_family = None
-	if ('gnl' in taxonResult):
-		trank_genus = str(taxonResult['gnl'])
-	else:
-		trank_genus = None
-	if ('cc2' in taxonResult):
-		nation = str(taxonResult['cc2'])
-	else:
-		nation = None
-	if ('stp' in taxonResult):
-		state = str(taxonResult['stp'])
-	else:
-		state = None
-	if ('cny' in taxonResult):
-		county = str(taxonResult['cny'])
-	else:
-		county = None
-	if ('oei' in taxonResult):
-		geologicAge = str(taxonResult['oei'])
-	else:
-		geologicAge = None
-	if ('env' in taxonResult):
-		paleoenv = str(taxonResult['env'])
-	else:
-		paleoenv = None
-	if ('eag' in taxonResult):
-		max_ma = float(taxonResult['eag'])
-	else:
-		max_ma = None
-	if ('lag' in taxonResult):
-		min_ma = float(taxonResult['lag'])
-	else:
-		min_ma = None
-	if ('ggc' in taxonResult):
-		geocomments = str(taxonResult['ggc'])
-	else:
-		geocomments = None
-	create_fossil_objects(lat, lng, taxonName, trank_phylum, trank_class, trank_order, trank_family, trank_genus, nation, state, county, geologicAge, paleoenv, max_ma, min_ma, geocomments)  # Creates a Fossil object
-
-def create_fossil_objects(lat,lng,taxonName,trank_phylum,trank_class,trank_order,trank_family,trank_genus,nation,state,county,geologicAge,paleoenv,max_ma,min_ma,geocomments):
-	# This takes the raw JSON variables from paleobiodbRecordsJson, created in paleoSearch(), and creates a set of Fossil objects for mapping, etc.
-	coordinatePairs = [lat, lng]  # lat/long
-	fossilName = getfossilName(taxonName, trank_phylum, trank_class, trank_order, trank_family,trank_genus)  # This is the fossil's display name
-	taxonomy = getTaxonomy(trank_phylum, trank_class, trank_order, trank_family,trank_genus)  # This is the fossil's tree-of-life designations
-	location = getLocation(nation, state, county, geocomments)
-	age = getGeologicAge(geologicAge, max_ma, min_ma)
-	newFossil = Fossil(fossilName, taxonomy, location, age, coordinatePairs, paleoenv, geocomments)
-	db.session.add(newFossil)
-	db.session.commit()
+# Per-search counters, filled in by paleoSearch() and the statement listener below. They are kept per thread, so concurrent searches each count only their own work.
+searchStatsLocal = threading.local()
 
+# Guards the stats of one search that its fetch threads update together: the counters bumped by openPaleobiodbURL() and the spans added by recordSpan()
+searchStatsLock = threading.Lock()
 
+def resetSearchStats():
+	searchStatsLocal.stats = {'upstreamFetches': 0, 'cacheHits': 0, 'dbStatements': 0, 'mirrorHits': 0, 'ingestedRows': 0, 'spans': {}}
+	return searchStatsLocal.stats
 
-def getNationFromISO3166(nation):
-	if (nation == None):
-		nation = "Location undisclosed"
-	elif (nation == 'UK'):
-		nation = "Great Britain"
-	elif (nation == 'TU'):
-		nation = "Tuva (Russian Federation)"
-	elif (nation == 'AA'):
-		nation = "Antarctica"
-	else:
-		thisIsTheNation = pycountry.countries.get(alpha2=nation)
-		nation = thisIsTheNation.name
-		print (nation)
-	return nation
-
-def getLocation(nation,state,county,geocomments):
-	if (nation == None) and (state == None) and (county == None):
-		if (geocomments != None):
-			location = geocomments
+def getSearchStats():
+	if not hasattr(searchStatsLocal, 'stats'):
+		return resetSearchStats()
+	return searchStatsLocal.stats
+
+@contextlib.contextmanager
+def timingSpan(stage, searchStats=None):
+	# Times one stage (geocode, fetch, parse, ingest, ageLabels, store, markers, render...): the seconds go into the /metrics histogram and, for a search, are added up in its stats['spans']. Fetch and parse run on several threads at once, so their spans are summed thread time rather than wall time.
+	spanStart = time.perf_counter()
+	try:
+		yield
+	finally:
+		recordSpan(stage, time.perf_counter() - spanStart, searchStats)
+
+def recordSpan(stage, elapsed, searchStats=None):
+	# Adds elapsed seconds to a stage, for time measured piecemeal rather than by timingSpan()
+	metrics.observe('dinosaur_stage_seconds', elapsed, stage=stage)
+	if (searchStats != None):
+		with searchStatsLock:
+			searchStats['spans'][stage] = searchStats['spans'].get(stage, 0.0) + elapsed
+
+def countSearchStat(statName, searchStats):
+	# Adds one to a counter of searchStats, which may be shared with other fetch threads of the same search
+	with searchStatsLock:
+		searchStats[statName] += 1
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def countDbStatement(conn, cursor, statement, parameters, context, executemany):
+	getSearchStats()['dbStatements'] += 1
+
+class SearchCancelled(Exception):
+	# Raised inside paleoSearch() once the search's cancel event is set (see /cancel)
+	pass
+
+def paleoSearch(paleobiodbURL, searchId, cancelEvent=None, progress=None, mirrorQuery=None, searchStats=None):
+	# One call = one full search: download, parse, store and build markers. The results are stored under searchId, as a new SearchRun. Setting cancelEvent stops the download and raises SearchCancelled, leaving nothing stored. The progress dict (see SearchJob) is kept up to date as the search runs. With a mirrorQuery (see getMirrorQuery()) the records come from the local mirror rather than from paleobiodbURL. Returns everything the results page needs, plus counts of upstream fetches and DB statements and per-stage timings, so regressions are easy to spot; pass searchStats (from resetSearchStats()) to include work done before the call, such as geocoding.
+	if (searchStats == None):
+		searchStats = resetSearchStats()
+	searchStart = time.perf_counter()
+	if (cancelEvent == None):
+		cancelEvent = threading.Event()
+	if (progress == None):
+		progress = newSearchProgress()
+	responseHeader = {} # Gets records_found, warnings etc. from the first page
+	with db.engine.connect() as connection: # Holds the search's staging table (see ingestPaleobiodbRecords()); nothing reaches the shared tables until store_staged_fossils()
+		if (mirrorQuery != None):
+			searchStats['mirrorHits'] += 1
+			paleobiodbRecords = iterMirrorRecords(mirrorQuery, responseHeader, cancelEvent, progress)
 		else:
-			location = "Location undisclosed"
+			paleobiodbRecords = iterPaleobiodbPages(paleobiodbURL, responseHeader, searchStats, cancelEvent, progress)
+		searchStats['ingestedRows'] = ingestPaleobiodbRecords(connection, paleobiodbRecords, responseHeader, searchId, progress=progress)
+		if ('warnings' in responseHeader): # Catches problems like typos in dinosaur names, i.e. "tircratops"
+			warning = responseHeader['warnings'][0]
+			app.logger.info("PBDB warning: %s", warning)
+			ResultsFound = None # Whatever was staged before the warning turned up is dropped with the staging table
+		else:
+			warning = None
+			ResultsFound = responseHeader.get('records_found')
+			with timingSpan('store', searchStats):
+				store_staged_fossils(connection, searchId)
+	with timingSpan('markers', searchStats):
+		allFossils = loadFossilRecords(searchId)
+		markers = get_markers(allFossils)
+		progress['markersBuilt'] = len(markers)
+		storeMarkerClusterIndex(searchId, MarkerClusterIndex(markers, app.config['MARKER_CLUSTER_MAX_ZOOM'])) # Precomputed now, so the map's marker requests are cheap
+	searchStats['spans']['search'] = time.perf_counter() - searchStart
+	for counterName, statName in (('dinosaur_search_records_total', 'ingestedRows'), ('dinosaur_search_db_statements_total', 'dbStatements'), ('dinosaur_search_upstream_fetches_total', 'upstreamFetches'), ('dinosaur_search_cache_hits_total', 'cacheHits'), ('dinosaur_search_mirror_hits_total', 'mirrorHits')):
+		metrics.inc(counterName, searchStats[statName])
+	return {'ResultsFound': ResultsFound, 'markers': markers, 'allFossils': allFossils, 'warning': warning, 'stats': dict(searchStats)}
+
+def iterPaleobiodbPages(paleobiodbURL, responseHeader, searchStats, cancelEvent, progress, useCache=True):
+	# Fetches a PBDB query as limit/offset pages of PBDB_PAGE_SIZE records, yielding the records in PBDB order as they are parsed. The first page is streamed on its own (its records_found says how many more there are); the rest are downloaded concurrently by PBDB_FETCH_THREADS threads, each passing its page on through a queue that holds at most PBDB_FETCH_BUFFER records, so no page is ever held whole in memory: a thread whose page isn't wanted yet stops reading from its socket until the search catches up. useCache=False goes straight to PBDB (see openPaleobiodbURL()).
+	pageSize = app.config['PBDB_PAGE_SIZE']
+	firstPageRecords = 0
+	for record in iterPaleobiodbPage(getPagedURL(paleobiodbURL, 0, pageSize), responseHeader, searchStats, cancelEvent, useCache): # responseHeader gets records_found and any warnings as soon as they are parsed, ahead of the records
+		firstPageRecords += 1
+		progress['recordsFetched'] += 1
+		yield record
+	recordsFound = int(responseHeader.get('records_found', 0))
+	progress['recordsFound'] = recordsFound
+	if ('warnings' in responseHeader) or (firstPageRecords < pageSize) or (recordsFound <= pageSize):
+		return
+	fetchThreads = app.config['PBDB_FETCH_THREADS']
+	pageOffsets = iter(range(pageSize, recordsFound, pageSize))
+	stopEvent = threading.Event()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=fetchThreads) as fetchPool:
+		pageQueues = collections.deque()
+		def submitPages(count):
+			for offset in itertools.islice(pageOffsets, count):
+				pageQueue = queue.Queue(maxsize=max(1, app.config['PBDB_FETCH_BUFFER'] // pageChunkSize))
+				fetchPool.submit(fetchPaleobiodbPage, getPagedURL(paleobiodbURL, offset, pageSize), pageQueue, searchStats, cancelEvent, stopEvent, useCache)
+				pageQueues.append(pageQueue)
+		try:
+			submitPages(fetchThreads)
+			while pageQueues:
+				pageQueue = pageQueues.popleft()
+				submitPages(1)
+				while True:
+					pageChunk = pageQueue.get()
+					if (pageChunk == None):
+						break
+					if isinstance(pageChunk, BaseException):
+						raise pageChunk
+					if cancelEvent.is_set():
+						raise SearchCancelled()
+					progress['recordsFetched'] += len(pageChunk)
+					yield from pageChunk
+		finally: # Done, or stopped early (warning, cancel or error): the fetch threads give up instead of waiting for their pages to be taken
+			stopEvent.set()
+
+pageChunkSize = 100 # Records a fetch thread hands over at a time
+
+def fetchPaleobiodbPage(pageURL, pageQueue, searchStats, cancelEvent, stopEvent, useCache=True):
+	# Runs on a fetch thread: puts one page's records into pageQueue pageChunkSize at a time as they are parsed, then None, or the exception that stopped it. Returns early once stopEvent is set.
+	def put(item):
+		while not stopEvent.is_set():
+			try:
+				pageQueue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+	if stopEvent.is_set(): # Queued behind other pages, and no longer wanted
+		return
+	pageRecords = iterPaleobiodbPage(pageURL, {}, searchStats, cancelEvent, useCache)
+	try:
+		pageChunk = []
+		for record in pageRecords:
+			pageChunk.append(record)
+			if (len(pageChunk) >= pageChunkSize):
+				if not put(pageChunk):
+					return
+				pageChunk = []
+		if pageChunk and not put(pageChunk):
+			return
+		put(None)
+	except Exception as error:
+		put(error)
+	finally:
+		pageRecords.close()
+
+def iterMirrorRecords(mirrorQuery, responseHeader, cancelEvent, progress):
+	# The mirror's answer to a search, in the same shape as iterPaleobiodbPages(); records_found is only known once every record has been read
+	recordsFetched = 0
+	for record in occurrenceMirror.query(**mirrorQuery):
+		recordsFetched += 1
+		if (recordsFetched % 1000 == 0):
+			if cancelEvent.is_set():
+				raise SearchCancelled()
+			progress['recordsFetched'] = recordsFetched
+		yield record
+	progress['recordsFetched'] = progress['recordsFound'] = recordsFetched
+	responseHeader['records_found'] = recordsFetched
+
+def getMirrorQuery(searchTaxon, latLongAndRadius, searchGeoTime):
+	# Arguments for OccurrenceMirror.query() if this search can be answered from the mirror, otherwise None: the taxon must be a synced, recently refreshed preset, the interval one we know the age range of, and the box must not cross the antimeridian
+	if (occurrenceMirror == None):
+		return None
+	preset = None
+	for item in getTaxonRadioButtonList():
+		if (searchTaxon == item[4]):
+			preset = item[1]
+	if (preset == None) or not occurrenceMirror.canServe(preset, app.config['PBDB_MIRROR_MAX_AGE']):
+		return None
+	box = latLongAndRadius.get('box')
+	if (box != None) and ((box[2] < -180) or (box[3] > 180)):
+		return None
+	if (searchGeoTime == 'None') or (searchGeoTime == 'allpasteras'):
+		ageRange = None
+	elif (searchGeoTime == 'precambrian'):
+		ageRange = (float('inf'), 541)
 	else:
-		if (nation == 'Great Britain'):
-			if (state == None):
-				location = 'Great Britain'
-			elif (state == 'England' or 'Scotland' or 'Wales' or 'Northern Ireland'):
-				if (county == None):
-					location = state
-				else:
-					location = (county + ", " + state)
-			else:
-				if (county == None):
-					location = (state + ", " + nation)
-				else:
-					location = (county + ", " + state + ", " + nation)
-		elif (nation == 'United States') or (nation == 'US'):
-			if (county == None):
-				location = state
-			else:
-				location = (county + ", " + state)
-		elif (nation == None):
-			if (state != None):
-				if (county == None):
-					location = state
-				else:
-					location = county + ", " + state
-		elif (state == None):
-			location = nation
-		elif (county == None):
-			location = (state + ", " + nation)
+		interval = getGeoTimeIndex().byName.get(searchGeoTime.lower())
+		if (interval == None):
+			return None
+		ageRange = (interval.max_ma, interval.min_ma)
+	return {'preset': preset, 'box': box, 'ageRange': ageRange}
+
+def syncMirrorPreset(preset, baseName, full=False):
+	# Brings one taxon preset's occurrences in the mirror up to date. After the first (full) sync only records modified on PBDB since the last sync are downloaded; a full sync also drops occurrences PBDB no longer returns. Returns the number of records downloaded.
+	lastSync = occurrenceMirror.lastSync(preset)
+	full = full or (lastSync == None)
+	syncedAt = time.time()
+	paleobiodbURL = app.config['PALEOBIODB_BASE_URL'] + '/occs/list.json?rowcount&base_name=%s&show=full,crmod' % urllib.parse.quote(baseName, safe=',')
+	if not full:
+		paleobiodbURL += '&occs_modified_after=' + urllib.parse.quote(lastSync[1])
+	responseHeader = {}
+	paleobiodbRecords = iterPaleobiodbPages(paleobiodbURL, responseHeader, resetSearchStats(), threading.Event(), newSearchProgress(), useCache=False) # Always PBDB's current answer: a cached (perhaps stale) page would lose changes the sync is meant to pick up
+	recordCount = occurrenceMirror.store(preset, paleobiodbRecords, syncedAt, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(syncedAt)), full)
+	if ('warnings' in responseHeader):
+		app.logger.warning("PBDB warning while syncing %s: %s", preset, responseHeader['warnings'])
+	return recordCount
+
+@app.cli.command('sync-mirror')
+@click.argument('presets', nargs=-1)
+@click.option('--full', is_flag=True, help='Download every record again instead of only those modified since the last sync.')
+def syncMirrorCommand(presets, full):
+	# Syncs the named taxon presets (the radio button values, e.g. "dinosaurs"), or all of them
+	if (occurrenceMirror == None):
+		raise click.ClickException('PBDB_MIRROR_PATH is not set.')
+	for item in getTaxonRadioButtonList():
+		if (not presets) or (item[1] in presets):
+			syncStart = time.perf_counter()
+			recordCount = syncMirrorPreset(item[1], item[4], full)
+			click.echo("%s: %d records in %.1fs" % (item[1], recordCount, time.perf_counter() - syncStart))
+
+def getPagedURL(paleobiodbURL, offset, limit):
+	return paleobiodbURL + '&limit=%d&offset=%d' % (limit, offset)
+
+def iterPaleobiodbPage(pageURL, pageHeader, searchStats, cancelEvent, useCache=True):
+	# Yields one page's records as they are parsed off the socket, retrying up to PBDB_FETCH_RETRIES times with exponential backoff; a retry skips the records already yielded, so each comes out once. pageHeader gets the page's other top-level keys. The time spent in here (not in the caller between records) goes into the 'fetch' span while reading from the network and the 'parse' span otherwise.
+	retries = app.config['PBDB_FETCH_RETRIES']
+	yieldedRecords = 0
+	for attempt in range(retries + 1):
+		if cancelEvent.is_set():
+			raise SearchCancelled()
+		try:
+			pageStart = time.perf_counter()
+			pageResponse = openPaleobiodbURL(pageURL, searchStats, useCache)
+			timedResponse = TimedReader(pageResponse, time.perf_counter() - pageStart) # Counting the wait for PBDB to start answering
+			pageSeconds = timedResponse.seconds
+			pageRecords = iterPaleobiodbRecords(timedResponse, pageHeader)
+			parsedRecords = 0
+			try:
+				while True:
+					parseStart = time.perf_counter()
+					record = next(pageRecords, None)
+					pageSeconds += time.perf_counter() - parseStart
+					if (record == None):
+						break
+					parsedRecords += 1
+					if (parsedRecords > yieldedRecords):
+						yieldedRecords += 1
+						yield record
+			finally:
+				recordSpan('fetch', timedResponse.seconds, searchStats)
+				recordSpan('parse', pageSeconds - timedResponse.seconds, searchStats)
+				pageResponse.close() # Read to the end, or abandoned partway (error, or the caller stopped): either way its connection isn't left half-read
+			if isinstance(pageResponse, CachingReader):
+				pageResponse.commit() # Only now that the whole page has parsed does it go into the response cache
+			return
+		except (requests.RequestException, urllib3.exceptions.HTTPError, OSError, ValueError) as error: # urllib3 and socket errors are raised as they are (not as RequestExceptions) when the connection drops partway through the body
+			if (attempt == retries):
+				raise
+			app.logger.warning("Retrying %s after error: %s", pageURL, error)
+			cancelEvent.wait(app.config['PBDB_FETCH_BACKOFF'] * (2 ** attempt))
+
+def requestPaleobiodbURL(paleobiodbURL):
+	# Streams a PBDB URL over the pooled HTTP session; the result reads like a file
+	paleobiodbResponse = paleobiodbSession.get(paleobiodbURL, stream=True, timeout=app.config['PBDB_FETCH_TIMEOUT'])
+	paleobiodbResponse.raise_for_status()
+	paleobiodbResponse.raw.decode_content = True
+	return paleobiodbResponse.raw
+
+def readValidPaleobiodbURL(paleobiodbURL):
+	# The whole body of a PBDB URL, fetched from the network, raising ValueError if it doesn't parse as a PBDB response
+	paleobiodbBody = requestPaleobiodbURL(paleobiodbURL).read()
+	collections.deque(iterPaleobiodbRecords(io.BytesIO(paleobiodbBody), {}), maxlen=0)
+	return paleobiodbBody
+
+def openPaleobiodbURL(paleobiodbURL, searchStats=None, useCache=True):
+	# Returns a readable response for a PBDB URL: straight from the response cache when it has the query, otherwise from the network, collected as the caller reads it so it can be cached once the caller has checked it (CachingReader.commit()). useCache=False skips the cache both ways: nothing is read from it, stored in it or revalidated.
+	if (searchStats == None):
+		searchStats = getSearchStats()
+	if (paleobiodbCache == None) or not useCache:
+		countSearchStat('upstreamFetches', searchStats)
+		return requestPaleobiodbURL(paleobiodbURL)
+	cacheKey = normaliseQueryURL(paleobiodbURL)
+	cachedBody = paleobiodbCache.get(cacheKey, refetch=lambda: readValidPaleobiodbURL(paleobiodbURL))
+	if (cachedBody != None):
+		countSearchStat('cacheHits', searchStats)
+		return io.BytesIO(cachedBody)
+	countSearchStat('upstreamFetches', searchStats)
+	return CachingReader(requestPaleobiodbURL(paleobiodbURL), paleobiodbCache, cacheKey)
+
+def ingestPaleobiodbRecords(connection, paleobiodbRecords, responseHeader, searchId, batchSize=1000, progress=None):
+	# Turns PBDB records into Fossil rows of search searchId and stages them (see stage_fossil_columns()) batchSize at a time, so only one batch is ever held in memory. Staging only writes this connection's temp table, so other searches' writes never wait while this one downloads. Stops as soon as PBDB reports a warning. Returns the number of rows staged; store_staged_fossils() moves them into the fossil table.
+	create_staging_table(connection)
+	ingestedRows = 0
+	batchRecords = []
+	for taxonResult in paleobiodbRecords:
+		if ('warnings' in responseHeader):
+			break
+		batchRecords.append(taxonResult)
+		if len(batchRecords) >= batchSize:
+			with timingSpan('ingest', getSearchStats()):
+				stage_fossil_columns(connection, buildFossilColumns(batchRecords, searchId))
+			ingestedRows += len(batchRecords)
+			batchRecords = []
+			if (progress != None):
+				progress['recordsIngested'] = ingestedRows
+	if ('warnings' not in responseHeader):
+		with timingSpan('ingest', getSearchStats()):
+			stage_fossil_columns(connection, buildFossilColumns(batchRecords, searchId))
+		ingestedRows += len(batchRecords)
+		if (progress != None):
+			progress['recordsIngested'] = ingestedRows
+	return ingestedRows
+
+class TimedReader:
+	# Wraps a readable response and adds up the seconds spent in its read() calls, i.e. waiting on the network, so that time can be told apart from the parsing done between reads
+	def __init__(self, response, seconds=0.0):
+		self.response = response
+		self.seconds = seconds
+
+	def read(self, size=-1):
+		readStart = time.perf_counter()
+		try:
+			return self.response.read(size)
+		finally:
+			self.seconds += time.perf_counter() - readStart
+
+class PaleobiodbStream:
+	# Minimal pull tokenizer over a byte stream of JSON, used by iterPaleobiodbRecords(). Only the unconsumed tail of the text is kept in memory.
+	def __init__(self, paleobiodbResponse, chunkSize=65536):
+		self.paleobiodbResponse = paleobiodbResponse
+		self.chunkSize = chunkSize
+		self.decoder = json.JSONDecoder()
+		self.utf8 = codecs.getincrementaldecoder('UTF-8')()
+		self.buffer = ""
+		self.position = 0
+		self.finished = False
+
+	def fill(self):
+		# Drops the consumed text and appends the next chunk. Returns False once the stream is exhausted.
+		if self.finished:
+			return False
+		chunk = self.paleobiodbResponse.read(self.chunkSize)
+		if not chunk:
+			self.finished = True
+		self.buffer = self.buffer[self.position:] + self.utf8.decode(chunk, final=self.finished)
+		self.position = 0
+		return not self.finished
+
+	def peek(self):
+		# Returns the next non-whitespace character without consuming it
+		while True:
+			while (self.position < len(self.buffer)) and self.buffer[self.position] in ' \t\r\n':
+				self.position += 1
+			if self.position < len(self.buffer):
+				return self.buffer[self.position]
+			if not self.fill():
+				raise ValueError("Unexpected end of PaleoBioDB response")
+
+	def expect(self, character):
+		if self.peek() != character:
+			raise ValueError("Malformed PaleoBioDB response: expected %r at %r" % (character, self.buffer[self.position:self.position + 40]))
+		self.position += 1
+
+	def skip(self, character):
+		# Consumes character if it comes next; returns whether it did
+		if self.peek() == character:
+			self.position += 1
+			return True
+		return False
+
+	def value(self):
+		# Decodes one complete JSON value, reading more of the stream whenever the buffer ends part-way through it
+		self.peek()
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buffer, self.position)
+			except json.JSONDecodeError:
+				if self.fill():
+					continue
+				raise
+			if isinstance(value, (int, float)) and ((end == len(self.buffer)) or (self.buffer[end] in '.eE+-0123456789')) and self.fill(): # A bare number cut off by the end of the buffer may continue in the next chunk
+				continue
+			self.position = end
+			return value
+
+def iterPaleobiodbRecords(paleobiodbResponse, responseHeader):
+	# Parses a PBDB response ({"records_found": N, "warnings": [...], "records": [{...}, ...]}) incrementally, straight off the HTTP stream. Yields each entry of "records" as soon as it has been read; every other top-level key goes into responseHeader.
+	stream = PaleobiodbStream(paleobiodbResponse)
+	stream.expect('{')
+	if stream.skip('}'):
+		return
+	while True:
+		key = stream.value()
+		stream.expect(':')
+		if (key == 'records'):
+			stream.expect('[')
+			if not stream.skip(']'):
+				while True:
+					yield stream.value()
+					if not stream.skip(','):
+						stream.expect(']')
+						break
+		else:
+			responseHeader[key] = stream.value()
+		if not stream.skip(','):
+			stream.expect('}')
+			while stream.fill(): # Reads to the end of the stream, so that wrappers such as CachingReader see it finish
+				pass
+			return
+
+# Compact-vocabulary PBDB fields read by buildFossilColumns(), and the Fossil columns they become
+paleobiodbTextFields = (('tna', 'taxonName'), ('phl', 'trank_phylum'), ('cll', 'trank_class'), ('odl', 'trank_order'), ('fml', 'trank_family'), ('gnl', 'trank_genus'),
+	('cc2', 'nation'), ('stp', 'state'), ('cny', 'county'), ('oei', 'geologicAge'), ('env', 'paleoenv'), ('ggc', 'geocomments'))
+paleobiodbNumberFields = (('lat', 'lat'), ('lng', 'lng'), ('eag', 'max_ma'), ('lag', 'min_ma'))
+fossilInsertColumns = ('search_id', 'fossilName', 'location', 'age', 'paleoenv', 'geocomments', 'nation', 'state', 'county', 'geologicAge', 'max_ma', 'min_ma', 'lat', 'lng')
+
+def buildFossilColumns(paleobiodbRecords, searchId):
+	# Turns a whole batch of PBDB records into Fossil columns: returns {column: [value per record]}, with each fossil's taxonomy dict (see getTaxonomy()) under 'taxonomy'. Each field is pulled out of the batch once, and every derived label is worked out once per distinct taxon, locality or age range rather than once per record (ages by labelGeologicAges()).
+	columns = {'search_id': itertools.repeat(searchId, len(paleobiodbRecords))}
+	for field, name in paleobiodbTextFields:
+		columns[name] = [None if value == None else str(value) for value in [record.get(field) for record in paleobiodbRecords]]
+	for field, name in paleobiodbNumberFields:
+		columns[name] = [None if value == None else float(value) for value in [record.get(field) for record in paleobiodbRecords]]
+	taxonKeys = list(zip(columns['taxonName'], columns['trank_phylum'], columns['trank_class'], columns['trank_order'], columns['trank_family'], columns['trank_genus']))
+	taxonLabels = {taxonKey: (getfossilName(*taxonKey), getTaxonomy(*taxonKey[1:])) for taxonKey in set(taxonKeys)}
+	columns['fossilName'] = [taxonLabels[taxonKey][0] for taxonKey in taxonKeys]
+	columns['taxonomy'] = [taxonLabels[taxonKey][1] for taxonKey in taxonKeys]
+	columns['location'] = getLocations(zip(columns['nation'], columns['state'], columns['county'], columns['geocomments']))
+	with timingSpan('ageLabels', getSearchStats()):
+		columns['age'] = labelGeologicAges((None, None) if geologicAge == None else (max_ma, min_ma) for geologicAge, max_ma, min_ma in zip(columns['geologicAge'], columns['max_ma'], columns['min_ma']))
+	return columns
+
+def buildFossilRow(paleobiodbRecord, searchId):
+	# The same columns for one record, worked out field by field through the per-row functions, as ingest did before buildFossilColumns(). Kept as the reference that tests/test_fossil_columns.py and "dinosaur_benchmark.py columns" compare buildFossilColumns() against.
+	fossilRow = {'search_id': searchId}
+	for field, name in paleobiodbTextFields:
+		if (field in paleobiodbRecord):
+			fossilRow[name] = str(paleobiodbRecord[field])
 		else:
-			location = (county + ", " + state + ", " + nation)
-	return location
+			fossilRow[name] = None
+	for field, name in paleobiodbNumberFields:
+		if (field in paleobiodbRecord):
+			fossilRow[name] = float(paleobiodbRecord[field])
+		else:
+			fossilRow[name] = None
+	fossilRow['fossilName'] = getfossilName(fossilRow['taxonName'], fossilRow['trank_phylum'], fossilRow['trank_class'], fossilRow['trank_order'], fossilRow['trank_family'], fossilRow['trank_genus'])
+	fossilRow['taxonomy'] = getTaxonomy(fossilRow['trank_phylum'], fossilRow['trank_class'], fossilRow['trank_order'], fossilRow['trank_family'], fossilRow['trank_genus'])
+	fossilRow['location'] = getLocation(fossilRow['nation'], fossilRow['state'], fossilRow['county'], fossilRow['geocomments'])
+	fossilRow['age'] = getGeologicAge(fossilRow['geologicAge'], fossilRow['max_ma'], fossilRow['min_ma'])
+	return fossilRow
+
+def create_staging_table(connection):
+	# The connection's own temp table of fossils waiting for store_staged_fossils(), with the taxon ranks in place of taxon_id
+	connection.exec_driver_sql('drop table if exists temp.fossil_staging') # Left over if the connection's last search failed
+	connection.exec_driver_sql('create temp table fossil_staging (%s)' % ', '.join(fossilInsertColumns + taxonColumnNames))
+
+def stage_fossil_columns(connection, fossilColumns):
+	# Adds the output of buildFossilColumns() to the connection's staging table (made by create_staging_table()) and commits. The columns are zipped into plain tuples and handed to the driver's executemany, skipping SQLAlchemy's per-row parameter processing; the driver takes the GIL back for every row, which is why this goes to a temp table that takes no lock on the database.
+	if fossilColumns['taxonomy']:
+		taxonomies = fossilColumns.pop('taxonomy')
+		for rank, name in zip(taxonRanks, taxonColumnNames):
+			fossilColumns[name] = [taxonomy[rank] or '' for taxonomy in taxonomies]
+		stagingColumns = fossilInsertColumns + taxonColumnNames
+		connection.exec_driver_sql('insert into temp.fossil_staging (%s) values (%s)' % (', '.join(stagingColumns), ', '.join('?' * len(stagingColumns))), list(zip(*[fossilColumns[name] for name in stagingColumns])))
+	connection.commit()
+
+def store_staged_fossils(connection, searchId):
+	# The search's only write to the shared tables, one short transaction: its SearchRun, any taxa the taxon table hasn't seen, the staged fossils with their taxon ids joined in, and their R*Tree entries. Each statement copies its rows inside SQLite in one step, so the write lock is never held while Python feeds rows in one at a time.
+	connection.execute(SearchRun.__table__.insert(), {'id': searchId, 'created_at': time.time()})
+	connection.exec_driver_sql('insert or ignore into taxon (%s) select distinct %s from temp.fossil_staging' % ((', '.join(taxonColumnNames),) * 2))
+	connection.exec_driver_sql('insert into fossil (%s, taxon_id) select %s, taxon.id from temp.fossil_staging join taxon using (%s) order by fossil_staging.rowid' % (', '.join(fossilInsertColumns), ', '.join('fossil_staging.' + name for name in fossilInsertColumns), ', '.join(taxonColumnNames)))
+	refresh_spatial_index(searchId, connection)
+	connection.exec_driver_sql('drop table temp.fossil_staging')
+	connection.commit()
 
 def getfossilName(taxonName,trank_phylum,trank_class,trank_order,trank_family,trank_genus):
 	if (trank_class == 'Trilobita'):
@@ -305,113 +1016,430 @@ def getTaxonomy(trank_phylum, trank_class, trank_order, trank_family, trank_genu
 	taxonomy = {'phylum': trank_phylum, 'class': trank_class, 'order': trank_order, 'family': trank_family, 'genus': trank_genus}
 	return taxonomy
 
+# Plain, session-independent copy of a GeoTime row, as held by GeoTimeIndex
+GeoTimeInterval = collections.namedtuple('GeoTimeInterval', ['interval_no', 'scale_level', 'interval_name', 'color', 'max_ma', 'min_ma', 'parent_no'])
+
+class GeoTimeIndex:
+	# In-memory interval index over the GeoTime table. For each scale level the intervals are kept sorted by min_ma, so the one containing a given age is found with a bisect; parent_no links walk up from there (age -> epoch -> period -> era -> eon).
+	def __init__(self, geoTimes):
+		self.byIntervalNo = {}
+		self.levels = {}
+		for geoTime in geoTimes:
+			interval = GeoTimeInterval(geoTime.interval_no, geoTime.scale_level, geoTime.interval_name, geoTime.color, geoTime.max_ma, geoTime.min_ma, geoTime.parent_no)
+			self.byIntervalNo[interval.interval_no] = interval
+			self.levels.setdefault(interval.scale_level, []).append(interval)
+		self.levelMins = {}
+		for scale_level, intervals in self.levels.items():
+			intervals.sort(key=lambda interval: (interval.min_ma, interval.max_ma))
+			self.levelMins[scale_level] = [interval.min_ma for interval in intervals]
+		self.byName = {interval.interval_name.lower(): interval for interval in self.byIntervalNo.values()}
+		self.ageLabels = {} # (max_ma, min_ma) -> label, since a result set repeats the same few age ranges over and over
+
+	def lookup(self, ma, scale_level):
+		# The interval at scale_level that contains ma (in millions of years), or None. On a shared boundary the older interval wins.
+		if scale_level not in self.levels:
+			return None
+		position = bisect.bisect_right(self.levelMins[scale_level], ma) - 1
+		if position < 0:
+			return None
+		interval = self.levels[scale_level][position]
+		if interval.max_ma >= ma:
+			return interval
+		return None
+
+	def parent(self, interval):
+		return self.byIntervalNo.get(interval.parent_no)
+
+	def chain(self, ma):
+		# {scale_level: interval} for every level that has an interval containing ma, e.g. {2: Mesozoic, 3: Cretaceous, 4: Late Cretaceous, ...}
+		return {scale_level: interval for scale_level, interval in ((scale_level, self.lookup(ma, scale_level)) for scale_level in self.levels) if interval != None}
+
+	def periodAndEra(self, ma):
+		# The period containing ma and the era it belongs to, or (None, None)
+		period = self.lookup(ma, 3)
+		if period == None:
+			return (None, None)
+		era = self.parent(period)
+		if (era == None) or (era.scale_level != 2):
+			return (None, None)
+		return (period, era)
+
+geoTimeIndex = None
+
+def buildGeoTimeIndex():
+	# (Re)builds the module-wide GeoTimeIndex from the GeoTime table. Called at startup and whenever create_GeoTime_objects() reloads the timescale.
+	global geoTimeIndex
+	geoTimeIndex = GeoTimeIndex(GeoTime.query.all())
+	return geoTimeIndex
+
+def getGeoTimeIndex():
+	if geoTimeIndex == None:
+		return buildGeoTimeIndex()
+	return geoTimeIndex
+
 def getGeologicAge(geologicAge,max_ma,min_ma):
-	eras = GeoTime.query.filter_by(scale_level=2)
-	periods = GeoTime.query.filter_by(scale_level=3)
-	age = ""
-	firstpart = ""
-	years = ""
-	if (geologicAge == None):
-		age = "Geologic age unknown"
+	if (geologicAge == None) or (max_ma == None):
+		return "Geologic age unknown"
+	index = getGeoTimeIndex()
+	ageKey = (max_ma, min_ma)
+	if ageKey not in index.ageLabels:
+		index.ageLabels[ageKey] = getGeologicAgeLabel(index, max_ma, min_ma)
+	return index.ageLabels[ageKey]
+
+def getGeologicAgeLabel(index, max_ma, min_ma):
+	if not index.levels:
+		return ""
+	if (min_ma != None):
+		midpoint = (max_ma + min_ma) / 2
+	else:
+		midpoint = max_ma
+	period, era = index.periodAndEra(midpoint)
+	if (period != None):
+		firstpart = period.interval_name + " " + getTimeScaleDivisionName(period) + ", " + era.interval_name + " " + getTimeScaleDivisionName(era)
+	else:
+		firstpart = ""
+	if (max_ma < 1):
+		if (min_ma != None):
+			years = " (approx. " + str(round(((max_ma+min_ma)/2)*1000,2)) + " thousand years ago)"
+		else:
+			years = " (approx. " + str(max_ma*1000) + " thousand years ago)"
 	else:
-		for period in periods:
-			for era in eras:
-				if (era.interval_no == period.parent_no):
-					if ((min_ma != None) and (period.max_ma >= ((max_ma + min_ma) / 2) >= period.min_ma)) or ((min_ma == None) and (period.max_ma >= max_ma >= period.min_ma)):
-						firstpart = period.interval_name + " " + getTimeScaleDivisionName(period) + ", " + era.interval_name + " " + getTimeScaleDivisionName(era)
-			if (max_ma < 1):
-				if (min_ma != None):
-					years = " (approx. " + str(round(((max_ma+min_ma)/2)*1000,2)) + " thousand years ago)"
-				elif (min_ma == None):
-					years = " (approx. " + str(max_ma*1000) + " thousand years ago)"
-			elif (max_ma >= 1):
-				if (min_ma != None):
-					years = " (approx. " + str(round((max_ma+min_ma)/2,2)) + " million years ago)"
-				elif (min_ma == None):
-					years = " (approx. " + str(max_ma) + " million years ago)"
-				else:
-					years = ""
-			age = firstpart + years
-	return age
+		if (min_ma != None):
+			years = " (approx. " + str(round((max_ma+min_ma)/2,2)) + " million years ago)"
+		else:
+			years = " (approx. " + str(max_ma) + " million years ago)"
+	return firstpart + years
+
+def labelGeologicAges(agePairs):
+	# Batch version of getGeologicAge() for a whole result set: takes a sequence of (max_ma, min_ma) pairs and returns their labels in the same order. Each distinct pair is labelled once. A pair with no max_ma is "Geologic age unknown"; so is a fossil with no geologicAge, which buildFossilColumns() passes as (None, None).
+	agePairs = list(agePairs)
+	index = getGeoTimeIndex()
+	for ageKey in set(agePairs):
+		if (ageKey[0] != None) and (ageKey not in index.ageLabels):
+			index.ageLabels[ageKey] = getGeologicAgeLabel(index, ageKey[0], ageKey[1])
+	return ["Geologic age unknown" if ageKey[0] == None else index.ageLabels[ageKey] for ageKey in agePairs]
+
+timeScaleDivisionNames = {1: "eon", 2: "era", 3: "period", 4: "epoch", 5: "age"}
 
 def getTimeScaleDivisionName(GeoTime):
-	TimeScaleDivisionDict = {1: "eon", 2: "era", 3: "period", 4: "epoch", 5: "age"}
-	TimeScaleDivisionName = TimeScaleDivisionDict[GeoTime.scale_level]
-	return TimeScaleDivisionName
+	return timeScaleDivisionNames[GeoTime.scale_level]
+
+# Which map icon each fossil gets. A rule covers a set of taxa at one rank, optionally only within one class. The most specific rank with a matching rule wins (family, then order, then class); fossils matching no rule get defaultMarkerIcon.
+# (rank, taxa, icon, only within this class)
+markerIconRules = [
+	('class', frozenset(['Trilobita']), '/static/images/mapicons/trilobite.png', None),
+	('class', frozenset(['Saurischia']), '/static/images/mapicons/tyrannosaurus_rex.png', None),
+	('family', frozenset(['Camarasauridae', 'Brachiosauridae', 'Euhelopodidae', 'Titanosauridae', 'Mamenchisauridae', 'Diplodocidae', 'Massospondylidae', 'Megaloolithidae', 'Riojasauridae', 'Plateosauridae', 'Saltasauridae', 'Faveoloolithidae', 'Dicraeosauridae', 'Nemegtosauridae', 'Rebbachisauridae']), '/static/images/mapicons/brontosaurus.png', 'Saurischia'),
+	('class', frozenset(['Ornithischia']), '/static/images/mapicons/stegosaurus.png', None),
+	('order', frozenset(['Thyreophora']), '/static/images/mapicons/stegosaurus.png', 'Ornithischia'),
+	('family', frozenset(['Ceratopsidae']), '/static/images/mapicons/triceratops.png', 'Ornithischia'),
+	('order', frozenset(['Pterosauria']), '/static/images/mapicons/pterodactyl.png', None),
+	('order', frozenset(['plesiosauridae', 'ichthyosauridae']), '/static/images/mapicons/plesiosaur.png', None),
+	('family', frozenset(['Hominidae']), '/static/images/mapicons/cartoon_caveman.ico', None),
+	]
+defaultMarkerIcon = '/static/images/mapicons/townspeople-dinosaur-icon.png'
+
+def compileMarkerIconRules(markerIconRules):
+	# Turns the rule list into {rank: {taxon name: [(required class, icon), ...]}} so classifying a fossil is a few dict lookups
+	compiledRules = {'family': {}, 'order': {}, 'class': {}}
+	for rank, taxa, icon, requiredClass in markerIconRules:
+		for taxonName in taxa:
+			compiledRules[rank].setdefault(taxonName, []).append((requiredClass, icon))
+	return compiledRules
+
+compiledMarkerIconRules = compileMarkerIconRules(markerIconRules)
+
+@functools.lru_cache(maxsize=4096)
+def getMarkerIcon(trank_class, trank_order, trank_family):
+	for rank, taxonName in (('family', trank_family), ('order', trank_order), ('class', trank_class)):
+		for requiredClass, icon in compiledMarkerIconRules[rank].get(taxonName, ()):
+			if (requiredClass == None) or (requiredClass == trank_class):
+				return icon
+	return defaultMarkerIcon
+
+markerClusterIndexes = collections.OrderedDict() # search_id -> MarkerClusterIndex, most recently used last
+markerClusterMarkers = 0 # Markers held by markerClusterIndexes
+markerClusterIndexesLock = threading.Lock()
+
+def storeMarkerClusterIndex(searchId, markerClusterIndex):
+	# Evicts the least recently used indexes until the cache is within both MARKER_CLUSTER_CACHE_SIZE and MARKER_CLUSTER_CACHE_MARKERS
+	global markerClusterMarkers
+	with markerClusterIndexesLock:
+		if searchId in markerClusterIndexes:
+			markerClusterMarkers -= len(markerClusterIndexes.pop(searchId).markers)
+		markerClusterIndexes[searchId] = markerClusterIndex
+		markerClusterMarkers += len(markerClusterIndex.markers)
+		while (len(markerClusterIndexes) > 1) and ((len(markerClusterIndexes) > app.config['MARKER_CLUSTER_CACHE_SIZE']) or (markerClusterMarkers > app.config['MARKER_CLUSTER_CACHE_MARKERS'])):
+			markerClusterMarkers -= len(markerClusterIndexes.popitem(last=False)[1].markers)
+
+def getMarkerClusterIndex(searchId):
+	# The MarkerClusterIndex of a stored search, rebuilt from the database if this process doesn't have it (e.g. another worker ran the search, or it was evicted)
+	with markerClusterIndexesLock:
+		if searchId in markerClusterIndexes:
+			markerClusterIndexes.move_to_end(searchId)
+			return markerClusterIndexes[searchId]
+	markerClusterIndex = MarkerClusterIndex(get_markers(loadFossilRecords(searchId)), app.config['MARKER_CLUSTER_MAX_ZOOM'])
+	storeMarkerClusterIndex(searchId, markerClusterIndex)
+	return markerClusterIndex
 
 def get_markers(allFossils):
-	coords_and_mapFlag_List = []
-	markers = {}
-	for fossil in allFossils:
-		# Just lat/long: coordinatePairs = [row[1],row[2]]
-		fossilName = fossil.fossilName
-		taxonomy = fossil.taxonomy
-		location = fossil.location
-		age = fossil.age
-		coordinatePairs = fossil.coordinatePairs
-		mapflagCaption = "<b style='color:red;'>" + fossilName + "</b>. " + location + ". " + age + "."
-		# print("CAPTION: " + mapflagCaption)
-		coords_and_mapFlag = [coordinatePairs[0],coordinatePairs[1],mapflagCaption]
-		print("coordinatePairs: " + str(coordinatePairs[0]) + ", " + str(coordinatePairs[1]))
-		print("PHYLUM: " + str(taxonomy['phylum']) + ", CLASS: " + str(taxonomy['class']) + ", ORDER: " + str(taxonomy['order']) + ", FAMILY: " + str(taxonomy['family']) + ", GENUS: " + str(taxonomy['genus']))
-		if (taxonomy['class'] == 'Trilobita'):
-			icon = '/static/images/mapicons/trilobite.png'
-		elif (taxonomy['class'] == 'Saurischia'):
-			if (taxonomy['family'] == 'Camarasauridae' or taxonomy['family'] == 'Brachiosauridae' or taxonomy['family'] == 'Euhelopodidae' or taxonomy['family'] == 'Titanosauridae' or taxonomy['family'] == 'Mamenchisauridae' or taxonomy['family'] == 'Diplodocidae' or taxonomy['family'] == 'Massospondylidae' or taxonomy['family'] == 'Megaloolithidae' or taxonomy['family'] == 'Riojasauridae' or taxonomy['family'] == 'Plateosauridae' or taxonomy['family'] == 'Saltasauridae' or taxonomy['family'] == 'Faveoloolithidae' or taxonomy['family'] == 'Dicraeosauridae' or taxonomy['family'] == 'Nemegtosauridae' or taxonomy['family'] == 'Rebbachisauridae'):
-				icon = '/static/images/mapicons/brontosaurus.png'
-			else:
-				icon = '/static/images/mapicons/tyrannosaurus_rex.png'
-		elif (taxonomy['class'] == 'Ornithischia'):
-			if (taxonomy['order'] == 'Thyreophora'):
-				icon = '/static/images/mapicons/stegosaurus.png'
-			elif (taxonomy['family'] == 'Ceratopsidae'):
-				icon = '/static/images/mapicons/triceratops.png'
-			else:
-				icon = '/static/images/mapicons/stegosaurus.png'
-		elif (taxonomy['order'] == 'Pterosauria'):
-			icon = '/static/images/mapicons/pterodactyl.png'
-		elif (taxonomy['order'] == 'plesiosauridae' or taxonomy['order'] == 'ichthyosauridae'):
-			icon = '/static/images/mapicons/plesiosaur.png'
-		elif (taxonomy['family'] == 'Hominidae'):
-			icon = '/static/images/mapicons/cartoon_caveman.ico'
-		else:
-			icon = '/static/images/mapicons/townspeople-dinosaur-icon.png'
-		icon_coords_and_mapFlag = { 'icon': icon, 'lat': coordinatePairs[0], 'lng': coordinatePairs[1], 'infobox': mapflagCaption }
-		# Full HTML flag: coordinatePairs = [row[1],row[2],("Hello I am <b style='color:#ffcc00;'> YELLOW </b>!" "<h2>It is HTML title</h2>" "<img src='//placehold.it/50'>""<br>Images allowed!")]
-		# print ("coords_and_mapFlag: " + str(coords_and_mapFlag))
-		coords_and_mapFlag_List.append(icon_coords_and_mapFlag)
-	markers = coords_and_mapFlag_List
-	return markers
+	# Builds the map markers for a whole result set in one pass, with no per-fossil logging
+	return [{'icon': getMarkerIcon(fossil.class_, fossil.order_, fossil.family), 'lat': fossil.lat, 'lng': fossil.lng, 'infobox': "<b style='color:red;'>" + fossil.fossilName + "</b>. " + fossil.location + ". " + fossil.age + "."} for fossil in allFossils]
+
+def newSearchProgress():
+	return {'recordsFound': None, 'recordsFetched': 0, 'recordsIngested': 0, 'markersBuilt': 0}
+
+class SearchJob(db.Model):
+	# One search submitted by /fossilsearch and run on searchJobPool. Jobs live in the database rather than in the process that runs them, so whichever worker process gets the browser's next request can report progress, cancel the job or show its results. status goes queued -> running -> done, failed or cancelled; the progress columns count records fetched from PBDB, ingested into the database and turned into map markers.
+	id = db.Column(db.String(32), primary_key=True)
+	client_id = db.Column(db.String(32), index=True)
+	search_args = db.Column(db.Text) # JSON
+	status = db.Column(db.String(10))
+	records_found = db.Column(db.Integer)
+	records_fetched = db.Column(db.Integer)
+	records_ingested = db.Column(db.Integer)
+	markers_built = db.Column(db.Integer)
+	cancelled = db.Column(db.Boolean) # Set by /cancel (or a newer search from the same browser); the process running the job checks it every SEARCH_JOB_SYNC_INTERVAL
+	search_id = db.Column(db.String(32))
+	search_page = db.Column(db.Text) # JSON
+	message = db.Column(db.String(200))
+	stats = db.Column(db.Text) # JSON
+	finished_at = db.Column(db.Float, index=True)
+	heartbeat_at = db.Column(db.Float) # Last sign of life from the process that will run the job (see syncSearchJob()); starts as the submission time
+
+	def __init__(self, clientId, searchArgs):
+		self.id = uuid.uuid4().hex
+		self.client_id = clientId
+		self.search_args = json.dumps(searchArgs)
+		self.status = 'queued'
+		self.cancelled = False
+		self.heartbeat_at = time.time()
+		self.setProgress(newSearchProgress())
+
+	def setProgress(self, progress):
+		self.records_found, self.records_fetched, self.records_ingested, self.markers_built = (progress['recordsFound'], progress['recordsFetched'], progress['recordsIngested'], progress['markersBuilt'])
+
+	def finished(self):
+		return self.status in ('done', 'failed', 'cancelled')
+
+	def statusJson(self):
+		return {'id': self.id, 'status': self.status, 'progress': {'recordsFound': self.records_found, 'recordsFetched': self.records_fetched, 'recordsIngested': self.records_ingested, 'markersBuilt': self.markers_built}, 'message': self.message, 'stats': json.loads(self.stats or 'null')}
+
+# Ids of the jobs submitted by this process still waiting in searchJobPool's queue; the running jobs' heartbeats cover them (see syncSearchJob())
+queuedSearchJobIds = set()
+queuedSearchJobIdsLock = threading.Lock()
+
+def submitSearchJob(clientId, searchArgs):
+	# Queues a search for this browser, cancelling the one it was already running, and forgets jobs nobody collected or whose process died
+	searchJob = SearchJob(clientId, searchArgs)
+	db.session.execute(SearchJob.__table__.update().where(SearchJob.client_id == clientId, SearchJob.finished_at == None).values(cancelled=True))
+	db.session.execute(SearchJob.__table__.delete().where(SearchJob.finished_at < time.time() - app.config['SEARCH_JOB_TTL']))
+	failStaleSearchJobs()
+	db.session.add(searchJob)
+	db.session.commit()
+	with queuedSearchJobIdsLock:
+		queuedSearchJobIds.add(searchJob.id)
+	searchJobPool.submit(runSearchJob, searchJob.id)
+	return searchJob
+
+def failStaleSearchJobs(*criteria):
+	# Marks failed the unfinished jobs (optionally only those matching criteria) whose heartbeat is more than SEARCH_JOB_STALE_AFTER seconds old: the process running or queueing them has gone, so nothing else will ever finish them. The caller commits.
+	now = time.time()
+	db.session.execute(SearchJob.__table__.update().where(SearchJob.finished_at == None, SearchJob.heartbeat_at < now - app.config['SEARCH_JOB_STALE_AFTER'], *criteria).values(status='failed', message="The search stopped responding. Please try again.", finished_at=now))
+
+def syncSearchJob(jobId, progress, cancelEvent, stopEvent):
+	# Runs beside a search job: saves its progress and heartbeat every SEARCH_JOB_SYNC_INTERVAL seconds, and sets its cancelEvent once the job has been marked cancelled, until stopEvent is set. The heartbeat also goes to the jobs queued behind it in this process, which can't beat for themselves while they wait for a worker.
+	while not stopEvent.wait(app.config['SEARCH_JOB_SYNC_INTERVAL']):
+		try:
+			with queuedSearchJobIdsLock:
+				heartbeatJobIds = [jobId] + list(queuedSearchJobIds)
+			with app.app_context(), db.engine.begin() as connection:
+				connection.execute(SearchJob.__table__.update().where(SearchJob.id == jobId).values(records_found=progress['recordsFound'], records_fetched=progress['recordsFetched'], records_ingested=progress['recordsIngested'], markers_built=progress['markersBuilt']))
+				connection.execute(SearchJob.__table__.update().where(SearchJob.id.in_(heartbeatJobIds), SearchJob.finished_at == None).values(heartbeat_at=time.time()))
+				if connection.execute(select(SearchJob.cancelled).where(SearchJob.id == jobId)).scalar():
+					cancelEvent.set()
+		except OperationalError as error: # Only progress is lost; the next sync tries again
+			app.logger.warning("Couldn't sync search job %s: %s", jobId, error)
+
+def runSearchJob(jobId):
+	# Runs on a searchJobPool thread: geocode, download, ingest and build markers, then leave the page details on the job for the browser to collect
+	profiler = startProfiler()
+	with queuedSearchJobIdsLock:
+		queuedSearchJobIds.discard(jobId)
+	with app.app_context():
+		searchJob = db.session.get(SearchJob, jobId)
+		progress = newSearchProgress()
+		cancelEvent = threading.Event()
+		stopEvent = threading.Event()
+		syncThread = threading.Thread(target=syncSearchJob, args=(jobId, progress, cancelEvent, stopEvent), daemon=True)
+		try:
+			if searchJob.cancelled:
+				raise SearchCancelled()
+			searchJob.status = 'running'
+			searchJob.heartbeat_at = time.time()
+			db.session.commit()
+			syncThread.start()
+			finishSearchJob(searchJob, cancelEvent, progress, **json.loads(searchJob.search_args))
+		except SearchCancelled:
+			searchJob.status = 'cancelled'
+		except Exception:
+			app.logger.exception("Search job %s failed", jobId)
+			db.session.rollback()
+			searchJob.message = "The search failed. Please try again."
+			searchJob.status = 'failed'
+		finally:
+			saveProfile(profiler, 'searchjob-' + jobId)
+			metrics.inc('dinosaur_searches_total', status=searchJob.status)
+			stopEvent.set()
+			if syncThread.is_alive():
+				syncThread.join()
+			searchJob.setProgress(progress)
+			searchJob.finished_at = time.time()
+			db.session.commit()
+
+def finishSearchJob(searchJob, cancelEvent, progress, searchTaxon, searchLocation, searchRadius, searchGeoTime):
+	searchStats = resetSearchStats()
+	baseNameString = getbaseNameString(searchTaxon)
+	with timingSpan('geocode', searchStats):
+		latLongAndRadius = getLatLongAndRadiusString(searchLocation,searchRadius) # The only geocode for this search; reused for the map's centre marker
+	if (latLongAndRadius == None):
+		searchJob.message = "Couldn't find the location " + searchLocation + ". Please try again."
+		searchJob.status = 'failed'
+		return
+	latlngradiusString = latLongAndRadius['latlngradiusString']
+	searchGeoTimeString = getsearchGeoTimeString(searchGeoTime)
+
+	paleobiodbURL = app.config['PALEOBIODB_BASE_URL'] + '/occs/list.json?rowcount&level=3%s%s%s&show=full' % (baseNameString,latlngradiusString,searchGeoTimeString)
+	app.logger.debug("PBDB URL: %s", paleobiodbURL)
+	searchId = uuid.uuid4().hex # Results are stored under their own id, so other users' searches never touch them
+	searchResults = paleoSearch(paleobiodbURL, searchId, cancelEvent, progress, getMirrorQuery(searchTaxon, latLongAndRadius, searchGeoTime), searchStats) # Runs the download/ingest/marker pipeline exactly once per search
+	app.logger.info("Search %s stats: %s", searchId, searchResults['stats'])
+	searchJob.stats = json.dumps(searchResults['stats'])
+	warning = searchResults['warning']
+	if (warning != None):
+		searchJob.message = warning + ". Please try again."
+		searchJob.status = 'failed'
+		return
+	if cancelEvent.is_set(): # Cancelled just as it finished
+		clear_db(searchId)
+		raise SearchCancelled()
+	ResultsFound = searchResults['ResultsFound']
+	allFossils = searchResults['allFossils']
+	centerMapMarker = getCenterMapMarker(searchLocation,searchRadius,latLongAndRadius,allFossils)
+	zoomNumber = getZoomNumber(searchLocation, searchRadius)
+	searchJob.search_id = searchId
+	searchJob.search_page = json.dumps({'centerLat': centerMapMarker['centerLat'], 'centerLng': centerMapMarker['centerLng'], 'searchCenter': centerMapMarker['searchCenter'], 'searchTerm': searchTaxon, 'zoomNumber': zoomNumber, 'ResultsFound': ResultsFound, 'fossilCount': len(allFossils)})
+	searchJob.status = 'done'
+
+def getClientSearchJob(jobId):
+	# A job is only visible to the browser that submitted it. A job that has stopped beating is failed here, so the browser waiting on it hears about it.
+	failStaleSearchJobs(SearchJob.id == jobId)
+	db.session.commit()
+	searchJob = db.session.get(SearchJob, jobId)
+	if (searchJob == None) or (searchJob.client_id != session.get('client_id')):
+		abort(404)
+	return searchJob
 
 @app.route('/fossilsearch')
 def fossilsearch():
 	# This downloads the JSON data for a search on PaleoBioDB. "taxon_name" returns just that taxon, while "base_name" returns taxon + all subtaxa (genus/species names). Search multiple taxa with comma separator. Wildcards include %: "Stegosaur%" pulls up both Stegosaurus and Stegosauridae. https://paleobiodb.org/data1.2/general/taxon_names_doc.htm
+	# The search itself runs as a background job; the browser is sent straight to /searchjob/<id>, which waits for it
 	searchTaxon = getSearchTaxon(request.args.get('taxonquery'), request.args.get('taxonradio'))
-	print('searchTaxon =' + str(searchTaxon))
-	baseNameString = getbaseNameString(searchTaxon)
+	app.logger.debug("searchTaxon = %s", searchTaxon)
 	searchLocation = request.args.get('locationquery')
 	searchRadius = int(request.args.get('degrees'))
-	print('searchLocation =' + str(searchLocation))
-	latlngradiusString = getLatLongAndRadiusString(searchLocation,searchRadius)['latlngradiusString']
+	app.logger.debug("searchLocation = %s", searchLocation)
 	searchGeoTime = str(request.args.get('geotimeradio'))
-	print('searchGeoTime =' + str(searchGeoTime))
-	searchGeoTimeString = getsearchGeoTimeString(searchGeoTime)
+	app.logger.debug("searchGeoTime = %s", searchGeoTime)
+	searchJob = submitSearchJob(session['client_id'], {'searchTaxon': searchTaxon, 'searchLocation': searchLocation, 'searchRadius': searchRadius, 'searchGeoTime': searchGeoTime})
+	return redirect(url_for('searchjob', jobId=searchJob.id))
 
-	paleobiodbURL = 'https://paleobiodb.org/data1.2/occs/list.json?rowcount&level=3%s%s%s&show=full' % (baseNameString,latlngradiusString,searchGeoTimeString)
-	print (paleobiodbURL)
-	warning = paleoSearch(paleobiodbURL)['warning']
-	if (warning != None):
-		flash(warning + ". Please try again.")
+@app.route('/searchjob/<jobId>')
+def searchjob(jobId):
+	# Shows a progress page while the job runs. Once it is done, the job's results become this browser's current search and the browser is sent on to /results, so reloading the results page works.
+	searchJob = getClientSearchJob(jobId)
+	if not searchJob.finished():
+		return render_template('searchjob.html', jobId=jobId, **searchJob.statusJson())
+	status, message, searchId, searchPage = searchJob.status, searchJob.message, searchJob.search_id, searchJob.search_page
+	db.session.delete(searchJob)
+	db.session.commit()
+	if (status == 'cancelled'):
 		return redirect(url_for('start_here'))
-	else:
-		ResultsFound = paleoSearch(paleobiodbURL)['ResultsFound']
-		markers = paleoSearch(paleobiodbURL)['markers']
-		allFossils = paleoSearch(paleobiodbURL)['allFossils']
-		centerLat = getCenterMapMarker(searchLocation,searchRadius)['centerLat']
-		centerLng = getCenterMapMarker(searchLocation,searchRadius)['centerLng']
-		markers.append(getCenterMapMarker(searchLocation,searchRadius)['searchCenter'])
-		zoomNumber = getZoomNumber(searchLocation, searchRadius)
-		return render_template('map.html', centerLat=centerLat, centerLng=centerLng, searchTerm=searchTaxon, zoomNumber=zoomNumber, markers=markers, ResultsFound=ResultsFound, allFossils=allFossils)
+	if (status == 'failed'):
+		flash(message)
+		return redirect(url_for('start_here'))
+	if ('search_id' in session): # This user's previous results are no longer needed
+		clear_db(session.pop('search_id'))
+		session.pop('search_page', None)
+	session['search_id'] = searchId
+	session['search_page'] = json.loads(searchPage)
+	return redirect(url_for('results'))
+
+@app.route('/metrics')
+def metricsPage():
+	# Prometheus scrape endpoint: search counters and stage timings from the registry, plus cache, geocoder and job-queue gauges sampled now
+	gauges = []
+	if (paleobiodbCache != None):
+		gauges.append(('dinosaur_pbdb_cache_requests', 'PBDB response cache lookups since startup, by result.', [({'result': name}, value) for name, value in sorted(paleobiodbCache.stats().items())]))
+	gauges.append(('dinosaur_geocoder_requests', 'Geocoder lookups since startup, by result.', [({'result': name}, value) for name, value in sorted(placeGeocoder.stats().items())]))
+	jobStatuses = dict(db.session.execute(select(SearchJob.status, func.count()).group_by(SearchJob.status)).all())
+	gauges.append(('dinosaur_search_jobs', 'Search jobs in the database, by status.', [({'status': status}, jobStatuses.get(status, 0)) for status in ('queued', 'running', 'done', 'failed', 'cancelled')]))
+	gauges.append(('dinosaur_marker_cluster_indexes', 'Result sets with marker clusters held in memory.', [({}, len(markerClusterIndexes))]))
+	gauges.append(('dinosaur_marker_cluster_markers', 'Markers held by those result sets.', [({}, markerClusterMarkers)]))
+	return app.response_class(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/searchjob/<jobId>/status')
+def searchjobstatus(jobId):
+	# Polled by the progress page: {id, status, progress: {recordsFound, recordsFetched, recordsIngested, markersBuilt}, message}
+	return jsonify(getClientSearchJob(jobId).statusJson())
+
+@app.route('/results')
+def results():
+	# Another page of the current search's fossil list; the map itself is the same on every page
+	if ('search_id' not in session):
+		return redirect(url_for('start_here'))
+	return render_results_page(session['search_id'], session['search_page'], request.args.get('page', 1, type=int))
+
+def render_results_page(searchId, searchPage, page):
+	# The map page loads its markers from /markers as the user pans and zooms, so the HTML only carries one page of the fossil list
+	pageSize = app.config['RESULTS_PAGE_SIZE']
+	pageCount = max(1, -(-searchPage['fossilCount'] // pageSize))
+	page = min(max(page, 1), pageCount)
+	pageFossils = iterFossilRecords(searchId, limit=pageSize, offset=(page - 1) * pageSize)
+	return streamResponse(timedChunks('render', stream_template('map.html', page=page, pageCount=pageCount, pageFossils=pageFossils, googleMapsApiKey=google_maps_api_key, **searchPage)), 'text/html')
+
+def timedChunks(stage, chunks):
+	# A streamed body is rendered while it is sent, so its span runs from the first chunk to the last
+	with timingSpan(stage):
+		yield from chunks
+
+def streamResponse(chunks, mimetype, headers=None):
+	# A streamed response, compressed on the fly with the best encoding the browser accepts (see dinosaur_export.py)
+	response = app.response_class(chunks, mimetype=mimetype, headers=headers)
+	response.vary.add('Accept-Encoding')
+	if app.config['COMPRESS_RESPONSES']:
+		encoding = request.accept_encodings.best_match(getContentEncodings())
+		if (encoding != None):
+			response.response = compressChunks(chunks, encoding, app.config['COMPRESSION_LEVEL'])
+			response.content_encoding = encoding
+	return response
+
+@app.route('/export/<exportFormat>')
+def export(exportFormat):
+	# The current search's fossils as GeoJSON, CSV or the compact binary format (see dinosaur_export.py), streamed straight from the stored results
+	if ('search_id' not in session) or (exportFormat not in exportFormats):
+		abort(404)
+	mimetype, extension, encoder = exportFormats[exportFormat]
+	return streamResponse(stream_with_context(encoder(iterFossilRecords(session['search_id']))), mimetype, {'Content-Disposition': 'attachment; filename=fossils.' + extension})
+
+@app.route('/markers')
+def markers():
+	# Map markers for the current search at one zoom level, inside the map's viewport: aggregate counts where fossils are dense, individual pins elsewhere
+	if ('search_id' not in session):
+		abort(404)
+	zoom = request.args.get('zoom', 4, type=int)
+	viewport = [request.args.get(name, default, type=float) for name, default in (('latmin', -90.0), ('latmax', 90.0), ('lngmin', -180.0), ('lngmax', 180.0))]
+	return jsonify(getMarkerClusterIndex(session['search_id']).query(zoom, *viewport))
 
 def getSearchTaxon(taxonquery, taxonradio):
 	if (taxonquery or taxonradio):
@@ -438,34 +1466,34 @@ def getbaseNameString(searchTaxon):
 
 def getLatLongAndRadiusString(searchLocation,searchRadius):
 	if (searchLocation == ""):
-		return {'latlngradiusString': "", 'centerLat': 0, 'centerLng': 0}
+		return {'latlngradiusString': "", 'centerLat': 0, 'centerLng': 0, 'box': None}
 	else:
 		# Geocoding an address into lat/long: https://developers.google.com/maps/documentation/javascript/geocoding (For Android, here: https://developer.android.com/training/building-location.html) A more user-friendly Python plugin is here https://pypi.python.org/pypi/geocoder
-		g = geocoder.google(searchLocation)
-		gLatJson = g.json['lat']
-		gLngJson = g.json['lng']
+		latLng = placeGeocoder.geocode(searchLocation) # Memoised per place; see dinosaur_geocode.py
+		if (latLng == None):
+			return None
+		gLatJson, gLngJson = latLng
 		latmin = gLatJson - (searchRadius/2)
 		latmax = gLatJson + (searchRadius/2)
 		lngmin = gLngJson - (searchRadius/2)
 		lngmax = gLngJson + (searchRadius/2)
 		latlngradiusString = '&lngmin=%s&lngmax=%s&latmin=%s&latmax=%s' % (lngmin,lngmax,latmin,latmax)
-		print (gLatJson)
-		print (gLngJson)
-		print (latlngradiusString)
-		return {'latlngradiusString': latlngradiusString, 'centerLat': gLatJson, 'centerLng': gLngJson}
+		app.logger.debug("Geocoded %s to %s, %s: %s", searchLocation, gLatJson, gLngJson, latlngradiusString)
+		return {'latlngradiusString': latlngradiusString, 'centerLat': gLatJson, 'centerLng': gLngJson, 'box': (latmin, latmax, lngmin, lngmax)}
 
-def getCenterMapMarker(searchLocation,searchRadius):
+def getCenterMapMarker(searchLocation,searchRadius,latLongAndRadius,allFossils):
 	if (searchLocation == ""):
 		# Making centerpoint for taxonsearch map
-		# firstFossil = fossilResults[0]
-		firstFossil = Fossil.query.first()
-		firstFossilCoordinatePairs = firstFossil.coordinatePairs
+		if allFossils:
+			firstFossilCoordinatePairs = [allFossils[0].lat, allFossils[0].lng]
+		else:
+			firstFossilCoordinatePairs = [0, 0]
 		centerLat = firstFossilCoordinatePairs[0] # Map centers on the first result if no location chosen
 		centerLng = firstFossilCoordinatePairs[1]
 		searchCenter = None
 	else:
-		centerLat = getLatLongAndRadiusString(searchLocation,searchRadius)['centerLat']
-		centerLng = getLatLongAndRadiusString(searchLocation,searchRadius)['centerLng']
+		centerLat = latLongAndRadius['centerLat']
+		centerLng = latLongAndRadius['centerLng']
 		searchCenter = {'icon': '/static/images/mapicons/my_house.png', 'lat': centerLat, 'lng': centerLng, 'infobox': "Your chosen <b style='color:#00cc00;'> centerpoint </b>!" "<h2>You live here</h2>" "<img src='/static/images/mapicons/my_house.png'>""<br><a href=https://en.wikipedia.org/wiki/Main_Page target='_blank'>Images and links allowed!</a>"}
 	return {'searchCenter':searchCenter, 'centerLat':centerLat, 'centerLng':centerLng}
 
@@ -498,17 +1526,38 @@ def getsearchGeoTimeString(searchGeoTime):
 
 
 
+@app.route('/fossilsnearby')
+def fossilsnearby():
+	# Re-filters the stored results of this user's last search by area, without another PBDB request: either a box (latmin, latmax, lngmin, lngmax) or a circle (lat, lng, radiuskm). Returns map markers as JSON.
+	searchId = session.get('search_id')
+	if (searchId == None):
+		abort(404)
+	if ('radiuskm' in request.args):
+		circle = [request.args.get(name, type=float) for name in ('lat', 'lng', 'radiuskm')]
+		if None in circle:
+			abort(400)
+		fossils = fossilsInRadius(searchId, *circle)
+	else:
+		box = [request.args.get(name, type=float) for name in ('latmin', 'latmax', 'lngmin', 'lngmax')]
+		if None in box:
+			abort(400)
+		fossils = fossilsInBox(searchId, *box)
+	return jsonify(get_markers(fossils))
+
 @app.route('/cancel')
 def cancel():
 	flash('Search canceled. Returning to start.')
-	clear_db()
+	if ('client_id' in session): # Aborts the search job this browser has running, wherever it has got to (and in whichever process)
+		db.session.execute(SearchJob.__table__.update().where(SearchJob.client_id == session['client_id'], SearchJob.finished_at == None).values(cancelled=True))
+		db.session.commit()
+	if ('search_id' in session):
+		clear_db(session.pop('search_id'))
+		session.pop('search_page', None)
 	return redirect(url_for('start_here'))
 
 if __name__ == '__main__':
 	db.create_all()
-	allGeoTimes = GeoTime.query.all()
-	for line in allGeoTimes:
-		db.session.delete(line)
-		db.session.commit()
-	create_GeoTime_objects()
+	migrate_fossil_table()
+	migrate_search_job_table()
+	loadGeoTimeSnapshot()
 	app.run()
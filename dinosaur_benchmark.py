@@ -0,0 +1,964 @@
+import click, collections, concurrent.futures, csv, datetime, gzip, http.server, io, json, math, multiprocessing, os, platform, random, resource, shutil, sqlite3, subprocess, sys, tempfile, threading, time, tracemalloc, urllib.parse
+import requests
+
+# End-to-end benchmark of the search pipeline that needs neither paleobiodb.org nor Google. Its fixtures (PBDB
+# occurrence responses of three sizes, the intervals list and a few geocoded places) live in benchmark_fixtures/:
+# "record" downloads them from the real services, "generate" builds synthetic ones of the same shape offline.
+# "run" serves them from a local stand-in for PBDB and the geocoder ("serve", started as a child process so its
+# memory is not counted as the app's), drives /, /fossilsearch and /cancel through the Flask test client, and
+# prints latency percentiles, throughput, peak RSS and DB statement counts as JSON for comparing runs:
+#   python dinosaur_benchmark.py run --output before.json
+# "stress" fires parallel searches from several app processes at the same fake PBDB and database, and fails unless every
+# browser gets exactly its own results. "spatial" times box and radius queries on the fossil R*Tree against the plain column
+# scan it replaced, over a million synthetic points; "parser" compares peak memory and speed of the app's fetch-and-stage
+# path (iterPaleobiodbPages() into ingestPaleobiodbRecords(), from the fake PBDB) with staging one json.loads() of the whole
+# response; "columns" compares rows/s of the columnar record stage, buildFossilColumns(), with the per-row path it replaced;
+# "markers" compares get_markers() and its icon rule table with the if/elif chain that chose the icons before; "locations"
+# compares the location labels of dinosaur_location with the per-record pycountry lookups they replaced; "schema" compares
+# loading a stored search and building its markers from the old pickled fossil table and from the columnar schema.
+
+rootPath = os.path.dirname(os.path.abspath(__file__))
+defaultFixturePath = os.path.join(rootPath, 'benchmark_fixtures')
+
+# fixture name -> (base_name searched for, number of occurrences)
+fixtureSizes = collections.OrderedDict([('small', ('triceratops', 500)), ('10k', ('saurischia,ornithischia', 10000)), ('100k', ('reptilia', 100000))])
+benchmarkPlaces = ('Montana', 'Alberta', 'Isle of Wight', 'Neuquen', 'Liaoning')
+locatedSearch = {'locationquery': 'Montana', 'degrees': '10', 'geotimeradio': 'Cretaceous'}
+
+# Material for generated fixtures: (phylum, class, order, family, genus) and (nation, state, county, lat, lng) of real fossil beds
+syntheticTaxa = (('Chordata', 'Reptilia', 'Saurischia', 'Tyrannosauridae', 'Tyrannosaurus'), ('Chordata', 'Reptilia', 'Saurischia', 'Diplodocidae', 'Diplodocus'),
+	('Chordata', 'Reptilia', 'Saurischia', 'Dromaeosauridae', 'Velociraptor'), ('Chordata', 'Reptilia', 'Saurischia', 'Titanosauridae', None),
+	('Chordata', 'Reptilia', 'Ornithischia', 'Ceratopsidae', 'Triceratops'), ('Chordata', 'Reptilia', 'Ornithischia', 'Hadrosauridae', 'Edmontosaurus'),
+	('Chordata', 'Reptilia', 'Ornithischia', 'Stegosauridae', 'Stegosaurus'), ('Chordata', 'Reptilia', 'Ornithischia', 'Ankylosauridae', None),
+	('Chordata', 'Reptilia', 'Pterosauria', 'Pteranodontidae', 'Pteranodon'), ('Chordata', 'Reptilia', 'Plesiosauria', None, None),
+	('Chordata', 'Reptilia', 'Crocodylia', 'Crocodylidae', 'Crocodylus'), ('Chordata', 'Reptilia', 'Testudines', None, None))
+syntheticLocalities = (('US', 'Montana', 'Garfield', 47.6, -106.3), ('US', 'Wyoming', 'Niobrara', 43.0, -104.5), ('US', 'Utah', 'Emery', 39.0, -110.7),
+	('CA', 'Alberta', None, 51.5, -112.0), ('MN', 'Omnogovi', None, 43.5, 103.5), ('AR', 'Neuquen', None, -38.9, -68.1), ('UK', 'England', 'Isle of Wight', 50.6, -1.3),
+	('CN', 'Liaoning', 'Jianchang', 40.8, 119.8), ('TZ', 'Lindi', None, -9.8, 39.3), ('AU', 'Queensland', None, -22.0, 143.0), ('DE', 'Bayern', None, 48.9, 11.0), ('MA', None, None, 31.0, -4.0))
+syntheticPlaces = {'Montana': (47.0, -109.6), 'Alberta': (53.9, -116.6), 'Isle of Wight': (50.7, -1.3), 'Neuquen': (-38.9, -68.1), 'Liaoning': (41.3, 122.6)}
+
+
+@click.group()
+def cli():
+	pass
+
+
+def writeFixture(fixturePath, fileName, body):
+	with gzip.open(os.path.join(fixturePath, fileName), 'wb') as fixtureFile:
+		fixtureFile.write(body)
+
+def readFixture(fixturePath, fileName):
+	with gzip.open(os.path.join(fixturePath, fileName), 'rb') as fixtureFile:
+		return json.loads(fixtureFile.read().decode('UTF-8'))
+
+def writeManifest(fixturePath, manifest):
+	with open(os.path.join(fixturePath, 'manifest.json'), 'w') as manifestFile:
+		json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+
+def readManifest(fixturePath):
+	with open(os.path.join(fixturePath, 'manifest.json')) as manifestFile:
+		return json.load(manifestFile)
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Directory to record into.')
+@click.option('--pbdb', 'pbdbURL', default='https://paleobiodb.org/data1.2')
+def record(fixturePath, pbdbURL):
+	"""Record fixtures from PaleoBioDB and Google."""
+	os.makedirs(fixturePath, exist_ok=True)
+	occurrences = {}
+	for name, (baseName, limit) in fixtureSizes.items():
+		paleobiodbURL = pbdbURL + '/occs/list.json?rowcount&base_name=%s&show=full&limit=%d' % (baseName, limit)
+		click.echo('Recording ' + paleobiodbURL)
+		paleobiodbResponse = requests.get(paleobiodbURL, timeout=600)
+		paleobiodbResponse.raise_for_status()
+		writeFixture(fixturePath, 'occs-%s.json.gz' % name, paleobiodbResponse.content)
+		occurrences[name] = {'baseName': baseName, 'file': 'occs-%s.json.gz' % name, 'records': len(paleobiodbResponse.json()['records'])}
+	paleobiodbResponse = requests.get(pbdbURL + '/intervals/list.json?scale=1', timeout=600) # The query refresh-timescale makes
+	paleobiodbResponse.raise_for_status()
+	writeFixture(fixturePath, 'intervals.json.gz', paleobiodbResponse.content)
+	import geocoder
+	places = {}
+	for place in benchmarkPlaces:
+		g = geocoder.google(place)
+		if (g.json == None) or ('lat' not in g.json):
+			click.echo("Couldn't geocode " + place + "; it is left out of the fixtures")
+		else:
+			places[place] = (g.json['lat'], g.json['lng'])
+	writeManifest(fixturePath, {'source': 'recorded from ' + pbdbURL, 'createdAt': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'occurrences': occurrences, 'places': places})
+	click.echo('Fixtures recorded in ' + fixturePath)
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Directory to write into.')
+@click.option('--seed', default=1)
+def generate(fixturePath, seed):
+	"""Generate synthetic fixtures, for when PBDB can't be reached."""
+	generateFixtures(fixturePath, seed)
+	click.echo('Fixtures generated in ' + fixturePath)
+
+def generateFixtures(fixturePath, seed=1):
+	# Same files as record(): occurrences spread around real fossil beds with ages from the bundled timescale, and its intervals in PBDB's compact vocabulary
+	os.makedirs(fixturePath, exist_ok=True)
+	with open(os.path.join(rootPath, 'geotime.json')) as snapshotFile:
+		snapshot = json.load(snapshotFile)
+	intervalRecords = []
+	for interval in snapshot['intervals']:
+		intervalRow = dict(zip(snapshot['columns'], interval))
+		intervalRecord = {'oid': 'int:%d' % intervalRow['interval_no'], 'lvl': intervalRow['scale_level'], 'nam': intervalRow['interval_name'], 'col': intervalRow['color'], 'eag': intervalRow['max_ma'], 'lag': intervalRow['min_ma']}
+		if (intervalRow['parent_no'] != None):
+			intervalRecord['pid'] = 'int:%d' % intervalRow['parent_no']
+		intervalRecords.append(intervalRecord)
+	writeFixture(fixturePath, 'intervals.json.gz', json.dumps({'records': intervalRecords}).encode('UTF-8'))
+	ageIntervals = [interval for interval in intervalRecords if (interval['lvl'] >= 3) and (interval['eag'] <= 260)] # Periods, epochs and stages back to the Permian
+	occurrences = {}
+	for fixtureNumber, (name, (baseName, count)) in enumerate(fixtureSizes.items()):
+		rng = random.Random('%s-%s' % (seed, name))
+		records = []
+		for index in range(count):
+			phylum, class_, order, family, genus = rng.choice(syntheticTaxa)
+			nation, state, county, lat, lng = rng.choice(syntheticLocalities)
+			interval = rng.choice(ageIntervals)
+			occurrence = {'oid': 'occ:%d' % ((fixtureNumber + 1) * 1000000 + index), 'tna': genus or family or order, 'phl': phylum, 'cll': class_, 'odl': order,
+				'lat': '%.5f' % min(max(lat + rng.gauss(0, 1.5), -89.9), 89.9), 'lng': '%.5f' % (lng + rng.gauss(0, 1.5)), 'oei': interval['nam'], 'eag': interval['eag'], 'lag': interval['lag'],
+				'env': rng.choice(('terrestrial indet.', 'fluvial indet.', 'lacustrine - large', 'marine indet.', 'coastal indet.'))}
+			if (rng.random() < 0.25): # Some occurrences are only dated to a span of neighbouring intervals
+				laterInterval = rng.choice(ageIntervals)
+				occurrence['eag'] = max(interval['eag'], laterInterval['eag'])
+				occurrence['lag'] = min(interval['lag'], laterInterval['lag'])
+			for field, value in (('fml', family), ('gnl', genus), ('cc2', nation), ('stp', state), ('cny', county)):
+				if (value != None):
+					occurrence[field] = value
+			if (rng.random() < 0.1):
+				occurrence['ggc'] = 'coordinates estimated from map'
+			records.append(occurrence)
+		writeFixture(fixturePath, 'occs-%s.json.gz' % name, json.dumps({'elapsed_time': 0.1, 'records_found': count, 'records_returned': count, 'records': records}).encode('UTF-8'))
+		occurrences[name] = {'baseName': baseName, 'file': 'occs-%s.json.gz' % name, 'records': count}
+	writeManifest(fixturePath, {'source': 'synthetic (seed %s)' % seed, 'createdAt': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'occurrences': occurrences, 'places': syntheticPlaces})
+
+
+class FakeUpstream:
+	# The parts of PBDB and the geocoder the app uses, answered from the fixtures: occs/list.json (base_name, lat/lng box, interval, min_ma, limit/offset paging), intervals/list.json, and /geocode?address=
+	def __init__(self, fixturePath, latency=0.0):
+		manifest = readManifest(fixturePath)
+		self.latency = latency
+		self.places = {place.lower(): latLng for place, latLng in manifest['places'].items()}
+		self.intervalsBody = json.dumps(readFixture(fixturePath, 'intervals.json.gz')).encode('UTF-8')
+		self.intervalAges = {interval['nam'].lower(): (float(interval['eag']), float(interval['lag'])) for interval in readFixture(fixturePath, 'intervals.json.gz')['records']}
+		self.occurrences = {}
+		for name, fixture in manifest['occurrences'].items():
+			records = readFixture(fixturePath, fixture['file'])['records']
+			self.occurrences[self.taxonKey(fixture['baseName'])] = (records, [json.dumps(record) for record in records]) # Encoded once, so serving a page is a join
+		self.selections = {}
+		self.lock = threading.Lock()
+
+	def taxonKey(self, baseName):
+		return ','.join(sorted(part.strip().lower() for part in baseName.split(',')))
+
+	def selectOccurrences(self, query):
+		# The encoded records matching a query's filters; remembered per filter set, since a search asks for each of its pages with the same filters
+		selectionKey = tuple(sorted((name, value) for name, value in query.items() if name not in ('limit', 'offset')))
+		with self.lock:
+			if selectionKey in self.selections:
+				return self.selections[selectionKey]
+		records, encodedRecords = self.occurrences[self.taxonKey(query['base_name'])]
+		box = None
+		if ('latmin' in query):
+			box = [float(query[name]) for name in ('latmin', 'latmax', 'lngmin', 'lngmax')]
+		ageRange = None
+		if ('interval' in query):
+			ageRange = self.intervalAges.get(query['interval'].lower(), (0.0, 0.0))
+		elif ('min_ma' in query):
+			ageRange = (float('inf'), float(query['min_ma']))
+		selection = []
+		for record, encodedRecord in zip(records, encodedRecords):
+			if (box != None) and not ((box[0] <= float(record['lat']) <= box[1]) and (box[2] <= float(record['lng']) <= box[3])):
+				continue
+			if (ageRange != None):
+				ageMax, ageMin = float(record['eag']), float(record.get('lag', record['eag']))
+				if (ageMax <= ageRange[1]) or (ageMin >= ageRange[0]):
+					continue
+				if (min(ageMax, ageRange[0]) - max(ageMin, ageRange[1])) * 2 < (ageMax - ageMin): # PBDB's default "major" time rule: at least half the occurrence's age range inside the interval
+					continue
+			selection.append(encodedRecord)
+		with self.lock:
+			self.selections[selectionKey] = selection
+		return selection
+
+	def answer(self, path, query):
+		# (status, JSON body) for a request
+		if path.endswith('/intervals/list.json'):
+			return 200, self.intervalsBody
+		if path == '/geocode':
+			latLng = self.places.get(query.get('address', '').strip().lower())
+			if (latLng == None):
+				return 200, json.dumps({'status': 'ZERO_RESULTS'}).encode('UTF-8')
+			return 200, json.dumps({'status': 'OK', 'lat': latLng[0], 'lng': latLng[1]}).encode('UTF-8')
+		if path.endswith('/occs/list.json'):
+			if (self.taxonKey(query.get('base_name', '')) not in self.occurrences):
+				return 200, json.dumps({'warnings': ["The name '%s' does not match any record in the taxonomy table" % query.get('base_name', '')], 'records': []}).encode('UTF-8')
+			selection = self.selectOccurrences(query)
+			offset = int(query.get('offset', 0))
+			limit = int(query.get('limit', len(selection)))
+			page = selection[offset:offset + limit]
+			return 200, ('{"elapsed_time":0.01,"records_found":%d,"records_returned":%d,"records":[%s]}' % (len(selection), len(page), ','.join(page))).encode('UTF-8')
+		return 404, b'{}'
+
+	def serve(self, port=0):
+		upstream = self
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1' # Keep-alive, as the app's session gets from PBDB
+			def log_message(self, *args):
+				pass
+			def do_GET(self):
+				splitURL = urllib.parse.urlsplit(self.path)
+				time.sleep(upstream.latency)
+				status, body = upstream.answer(splitURL.path, dict(urllib.parse.parse_qsl(splitURL.query, keep_blank_values=True)))
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+		server = http.server.ThreadingHTTPServer(('127.0.0.1', port), RequestHandler)
+		server.daemon_threads = True
+		return server
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath)
+@click.option('--port', default=0, help='0 picks a free port.')
+@click.option('--latency', default=0.0, help='Seconds added to every response.')
+def serve(fixturePath, port, latency):
+	"""Serve the fixtures as a stand-in PBDB and geocoder."""
+	server = FakeUpstream(fixturePath, latency).serve(port)
+	click.echo('http://127.0.0.1:%d' % server.server_address[1]) # run() reads this line; point PALEOBIODB_BASE_URL at <url>/data1.2 to use it by hand
+	sys.stdout.flush()
+	server.serve_forever()
+
+def startUpstream(fixturePath, latency):
+	upstreamProcess = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', '--fixtures', fixturePath, '--latency', str(latency)], stdout=subprocess.PIPE, text=True)
+	upstreamURL = upstreamProcess.stdout.readline().strip()
+	if not upstreamURL:
+		upstreamProcess.wait()
+		raise click.ClickException('The fixture server did not start')
+	return upstreamProcess, upstreamURL
+
+
+class FixtureGeocodeProvider:
+	# Stands in for dinosaur_geocode.GoogleProvider, asking the fixture server instead of Google
+	def __init__(self, geocodeURL):
+		self.geocodeURL = geocodeURL
+
+	def geocode(self, place):
+		geocodeJson = requests.get(self.geocodeURL, params={'address': place}, timeout=30).json()
+		if (geocodeJson['status'] != 'OK'):
+			return None
+		return (geocodeJson['lat'], geocodeJson['lng'])
+
+
+def summariseLatencies(seconds):
+	# Nearest-rank percentiles, in milliseconds
+	ordered = sorted(seconds)
+	if not ordered:
+		return {'count': 0}
+	def percentile(p):
+		return round(ordered[max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)] * 1000, 2)
+	return {'count': len(ordered), 'meanMs': round(sum(ordered) / len(ordered) * 1000, 2), 'p50Ms': percentile(50), 'p90Ms': percentile(90), 'p99Ms': percentile(99), 'maxMs': round(ordered[-1] * 1000, 2)}
+
+def median(values):
+	ordered = sorted(values)
+	if not ordered:
+		return None
+	return ordered[len(ordered) // 2]
+
+def getPeakRssKb():
+	# High-water mark of this process's resident set; ru_maxrss is in kilobytes on Linux but bytes on macOS
+	peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if (sys.platform == 'darwin'):
+		return peakRss // 1024
+	return peakRss
+
+class BenchmarkClient:
+	# One browser: a Flask test client with its own session, so each client gets its own client_id and search jobs
+	def __init__(self, app, pollSeconds=0.01):
+		self.client = app.test_client()
+		self.pollSeconds = pollSeconds
+
+	def startSearch(self, searchArgs):
+		searchResponse = self.client.get('/fossilsearch?' + urllib.parse.urlencode(searchArgs))
+		return searchResponse.headers['Location'].rsplit('/', 1)[-1]
+
+	def jobStatus(self, jobId):
+		return self.client.get('/searchjob/%s/status' % jobId).get_json()
+
+	def waitForJob(self, jobId):
+		while True:
+			jobStatus = self.jobStatus(jobId)
+			if (jobStatus['status'] not in ('queued', 'running')):
+				return jobStatus
+			time.sleep(self.pollSeconds)
+
+	def search(self, searchArgs):
+		# A whole search as a browser sees it: submit, wait on the progress page, load the results. Returns (seconds, final job status).
+		searchStart = time.perf_counter()
+		jobId = self.startSearch(searchArgs)
+		jobStatus = self.waitForJob(jobId)
+		resultsResponse = self.client.get('/searchjob/' + jobId, follow_redirects=True) # The job page redirects to /results once the search is done
+		resultsResponse.get_data()
+		return time.perf_counter() - searchStart, jobStatus
+
+def getSearchArgs(baseName, **searchArgs):
+	return dict({'taxonquery': baseName, 'locationquery': '', 'degrees': '1', 'geotimeradio': 'allpasteras'}, **searchArgs)
+
+def summariseSearches(searchLatencies, jobStatuses):
+	# Latencies plus the per-search counts and stage timings reported by the app's search stats (medians over the runs)
+	summary = {'latency': summariseLatencies(searchLatencies), 'statuses': dict(collections.Counter(jobStatus['status'] for jobStatus in jobStatuses))}
+	searchStats = [jobStatus['stats'] for jobStatus in jobStatuses if jobStatus.get('stats')]
+	if searchStats:
+		for statName in ('ingestedRows', 'dbStatements', 'upstreamFetches', 'cacheHits', 'mirrorHits'):
+			summary[statName] = median(stats[statName] for stats in searchStats)
+		summary['spansMs'] = {stage: round(median(stats['spans'].get(stage, 0.0) for stats in searchStats) * 1000, 2) for stage in sorted(set().union(*(stats['spans'] for stats in searchStats)))}
+		ingestRates = [stats['ingestedRows'] / (stats['spans']['ingest'] + stats['spans']['store']) for stats in searchStats if stats['ingestedRows'] and stats['spans'].get('ingest') and stats['spans'].get('store')]
+		if ingestRates: # Rows staged and stored per second of the app's own ingest and store stages, free of PBDB's latency and the fetch, geocode and marker stages
+			summary['ingestRecordsPerSecond'] = round(median(ingestRates))
+		if searchLatencies and summary['ingestedRows']: # The whole search, as the browser waits for it
+			summary['searchRecordsPerSecond'] = round(summary['ingestedRows'] / median(searchLatencies))
+	return summary
+
+def configureApp(workPath, upstreamURL, cache, **settings):
+	# Settings (read when dinosaur is imported) that point the app at the fixture server and a throwaway database in workPath
+	settingsPath = os.path.join(workPath, 'settings.py')
+	settings = dict({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workPath, 'dinosaur.db'), 'PALEOBIODB_BASE_URL': upstreamURL + '/data1.2', 'PALEOBIODB_CACHE': cache,
+		'PBDB_MIRROR_PATH': None, 'GEOCODE_CACHE_PATH': None, 'GAZETTEER_FILE': None, 'LOG_LEVEL': 'WARNING', 'DEBUG': False}, **settings)
+	with open(settingsPath, 'w') as settingsFile:
+		for name, value in settings.items():
+			settingsFile.write('%s = %r\n' % (name, value))
+	os.environ['DINOSAUR_SETTINGS'] = settingsPath
+	os.chdir(rootPath) # dinosaur.py reads static/ relative to the working directory
+
+def runBenchmark(upstreamURL, manifest, sizes, repeat, clients, cache):
+	# Points a fresh copy of the app at the fixture server and a throwaway database, then times each scenario in turn
+	workPath = tempfile.mkdtemp(prefix='dinosaur-benchmark-')
+	configureApp(workPath, upstreamURL, cache)
+	results = {'startup': {}, 'scenarios': collections.OrderedDict()}
+	try:
+		importStart = time.perf_counter()
+		import dinosaur
+		results['startup']['importSeconds'] = round(time.perf_counter() - importStart, 4)
+		import sqlalchemy
+		statementCount = [0]
+		statementCountLock = threading.Lock()
+		def countStatement(*args):
+			with statementCountLock:
+				statementCount[0] += 1
+		sqlalchemy.event.listen(sqlalchemy.engine.Engine, 'before_cursor_execute', countStatement)
+		dinosaur.placeGeocoder.providers = [FixtureGeocodeProvider(upstreamURL + '/geocode')]
+		app = dinosaur.app
+		with app.app_context():
+			dinosaur.db.create_all()
+			stepStart = time.perf_counter()
+			dinosaur.loadGeoTimeSnapshot()
+			results['startup']['timescaleSnapshotSeconds'] = round(time.perf_counter() - stepStart, 4)
+			stepStart = time.perf_counter()
+			dinosaur.create_GeoTime_objects(dinosaur.fetchGeoTimeRows()) # The fixtures' intervals, which the fake PBDB also filters by
+			results['startup']['timescaleUpstreamSeconds'] = round(time.perf_counter() - stepStart, 4)
+		results['startup']['peakRssKb'] = getPeakRssKb()
+		client = BenchmarkClient(app)
+
+		# The landing page, one client
+		client.client.get('/')
+		homeLatencies = []
+		statementsBefore = statementCount[0]
+		for index in range(repeat * 20):
+			requestStart = time.perf_counter()
+			client.client.get('/').get_data()
+			homeLatencies.append(time.perf_counter() - requestStart)
+		results['scenarios']['home'] = {'latency': summariseLatencies(homeLatencies), 'dbStatementsPerRequest': (statementCount[0] - statementsBefore) / float(len(homeLatencies)), 'peakRssKb': getPeakRssKb()}
+
+		# Whole-taxon searches of each fixture size, one at a time
+		for name in sizes:
+			baseName = manifest['occurrences'][name]['baseName']
+			searchLatencies = []
+			jobStatuses = []
+			for index in range(repeat):
+				searchSeconds, jobStatus = client.search(getSearchArgs(baseName))
+				searchLatencies.append(searchSeconds)
+				jobStatuses.append(jobStatus)
+			results['scenarios']['search-' + name] = dict(summariseSearches(searchLatencies, jobStatuses), peakRssKb=getPeakRssKb())
+
+		# A located, interval-limited search of the biggest fixture
+		largestName = sizes[-1]
+		if (locatedSearch['locationquery'] in manifest['places']):
+			searchLatencies = []
+			jobStatuses = []
+			for index in range(repeat):
+				searchSeconds, jobStatus = client.search(getSearchArgs(manifest['occurrences'][largestName]['baseName'], **locatedSearch))
+				searchLatencies.append(searchSeconds)
+				jobStatuses.append(jobStatus)
+			results['scenarios']['search-located-' + largestName] = dict(summariseSearches(searchLatencies, jobStatuses), peakRssKb=getPeakRssKb())
+
+		# /cancel while the biggest search is running: how long the request takes, and how long until the job has actually stopped
+		cancelLatencies = []
+		stopLatencies = []
+		completedFirst = 0
+		for index in range(repeat):
+			jobId = client.startSearch(getSearchArgs(manifest['occurrences'][largestName]['baseName']))
+			while (client.jobStatus(jobId)['status'] == 'queued'):
+				time.sleep(client.pollSeconds)
+			cancelStart = time.perf_counter()
+			client.client.get('/cancel')
+			cancelLatencies.append(time.perf_counter() - cancelStart)
+			jobStatus = client.waitForJob(jobId)
+			if (jobStatus['status'] == 'cancelled'):
+				stopLatencies.append(time.perf_counter() - cancelStart)
+			else:
+				completedFirst += 1
+		results['scenarios']['cancel-' + largestName] = {'latency': summariseLatencies(cancelLatencies), 'untilStopped': summariseLatencies(stopLatencies), 'completedBeforeCancel': completedFirst, 'peakRssKb': getPeakRssKb()}
+
+		# Several browsers at once, each alternating the landing page and a search of the middle fixture
+		concurrentName = sizes[len(sizes) // 2]
+		concurrentArgs = getSearchArgs(manifest['occurrences'][concurrentName]['baseName'])
+		def browse(benchmarkClient):
+			browseResults = []
+			for index in range(repeat):
+				requestStart = time.perf_counter()
+				benchmarkClient.client.get('/').get_data()
+				homeSeconds = time.perf_counter() - requestStart
+				searchSeconds, jobStatus = benchmarkClient.search(concurrentArgs)
+				browseResults.append((homeSeconds, searchSeconds, jobStatus))
+			return browseResults
+		benchmarkClients = [BenchmarkClient(app) for index in range(clients)]
+		statementsBefore = statementCount[0]
+		concurrentStart = time.perf_counter()
+		with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as clientPool:
+			browseResults = [browseResult for clientResults in clientPool.map(browse, benchmarkClients) for browseResult in clientResults]
+		concurrentSeconds = time.perf_counter() - concurrentStart
+		concurrentSummary = summariseSearches([searchSeconds for homeSeconds, searchSeconds, jobStatus in browseResults], [jobStatus for homeSeconds, searchSeconds, jobStatus in browseResults])
+		results['scenarios']['concurrent-' + concurrentName] = dict(concurrentSummary, clients=clients, seconds=round(concurrentSeconds, 3), searchesPerSecond=round(len(browseResults) / concurrentSeconds, 3),
+			pagesPerSecond=round(len(browseResults) * 3 / concurrentSeconds, 3), homeLatency=summariseLatencies([homeSeconds for homeSeconds, searchSeconds, jobStatus in browseResults]),
+			dbStatementsTotal=statementCount[0] - statementsBefore, peakRssKb=getPeakRssKb()) # Pages are /, /fossilsearch and the results page; status polls are not counted
+		results['peakRssKb'] = getPeakRssKb()
+		results['appConfig'] = {name: app.config[name] for name in ('PBDB_PAGE_SIZE', 'PBDB_FETCH_THREADS', 'SEARCH_JOB_WORKERS', 'PALEOBIODB_CACHE', 'RESULTS_PAGE_SIZE')}
+	finally:
+		shutil.rmtree(workPath, ignore_errors=True)
+	return results
+
+def getGitCommit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=rootPath, stderr=subprocess.DEVNULL, text=True).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--output', default='-', help='File for the JSON results; - prints them.')
+@click.option('--sizes', default=','.join(fixtureSizes), help='Fixtures to search, smallest first.')
+@click.option('--repeat', default=5, help='Runs of each scenario (x20 for the landing page).')
+@click.option('--clients', default=4, help='Simultaneous browsers in the concurrent scenario.')
+@click.option('--upstream-latency', 'upstreamLatency', default=0.0, help='Seconds the fake PBDB and geocoder wait before each response.')
+@click.option('--cache', default=None, help="PALEOBIODB_CACHE for the run; off by default, so every search reaches the fake PBDB.")
+def run(fixturePath, output, sizes, repeat, clients, upstreamLatency, cache):
+	"""Run the benchmark and report the results as JSON."""
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		click.echo('No fixtures in %s, generating synthetic ones' % fixturePath, err=True)
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	sizes = [name.strip() for name in sizes.split(',') if name.strip()]
+	for name in sizes:
+		if (name not in manifest['occurrences']):
+			raise click.BadParameter('no fixture called ' + name, param_hint='--sizes')
+	startedAt = datetime.datetime.now(datetime.timezone.utc).isoformat()
+	upstreamProcess, upstreamURL = startUpstream(fixturePath, upstreamLatency)
+	try:
+		results = runBenchmark(upstreamURL, manifest, sizes, repeat, clients, cache)
+	finally:
+		upstreamProcess.terminate()
+		upstreamProcess.wait()
+	results['run'] = {'startedAt': startedAt, 'commit': getGitCommit(), 'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+		'fixtures': {'source': manifest['source'], 'records': {name: manifest['occurrences'][name]['records'] for name in sizes}}, 'repeat': repeat, 'clients': clients, 'upstreamLatency': upstreamLatency}
+	resultsJson = json.dumps(results, indent=1, sort_keys=True)
+	if (output == '-'):
+		click.echo(resultsJson)
+	else:
+		with open(output, 'w') as outputFile:
+			outputFile.write(resultsJson + '\n')
+		click.echo('Results written to ' + output, err=True)
+
+def countCsvRows(csvText):
+	return sum(1 for row in csv.reader(io.StringIO(csvText))) - 1 # Less the header
+
+def runStressClients(upstreamURL, manifest, sizes, clients, searches, firstClient=0):
+	# One worker process's share of the stress run: clients browsers at once, each running its searches back to back on a different fixture from its neighbours, so small searches land while big ones are ingesting. A search passes if it finishes, ingests exactly its fixture's records and its browser then sees exactly those results. Returns (fixture name, seconds, seconds storing, problems) per search.
+	import dinosaur
+	dinosaur.placeGeocoder.providers = [FixtureGeocodeProvider(upstreamURL + '/geocode')]
+	app = dinosaur.app
+	def stressClient(clientNumber):
+		benchmarkClient = BenchmarkClient(app, pollSeconds=1.0) # As often as the progress page polls; faster polling here would take CPU from the searches being tested
+		clientResults = []
+		for index in range(searches):
+			name = sizes[(clientNumber + index) % len(sizes)]
+			expectedRows = manifest['occurrences'][name]['records']
+			searchSeconds, jobStatus = benchmarkClient.search(getSearchArgs(manifest['occurrences'][name]['baseName']))
+			problems = []
+			if (jobStatus['status'] != 'done'):
+				problems.append('status %s: %s' % (jobStatus['status'], jobStatus.get('message')))
+			elif (jobStatus['stats']['ingestedRows'] != expectedRows):
+				problems.append('ingested %d of %d records' % (jobStatus['stats']['ingestedRows'], expectedRows))
+			else:
+				exportedRows = countCsvRows(benchmarkClient.client.get('/export/csv').get_data(as_text=True))
+				if (exportedRows != expectedRows):
+					problems.append('browser sees %d results, expected %d' % (exportedRows, expectedRows))
+			clientResults.append((name, searchSeconds, (jobStatus.get('stats') or {}).get('spans', {}).get('store'), problems))
+		return clientResults
+	with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as clientPool:
+		return [searchResult for clientResults in clientPool.map(stressClient, range(firstClient, firstClient + clients)) for searchResult in clientResults]
+
+def runStress(upstreamURL, manifest, sizes, processes, clients, searches, pageSize, busyTimeout):
+	# Like a gunicorn deployment: processes copies of the app (started fresh, as spawned processes) share one database, each with clients browsers searching at once
+	workPath = tempfile.mkdtemp(prefix='dinosaur-stress-')
+	settings = {'SEARCH_JOB_WORKERS': clients, 'PBDB_PAGE_SIZE': pageSize} # Every client's search runs at once, over several slow pages
+	if (busyTimeout != None):
+		settings['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': busyTimeout, 'check_same_thread': False}}
+	configureApp(workPath, upstreamURL, None, **settings)
+	try:
+		import dinosaur
+		with dinosaur.app.app_context():
+			dinosaur.db.create_all()
+			dinosaur.loadGeoTimeSnapshot()
+		stressStart = time.perf_counter()
+		with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as processPool:
+			processFutures = [processPool.submit(runStressClients, upstreamURL, manifest, sizes, clients, searches, processNumber * clients) for processNumber in range(processes)]
+			searchResults = [searchResult for processFuture in processFutures for searchResult in processFuture.result()]
+		stressSeconds = time.perf_counter() - stressStart
+		with dinosaur.app.app_context():
+			storedSearchRuns = dinosaur.db.session.query(dinosaur.SearchRun).count()
+	finally:
+		shutil.rmtree(workPath, ignore_errors=True)
+	failures = ['%s search: %s' % (name, problem) for name, searchSeconds, storeSeconds, problems in searchResults for problem in problems]
+	return {'searches': len(searchResults), 'seconds': round(stressSeconds, 3), 'failures': failures, 'storedSearchRuns': storedSearchRuns,
+		'latency': {name: summariseLatencies([searchSeconds for resultName, searchSeconds, storeSeconds, problems in searchResults if resultName == name]) for name in sizes},
+		'storeLatency': {name: summariseLatencies([storeSeconds for resultName, searchSeconds, storeSeconds, problems in searchResults if (resultName == name) and (storeSeconds != None)]) for name in sizes}} # The write transaction, including any wait for the lock
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--sizes', default='small,10k', help='Fixtures the clients search, in rotation.')
+@click.option('--processes', default=4, help='App processes sharing the database.')
+@click.option('--clients', default=2, help='Browsers searching at the same time in each process.')
+@click.option('--searches', default=3, help='Searches per browser.')
+@click.option('--upstream-latency', 'upstreamLatency', default=0.5, help='Seconds the fake PBDB waits before each response.')
+@click.option('--page-size', 'pageSize', default=1000, help='PBDB_PAGE_SIZE for the run.')
+@click.option('--busy-timeout', 'busyTimeout', default=None, type=float, help="Seconds a search may wait for the SQLite write lock before failing; by default the app's own setting.")
+def stress(fixturePath, sizes, processes, clients, searches, upstreamLatency, pageSize, busyTimeout):
+	"""Run parallel searches against the fake PBDB and check each one gets its own results."""
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	sizes = [name.strip() for name in sizes.split(',') if name.strip()]
+	upstreamProcess, upstreamURL = startUpstream(fixturePath, upstreamLatency)
+	try:
+		results = runStress(upstreamURL, manifest, sizes, processes, clients, searches, pageSize, busyTimeout)
+	finally:
+		upstreamProcess.terminate()
+		upstreamProcess.wait()
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+	if results['failures']:
+		raise click.ClickException('%d of %d searches failed' % (len(results['failures']), results['searches']))
+
+
+def runSpatialBenchmark(points, queries, boxDegrees, radiusKm, seed):
+	# Stores points fossils of one search at uniformly random coordinates in a throwaway database, then times the same random boxes through fossil_rtree (fossilsInBox()) and through the lat/lng column scan it falls back to without one
+	workPath = tempfile.mkdtemp(prefix='dinosaur-spatial-')
+	configureApp(workPath, 'http://127.0.0.1:9', None) # Nothing is fetched
+	rng = random.Random(seed)
+	searchId = 'spatial-benchmark'
+	results = {}
+	try:
+		import dinosaur
+		with dinosaur.app.app_context():
+			dinosaur.db.create_all()
+			connection = dinosaur.db.session.connection()
+			stepStart = time.perf_counter()
+			taxonId = connection.exec_driver_sql("insert into taxon (phylum, class_, order_, family, genus) values ('Chordata', 'Reptilia', 'Ornithischia', 'Ceratopsidae', 'Triceratops')").lastrowid
+			for batchStart in range(0, points, 100000):
+				connection.exec_driver_sql('insert into fossil (search_id, taxon_id, fossilName, lat, lng) values (?, ?, ?, ?, ?)',
+					[(searchId, taxonId, 'Triceratops', rng.uniform(-90.0, 90.0), rng.uniform(-180.0, 180.0)) for index in range(batchStart, min(batchStart + 100000, points))])
+			dinosaur.db.session.commit()
+			results['loadSeconds'] = round(time.perf_counter() - stepStart, 3)
+			stepStart = time.perf_counter()
+			dinosaur.refresh_spatial_index(searchId)
+			dinosaur.db.session.commit()
+			results['indexSeconds'] = round(time.perf_counter() - stepStart, 3)
+			boxes = []
+			for index in range(queries):
+				latmin = rng.uniform(-85.0, 85.0 - boxDegrees)
+				lngmin = rng.uniform(-180.0, 180.0 - boxDegrees)
+				boxes.append((latmin, latmin + boxDegrees, lngmin, lngmin + boxDegrees))
+			def scanBox(latmin, latmax, lngmin, lngmax):
+				return dinosaur.loadFossilRecords(searchId, dinosaur.Fossil.lat.between(latmin, latmax), dinosaur.Fossil.lng.between(lngmin, lngmax))
+			mismatches = 0
+			rtreeLatencies = []
+			scanLatencies = []
+			matches = []
+			dinosaur.fossilsInBox(searchId, *boxes[0]) # Warms SQLite's page cache, so neither side pays for the first read
+			scanBox(*boxes[0])
+			for box in boxes:
+				queryStart = time.perf_counter()
+				rtreeFossils = dinosaur.fossilsInBox(searchId, *box)
+				rtreeLatencies.append(time.perf_counter() - queryStart)
+				queryStart = time.perf_counter()
+				scanFossils = scanBox(*box)
+				scanLatencies.append(time.perf_counter() - queryStart)
+				matches.append(len(rtreeFossils))
+				if ([fossil.id for fossil in rtreeFossils] != [fossil.id for fossil in scanFossils]):
+					mismatches += 1
+			radiusLatencies = []
+			for latmin, latmax, lngmin, lngmax in boxes:
+				queryStart = time.perf_counter()
+				dinosaur.fossilsInRadius(searchId, (latmin + latmax) / 2, (lngmin + lngmax) / 2, radiusKm)
+				radiusLatencies.append(time.perf_counter() - queryStart)
+		results.update({'box': {'rtree': summariseLatencies(rtreeLatencies), 'scan': summariseLatencies(scanLatencies), 'medianMatches': median(matches), 'mismatches': mismatches},
+			'radius': {'rtree': summariseLatencies(radiusLatencies)}, 'databaseBytes': os.path.getsize(os.path.join(workPath, 'dinosaur.db'))})
+	finally:
+		shutil.rmtree(workPath, ignore_errors=True)
+	return results
+
+@cli.command()
+@click.option('--points', default=1000000, help='Fossils stored.')
+@click.option('--queries', default=50, help='Random boxes queried each way.')
+@click.option('--box-degrees', 'boxDegrees', default=5.0, help='Side of each box.')
+@click.option('--radius-km', 'radiusKm', default=250.0, help='Radius of the fossilsInRadius() queries, centred on the boxes.')
+@click.option('--seed', default=1)
+def spatial(points, queries, boxDegrees, radiusKm, seed):
+	"""Time bounding-box and radius queries on the R*Tree against a column scan."""
+	results = runSpatialBenchmark(points, queries, boxDegrees, radiusKm, seed)
+	results['run'] = {'commit': getGitCommit(), 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'points': points, 'queries': queries, 'boxDegrees': boxDegrees, 'radiusKm': radiusKm, 'seed': seed}
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+	if results['box']['mismatches']:
+		raise click.ClickException('%d boxes found different fossils through the R*Tree and the scan' % results['box']['mismatches'])
+
+def measureIngest(ingest, repeat):
+	# Best of repeat untraced runs for the speed, then one run under tracemalloc (which follows every thread, so the fetch threads too) for the peak memory
+	runSeconds = []
+	for index in range(repeat):
+		runStart = time.perf_counter()
+		records = ingest()
+		runSeconds.append(time.perf_counter() - runStart)
+	tracemalloc.start()
+	ingest()
+	peakBytes = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return {'records': records, 'seconds': round(min(runSeconds), 4), 'recordsPerSecond': round(records / min(runSeconds)), 'peakMb': round(peakBytes / 1048576.0, 2)}
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--sizes', default=','.join(fixtureSizes), help='Occurrence fixtures to fetch.')
+@click.option('--repeat', default=3, help='Timed runs of each path; the best counts.')
+@click.option('--page-size', 'pageSize', default=5000, help='PBDB_PAGE_SIZE for the run.')
+def parser(fixturePath, sizes, repeat, pageSize):
+	"""Compare memory and speed of the app's streamed fetch-and-stage path with json.loads of the whole response."""
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	upstreamProcess, upstreamURL = startUpstream(fixturePath, 0.0) # A child process, so the served bodies don't count towards the app's memory
+	workPath = tempfile.mkdtemp(prefix='dinosaur-parser-')
+	try:
+		dinosaur = importOfflineApp(workPath, upstreamURL, PBDB_PAGE_SIZE=pageSize)
+		def streamed(paleobiodbURL): # What paleoSearch() does up to store_staged_fossils(): paged, parsed off the sockets and staged in batches
+			responseHeader = {}
+			with dinosaur.db.engine.connect() as connection:
+				paleobiodbRecords = dinosaur.iterPaleobiodbPages(paleobiodbURL, responseHeader, dinosaur.resetSearchStats(), threading.Event(), dinosaur.newSearchProgress())
+				return dinosaur.ingestPaleobiodbRecords(connection, paleobiodbRecords, responseHeader, 'benchmark')
+		def wholeResponse(paleobiodbURL): # The same staging, fed from one unpaged response read and decoded whole
+			responseHeader = json.loads(dinosaur.paleobiodbSession.get(paleobiodbURL, timeout=300).content)
+			paleobiodbRecords = responseHeader.pop('records')
+			with dinosaur.db.engine.connect() as connection:
+				return dinosaur.ingestPaleobiodbRecords(connection, iter(paleobiodbRecords), responseHeader, 'benchmark')
+		results = collections.OrderedDict()
+		with dinosaur.app.app_context():
+			for name in [name.strip() for name in sizes.split(',') if name.strip()]:
+				if (name not in manifest['occurrences']):
+					raise click.BadParameter('no fixture called ' + name, param_hint='--sizes')
+				paleobiodbURL = dinosaur.app.config['PALEOBIODB_BASE_URL'] + '/occs/list.json?rowcount&level=3&base_name=%s&show=full' % urllib.parse.quote(manifest['occurrences'][name]['baseName'], safe=',')
+				results[name] = {'streamed': measureIngest(lambda: streamed(paleobiodbURL), repeat), 'json.loads': measureIngest(lambda: wholeResponse(paleobiodbURL), repeat)}
+	finally:
+		upstreamProcess.terminate()
+		upstreamProcess.wait()
+		shutil.rmtree(workPath, ignore_errors=True)
+	results['run'] = {'commit': getGitCommit(), 'python': platform.python_version(), 'fixtures': manifest['source'], 'repeat': repeat, 'pageSize': pageSize,
+		'fetchThreads': dinosaur.app.config['PBDB_FETCH_THREADS'], 'fetchBuffer': dinosaur.app.config['PBDB_FETCH_BUFFER']}
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+
+
+def importOfflineApp(workPath, upstreamURL='http://127.0.0.1:9', **settings):
+	# The app on a throwaway database in workPath with the bundled timescale loaded, for the benchmarks that time one stage in-process; nothing is fetched unless upstreamURL is given
+	configureApp(workPath, upstreamURL, None, **settings)
+	import dinosaur
+	with dinosaur.app.app_context():
+		dinosaur.db.create_all()
+		dinosaur.loadGeoTimeSnapshot()
+	return dinosaur
+
+def bestRate(run, rows, repeat, setup=None):
+	# Rows per second over the fastest of repeat runs; setup (e.g. clearing a cache) runs before each one, outside the timing
+	runSeconds = []
+	for index in range(repeat):
+		if (setup != None):
+			setup()
+		runStart = time.perf_counter()
+		run()
+		runSeconds.append(time.perf_counter() - runStart)
+	return {'seconds': round(min(runSeconds), 4), 'rowsPerSecond': round(rows / min(runSeconds))}
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--sizes', default=','.join(fixtureSizes), help='Occurrence fixtures to process.')
+@click.option('--repeat', default=3, help='Timed runs of each path; the best counts.')
+@click.option('--batch-size', 'batchSize', default=1000, help='Records per batch, as ingestPaleobiodbRecords() hands them over.')
+def columns(fixturePath, sizes, repeat, batchSize):
+	"""Compare rows/s of buildFossilColumns() and the per-row path it replaced."""
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	workPath = tempfile.mkdtemp(prefix='dinosaur-columns-')
+	try:
+		dinosaur = importOfflineApp(workPath)
+		import dinosaur_location
+		def clearLabelCaches(): # Both paths start from cold label caches
+			dinosaur.getGeoTimeIndex().ageLabels.clear()
+			dinosaur_location.getLocation.cache_clear()
+		results = collections.OrderedDict()
+		with dinosaur.app.app_context():
+			for name in [name.strip() for name in sizes.split(',') if name.strip()]:
+				if (name not in manifest['occurrences']):
+					raise click.BadParameter('no fixture called ' + name, param_hint='--sizes')
+				paleobiodbRecords = readFixture(fixturePath, manifest['occurrences'][name]['file'])['records']
+				batches = [paleobiodbRecords[start:start + batchSize] for start in range(0, len(paleobiodbRecords), batchSize)]
+				results[name] = {'records': len(paleobiodbRecords),
+					'perRow': bestRate(lambda: [[dinosaur.buildFossilRow(record, 'benchmark') for record in batch] for batch in batches], len(paleobiodbRecords), repeat, clearLabelCaches),
+					'columnar': bestRate(lambda: [dinosaur.buildFossilColumns(batch, 'benchmark') for batch in batches], len(paleobiodbRecords), repeat, clearLabelCaches)}
+				results[name]['speedup'] = round(results[name]['columnar']['rowsPerSecond'] / float(results[name]['perRow']['rowsPerSecond']), 2)
+	finally:
+		shutil.rmtree(workPath, ignore_errors=True)
+	results['run'] = {'commit': getGitCommit(), 'python': platform.python_version(), 'fixtures': manifest['source'], 'repeat': repeat, 'batchSize': batchSize}
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+
+
+def storeFixtureSearch(dinosaur, paleobiodbRecords, searchId):
+	# Stores a fixture's records as search searchId the way paleoSearch() does, and reads them back as the map and results list get them
+	with dinosaur.db.engine.connect() as connection:
+		dinosaur.ingestPaleobiodbRecords(connection, iter(paleobiodbRecords), {}, searchId)
+		dinosaur.store_staged_fossils(connection, searchId)
+	return dinosaur.loadFossilRecords(searchId)
+
+def getChainIcon(taxonomy):
+	# The icon get_markers() chose for a taxonomy dict before the icon rule table, through its if/elif chain
+	if (taxonomy['class'] == 'Trilobita'):
+		return '/static/images/mapicons/trilobite.png'
+	elif (taxonomy['class'] == 'Saurischia'):
+		if (taxonomy['family'] == 'Camarasauridae' or taxonomy['family'] == 'Brachiosauridae' or taxonomy['family'] == 'Euhelopodidae' or taxonomy['family'] == 'Titanosauridae' or taxonomy['family'] == 'Mamenchisauridae' or taxonomy['family'] == 'Diplodocidae' or taxonomy['family'] == 'Massospondylidae' or taxonomy['family'] == 'Megaloolithidae' or taxonomy['family'] == 'Riojasauridae' or taxonomy['family'] == 'Plateosauridae' or taxonomy['family'] == 'Saltasauridae' or taxonomy['family'] == 'Faveoloolithidae' or taxonomy['family'] == 'Dicraeosauridae' or taxonomy['family'] == 'Nemegtosauridae' or taxonomy['family'] == 'Rebbachisauridae'):
+			return '/static/images/mapicons/brontosaurus.png'
+		else:
+			return '/static/images/mapicons/tyrannosaurus_rex.png'
+	elif (taxonomy['class'] == 'Ornithischia'):
+		if (taxonomy['order'] == 'Thyreophora'):
+			return '/static/images/mapicons/stegosaurus.png'
+		elif (taxonomy['family'] == 'Ceratopsidae'):
+			return '/static/images/mapicons/triceratops.png'
+		else:
+			return '/static/images/mapicons/stegosaurus.png'
+	elif (taxonomy['order'] == 'Pterosauria'):
+		return '/static/images/mapicons/pterodactyl.png'
+	elif (taxonomy['order'] == 'plesiosauridae' or taxonomy['order'] == 'ichthyosauridae'):
+		return '/static/images/mapicons/plesiosaur.png'
+	elif (taxonomy['family'] == 'Hominidae'):
+		return '/static/images/mapicons/cartoon_caveman.ico'
+	else:
+		return '/static/images/mapicons/townspeople-dinosaur-icon.png'
+
+def getChainMarkers(allFossils, dinosaur):
+	# get_markers() as it was before the icon rule table: getChainIcon() per fossil over a freshly built taxonomy dict, without the two debug print()s per fossil it also made
+	return [{'icon': getChainIcon(dinosaur.getTaxonomy(fossil.phylum, fossil.class_, fossil.order_, fossil.family, fossil.genus)), 'lat': fossil.lat, 'lng': fossil.lng, 'infobox': "<b style='color:red;'>" + fossil.fossilName + "</b>. " + fossil.location + ". " + fossil.age + "."} for fossil in allFossils]
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--sizes', default=','.join(fixtureSizes), help='Occurrence fixtures to build markers for.')
+@click.option('--repeat', default=5, help='Timed runs of each path; the best counts.')
+def markers(fixturePath, sizes, repeat):
+	"""Compare markers/s of get_markers() and the if/elif icon chain it replaced."""
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	workPath = tempfile.mkdtemp(prefix='dinosaur-markers-')
+	try:
+		dinosaur = importOfflineApp(workPath)
+		results = collections.OrderedDict()
+		with dinosaur.app.app_context():
+			for name in [name.strip() for name in sizes.split(',') if name.strip()]:
+				if (name not in manifest['occurrences']):
+					raise click.BadParameter('no fixture called ' + name, param_hint='--sizes')
+				allFossils = storeFixtureSearch(dinosaur, readFixture(fixturePath, manifest['occurrences'][name]['file'])['records'], name)
+				ruleMarkers, chainMarkers = dinosaur.get_markers(allFossils), getChainMarkers(allFossils, dinosaur)
+				results[name] = {'markers': len(allFossils), 'iconMismatches': sum(1 for ruleMarker, chainMarker in zip(ruleMarkers, chainMarkers) if ruleMarker != chainMarker),
+					'ifChain': bestRate(lambda: getChainMarkers(allFossils, dinosaur), len(allFossils), repeat),
+					'ruleTable': bestRate(lambda: dinosaur.get_markers(allFossils), len(allFossils), repeat, dinosaur.getMarkerIcon.cache_clear)} # The icon memo starts cold on every run
+				results[name]['speedup'] = round(results[name]['ruleTable']['rowsPerSecond'] / float(results[name]['ifChain']['rowsPerSecond']), 2)
+	finally:
+		shutil.rmtree(workPath, ignore_errors=True)
+	results['run'] = {'commit': getGitCommit(), 'python': platform.python_version(), 'fixtures': manifest['source'], 'repeat': repeat}
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+
+
+def getPycountryLocation(pycountry, nation, state, county, geocomments):
+	# The location label as it was made before the precomputed country table: the nation looked up in pycountry on every call (by alpha_2, since current pycountry no longer takes the old alpha2 keyword, and without the print() it made), then the old getLocation() branches
+	if (nation == None):
+		nationName = None
+	elif (nation == 'UK'):
+		nationName = "Great Britain"
+	elif (nation == 'TU'):
+		nationName = "Tuva (Russian Federation)"
+	elif (nation == 'AA'):
+		nationName = "Antarctica"
+	else:
+		country = pycountry.countries.get(alpha_2=nation)
+		nationName = nation if (country == None) else country.name
+	if (nationName == None) and (state == None) and (county == None):
+		if (geocomments != None):
+			return geocomments
+		return "Location undisclosed"
+	if (nationName == 'Great Britain'):
+		if (state == None):
+			return 'Great Britain'
+		elif (state == 'England' or 'Scotland' or 'Wales' or 'Northern Ireland'):
+			if (county == None):
+				return state
+			return (county + ", " + state)
+	elif (nationName == 'United States'):
+		if (county == None):
+			return state
+		return (county + ", " + state)
+	elif (nationName == None): # The old code crashed on a county with no state; joined here instead
+		return ", ".join(part for part in (county, state) if part != None)
+	elif (state == None):
+		return nationName
+	elif (county == None):
+		return (state + ", " + nationName)
+	return (county + ", " + state + ", " + nationName)
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--sizes', default=','.join(fixtureSizes), help='Occurrence fixtures to label.')
+@click.option('--repeat', default=5, help='Timed runs of each path; the best counts.')
+def locations(fixturePath, sizes, repeat):
+	"""Compare labels/s of dinosaur_location and the pycountry lookups it replaced."""
+	import dinosaur_location
+	try:
+		import pycountry
+	except ImportError: # Optional: without it only the current paths are timed
+		pycountry = None
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	results = collections.OrderedDict()
+	for name in [name.strip() for name in sizes.split(',') if name.strip()]:
+		if (name not in manifest['occurrences']):
+			raise click.BadParameter('no fixture called ' + name, param_hint='--sizes')
+		localities = [(record.get('cc2'), record.get('stp'), record.get('cny'), record.get('ggc')) for record in readFixture(fixturePath, manifest['occurrences'][name]['file'])['records']]
+		results[name] = {'labels': len(localities),
+			'table': bestRate(lambda: [dinosaur_location.getLocation.__wrapped__(*locality) for locality in localities], len(localities), repeat),
+			'memoised': bestRate(lambda: [dinosaur_location.getLocation(*locality) for locality in localities], len(localities), repeat, dinosaur_location.getLocation.cache_clear),
+			'batch': bestRate(lambda: dinosaur_location.getLocations(localities), len(localities), repeat, dinosaur_location.getLocation.cache_clear)}
+		if (pycountry != None):
+			results[name]['pycountry'] = bestRate(lambda: [getPycountryLocation(pycountry, *locality) for locality in localities], len(localities), repeat)
+			results[name]['speedup'] = round(results[name]['batch']['rowsPerSecond'] / float(results[name]['pycountry']['rowsPerSecond']), 2)
+			results[name]['labelsChanged'] = sum(1 for locality in localities if getPycountryLocation(pycountry, *locality) != dinosaur_location.getLocation(*locality)) # On purpose, e.g. other British states now keep ", Great Britain"
+	results['run'] = {'commit': getGitCommit(), 'python': platform.python_version(), 'fixtures': manifest['source'], 'repeat': repeat, 'pycountry': None if (pycountry == None) else getattr(pycountry, '__version__', 'unknown')}
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+
+
+def createPickledFossilTable(databasePath, fossilRows):
+	# The fossil table as it was before the columnar schema, with the taxonomy dict and [lat, lng] pair pickled into each row, in its own SQLite file. Returns (engine, mapped class) for reading it back as the app did, through the ORM.
+	import sqlalchemy, sqlalchemy.orm
+	class PickledBase(sqlalchemy.orm.DeclarativeBase):
+		pass
+	class PickledFossil(PickledBase):
+		__tablename__ = 'fossil'
+		id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+		fossilName = sqlalchemy.Column(sqlalchemy.String(80))
+		taxonomy = sqlalchemy.Column(sqlalchemy.PickleType)
+		location = sqlalchemy.Column(sqlalchemy.String(100))
+		age = sqlalchemy.Column(sqlalchemy.String(50))
+		coordinatePairs = sqlalchemy.Column(sqlalchemy.PickleType)
+		paleoenv = sqlalchemy.Column(sqlalchemy.String(30))
+		geocomments = sqlalchemy.Column(sqlalchemy.String(200))
+		nation = sqlalchemy.Column(sqlalchemy.String(40))
+		state = sqlalchemy.Column(sqlalchemy.String(40))
+		county = sqlalchemy.Column(sqlalchemy.String(80))
+		geologicAge = sqlalchemy.Column(sqlalchemy.String(30))
+		max_ma = sqlalchemy.Column(sqlalchemy.Float)
+		min_ma = sqlalchemy.Column(sqlalchemy.Float)
+		lat = sqlalchemy.Column(sqlalchemy.Float)
+		lng = sqlalchemy.Column(sqlalchemy.Float)
+	engine = sqlalchemy.create_engine('sqlite:///' + databasePath)
+	PickledBase.metadata.create_all(engine)
+	pickledColumns = [column.name for column in PickledFossil.__table__.columns if column.name != 'id']
+	with sqlalchemy.orm.Session(engine) as session:
+		session.execute(sqlalchemy.insert(PickledFossil), [dict({name: fossilRow.get(name) for name in pickledColumns}, coordinatePairs=[fossilRow['lat'], fossilRow['lng']]) for fossilRow in fossilRows])
+		session.commit()
+	return engine, PickledFossil
+
+def getPickledMarkers(allFossils):
+	# get_markers() over the pickled schema's rows, as it was then (less its print()s): the unpickled taxonomy dict and coordinate pair of each row
+	return [{'icon': getChainIcon(fossil.taxonomy), 'lat': fossil.coordinatePairs[0], 'lng': fossil.coordinatePairs[1], 'infobox': "<b style='color:red;'>" + fossil.fossilName + "</b>. " + fossil.location + ". " + fossil.age + "."} for fossil in allFossils]
+
+def getTableBytes(connection, tableNames):
+	# Bytes on disk of the named tables with their indexes, from SQLite's dbstat; the R*Tree is left out, as both layouts had one
+	return connection.exec_driver_sql('select coalesce(sum(pgsize), 0) from dbstat where name in (select name from sqlite_master where tbl_name in (%s))' % ', '.join("'%s'" % tableName for tableName in tableNames)).scalar()
+
+@cli.command()
+@click.option('--fixtures', 'fixturePath', default=defaultFixturePath, help='Generated first if the directory has no fixtures.')
+@click.option('--sizes', default=','.join(fixtureSizes), help='Occurrence fixtures to store.')
+@click.option('--repeat', default=3, help='Timed runs of each path; the best counts.')
+def schema(fixturePath, sizes, repeat):
+	"""Compare loading a stored search and building its markers from the pickled fossil table and the columnar schema."""
+	import sqlalchemy.orm
+	if not os.path.exists(os.path.join(fixturePath, 'manifest.json')):
+		generateFixtures(fixturePath)
+	manifest = readManifest(fixturePath)
+	workPath = tempfile.mkdtemp(prefix='dinosaur-schema-')
+	try:
+		dinosaur = importOfflineApp(workPath)
+		results = collections.OrderedDict()
+		with dinosaur.app.app_context():
+			for name in [name.strip() for name in sizes.split(',') if name.strip()]:
+				if (name not in manifest['occurrences']):
+					raise click.BadParameter('no fixture called ' + name, param_hint='--sizes')
+				paleobiodbRecords = readFixture(fixturePath, manifest['occurrences'][name]['file'])['records']
+				storeFixtureSearch(dinosaur, paleobiodbRecords, name)
+				pickledEngine, PickledFossil = createPickledFossilTable(os.path.join(workPath, 'pickled-%s.db' % name), [dinosaur.buildFossilRow(record, name) for record in paleobiodbRecords])
+				def loadPickled(): # Fossil.query.all() on a fresh session, as the results page did
+					with sqlalchemy.orm.Session(pickledEngine) as session:
+						return session.query(PickledFossil).order_by(PickledFossil.id).all()
+				def loadColumnar():
+					dinosaur.db.session.expire_all()
+					return dinosaur.loadFossilRecords(name)
+				pickledFossils, columnarFossils = loadPickled(), loadColumnar()
+				results[name] = {'fossils': len(columnarFossils),
+					'pickled': {'load': bestRate(loadPickled, len(pickledFossils), repeat), 'markers': bestRate(lambda: getPickledMarkers(pickledFossils), len(pickledFossils), repeat)},
+					'columnar': {'load': bestRate(loadColumnar, len(columnarFossils), repeat), 'markers': bestRate(lambda: dinosaur.get_markers(columnarFossils), len(columnarFossils), repeat, dinosaur.getMarkerIcon.cache_clear)},
+					'markerMismatches': sum(1 for pickledMarker, columnarMarker in zip(getPickledMarkers(pickledFossils), dinosaur.get_markers(columnarFossils)) if pickledMarker != columnarMarker)}
+				with pickledEngine.connect() as connection:
+					results[name]['pickled']['tableBytes'] = getTableBytes(connection, ['fossil'])
+				pickledEngine.dispose()
+				with dinosaur.db.engine.connect() as connection:
+					results[name]['columnar']['tableBytes'] = getTableBytes(connection, ['fossil', 'taxon'])
+				for layout in ('pickled', 'columnar'):
+					results[name][layout]['totalSeconds'] = round(results[name][layout]['load']['seconds'] + results[name][layout]['markers']['seconds'], 4)
+				results[name]['speedup'] = round(results[name]['pickled']['totalSeconds'] / results[name]['columnar']['totalSeconds'], 2)
+				dinosaur.clear_db(name) # So the next fixture's table sizes are its own
+				with dinosaur.db.engine.connect() as connection:
+					connection.exec_driver_sql('vacuum')
+	finally:
+		shutil.rmtree(workPath, ignore_errors=True)
+	results['run'] = {'commit': getGitCommit(), 'python': platform.python_version(), 'fixtures': manifest['source'], 'repeat': repeat}
+	click.echo(json.dumps(results, indent=1, sort_keys=True))
+
+
+if __name__ == '__main__':
+	cli()
@@ -0,0 +1,202 @@
+import collections, logging, os, sqlite3, threading, time, urllib.parse
+
+# Response cache for PaleoBioDB queries. Entries are keyed on the normalised query parameters of the request URL
+# (taxon list, lat/lng box, interval...), so the same search typed two slightly different ways shares one entry.
+# Two storage backends are provided (in-process LRU and on-disk SQLite); ResponseCache adds TTL and
+# stale-while-revalidate on top of either one.
+
+
+def normaliseQueryURL(url, coordinateDigits=4):
+	# Returns a canonical cache key for a PaleoBioDB URL: host + path + sorted query parameters, with taxon names lowercased and sorted, and lat/lng bounds rounded to coordinateDigits places
+	parsedURL = urllib.parse.urlsplit(url)
+	queryParams = []
+	for name, value in urllib.parse.parse_qsl(parsedURL.query, keep_blank_values=True):
+		name = name.lower()
+		if name in ('base_name', 'taxon_name', 'interval'):
+			value = ",".join(sorted(part.strip().lower() for part in value.split(",") if part.strip()))
+		elif name in ('lngmin', 'lngmax', 'latmin', 'latmax', 'min_ma', 'max_ma'):
+			try:
+				value = repr(round(float(value), coordinateDigits))
+			except ValueError:
+				pass
+		queryParams.append((name, value))
+	queryParams.sort()
+	return parsedURL.netloc.lower() + parsedURL.path + "?" + urllib.parse.urlencode(queryParams)
+
+
+class MemoryCacheBackend:
+	# In-process LRU store of key -> (body, storedAt), bounded by the total size of the bodies
+	def __init__(self, maxBytes):
+		self.maxBytes = maxBytes
+		self.entries = collections.OrderedDict()
+		self.totalBytes = 0
+		self.evictions = 0
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			if key not in self.entries:
+				return None
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+	def set(self, key, body, storedAt):
+		with self.lock:
+			if key in self.entries:
+				self.totalBytes -= len(self.entries.pop(key)[0])
+			self.entries[key] = (body, storedAt)
+			self.totalBytes += len(body)
+			while (self.totalBytes > self.maxBytes) and self.entries:
+				self.totalBytes -= len(self.entries.popitem(last=False)[1][0])
+				self.evictions += 1
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.totalBytes = 0
+
+
+class SQLiteCacheBackend:
+	# On-disk store of key -> (body, storedAt) in its own SQLite file, evicting least recently used entries once the bodies exceed maxBytes. Survives restarts.
+	def __init__(self, path, maxBytes):
+		self.path = path
+		self.maxBytes = maxBytes
+		self.evictions = 0
+		self.lock = threading.Lock()
+		with self.connect() as connection:
+			connection.execute('create table if not exists responses(cachekey text primary key, body blob, stored_at float, used_at float, size integer)')
+			connection.execute('create index if not exists responses_used_at on responses(used_at)')
+
+	def connect(self):
+		return sqlite3.connect(self.path, timeout=30)
+
+	def get(self, key):
+		with self.lock, self.connect() as connection:
+			row = connection.execute('select body, stored_at from responses where cachekey = ?', (key,)).fetchone()
+			if row == None:
+				return None
+			connection.execute('update responses set used_at = ? where cachekey = ?', (time.time(), key))
+			return (bytes(row[0]), row[1])
+
+	def set(self, key, body, storedAt):
+		with self.lock, self.connect() as connection:
+			connection.execute('insert or replace into responses values (?, ?, ?, ?, ?)', (key, body, storedAt, time.time(), len(body)))
+			totalBytes = connection.execute('select coalesce(sum(size), 0) from responses').fetchone()[0]
+			while totalBytes > self.maxBytes:
+				oldest = connection.execute('select cachekey, size from responses order by used_at limit 1').fetchone()
+				if oldest == None:
+					break
+				connection.execute('delete from responses where cachekey = ?', (oldest[0],))
+				totalBytes -= oldest[1]
+				self.evictions += 1
+
+	def clear(self):
+		with self.lock, self.connect() as connection:
+			connection.execute('delete from responses')
+
+
+class ResponseCache:
+	# TTL + stale-while-revalidate policy over a backend. Entries younger than ttl are served as-is; entries up to ttl + staleTtl old are served immediately while refetch() refreshes them on a background thread; anything older is a miss.
+	def __init__(self, backend, ttl, staleTtl=0, maxEntryBytes=None):
+		self.backend = backend
+		self.ttl = ttl
+		self.staleTtl = staleTtl
+		self.maxEntryBytes = maxEntryBytes
+		self.hits = 0
+		self.staleHits = 0
+		self.misses = 0
+		self.revalidating = set()
+		self.lock = threading.Lock()
+
+	def get(self, key, refetch=None):
+		# Returns the cached body for key, or None on a miss. refetch() (returning fresh bytes) is used to revalidate stale entries.
+		entry = self.backend.get(key)
+		if entry != None:
+			body, storedAt = entry
+			age = time.time() - storedAt
+			if age <= self.ttl:
+				self.count('hits')
+				return body
+			if (age <= self.ttl + self.staleTtl) and (refetch != None):
+				self.count('staleHits')
+				self.revalidate(key, refetch)
+				return body
+		self.count('misses')
+		return None
+
+	def count(self, counterName):
+		# get() runs on every fetch thread at once, and += on an attribute isn't atomic, so the counters are bumped under the lock
+		with self.lock:
+			setattr(self, counterName, getattr(self, counterName) + 1)
+
+	def set(self, key, body):
+		if (self.maxEntryBytes == None) or (len(body) <= self.maxEntryBytes):
+			self.backend.set(key, body, time.time())
+
+	def revalidate(self, key, refetch):
+		with self.lock:
+			if key in self.revalidating:
+				return
+			self.revalidating.add(key)
+		def refresh():
+			try:
+				self.set(key, refetch())
+			except Exception as error:
+				logging.getLogger(__name__).warning("Cache revalidation failed for %s: %s", key, error)
+			finally:
+				with self.lock:
+					self.revalidating.discard(key)
+		threading.Thread(target=refresh, daemon=True).start()
+
+	def clear(self):
+		self.backend.clear()
+
+	def stats(self):
+		with self.lock:
+			return {'hits': self.hits, 'staleHits': self.staleHits, 'misses': self.misses, 'evictions': self.backend.evictions}
+
+
+class CachingReader:
+	# Wraps an HTTP response so it can still be streamed by the caller; the bytes read are also collected, and stored in the cache when the caller calls commit() after reading the stream to its end and checking the body. Bodies bigger than the cache's maxEntryBytes are not collected at all.
+	def __init__(self, response, cache, key):
+		self.response = response
+		self.cache = cache
+		self.key = key
+		self.chunks = []
+		self.size = 0
+		self.complete = False
+
+	def read(self, size=-1):
+		chunk = self.response.read(size)
+		if self.chunks != None:
+			if chunk:
+				self.size += len(chunk)
+				if (self.cache.maxEntryBytes != None) and (self.size > self.cache.maxEntryBytes):
+					self.chunks = None
+				else:
+					self.chunks.append(chunk)
+			if (size == None) or (size < 0) or ((not chunk) and (size != 0)): # A read of the whole body, or the empty read at the end of the stream
+				self.complete = True
+		return chunk
+
+	def commit(self):
+		# Stores the body in the cache; does nothing unless the whole body has been read (and fit in maxEntryBytes)
+		if self.complete and (self.chunks != None):
+			self.cache.set(self.key, b"".join(self.chunks))
+		self.chunks = None
+
+	def close(self):
+		self.response.close()
+
+
+def createResponseCache(config):
+	# Builds the ResponseCache described by the app config, or returns None when PALEOBIODB_CACHE is off
+	backendName = config.get('PALEOBIODB_CACHE')
+	maxBytes = config.get('PALEOBIODB_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+	if backendName == 'memory':
+		backend = MemoryCacheBackend(maxBytes)
+	elif backendName == 'sqlite':
+		backend = SQLiteCacheBackend(config.get('PALEOBIODB_CACHE_PATH', os.path.join(os.getcwd(), 'pbdb_cache.db')), maxBytes)
+	else:
+		return None
+	return ResponseCache(backend, config.get('PALEOBIODB_CACHE_TTL', 24 * 60 * 60), config.get('PALEOBIODB_CACHE_STALE', 7 * 24 * 60 * 60), config.get('PALEOBIODB_CACHE_MAX_ENTRY_BYTES', maxBytes // 4))
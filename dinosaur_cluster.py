@@ -0,0 +1,72 @@
+import array, math
+
+# Server-side grid clustering of map markers. A MarkerClusterIndex is built once per result set: for every zoom level
+# up to maxZoom the markers are bucketed into square cells of cellPixels screen pixels (Web Mercator, 256px tiles),
+# so answering "what is visible at this zoom in this viewport" is a scan over pre-aggregated cells rather than over
+# every fossil. Cells holding a single fossil come back as that fossil's marker; the rest as {lat, lng, count}.
+# Each level's cells are packed into arrays (see packCells()), about 24 bytes a cell rather than a list of boxed numbers.
+
+
+def mercatorXY(lat, lng):
+	# World position of a point as fractions (0..1) of the map's width and height
+	lat = min(max(lat, -85.05112878), 85.05112878)
+	x = (lng + 180.0) / 360.0
+	sinLat = math.sin(math.radians(lat))
+	y = 0.5 - math.log((1 + sinLat) / (1 - sinLat)) / (4 * math.pi)
+	return (x, y)
+
+def inViewport(lat, lng, latmin, latmax, lngmin, lngmax):
+	# A viewport with lngmin > lngmax wraps across the antimeridian
+	if not (latmin <= lat <= latmax):
+		return False
+	if lngmin <= lngmax:
+		return lngmin <= lng <= lngmax
+	return (lng >= lngmin) or (lng <= lngmax)
+
+
+def packCells(cells):
+	# [count, sumLat, sumLng, first marker index] lists -> one array per column
+	counts, sumLats, sumLngs, indexes = array.array('I'), array.array('d'), array.array('d'), array.array('I')
+	for count, sumLat, sumLng, index in cells:
+		counts.append(count)
+		sumLats.append(sumLat)
+		sumLngs.append(sumLng)
+		indexes.append(index)
+	return (counts, sumLats, sumLngs, indexes)
+
+
+class MarkerClusterIndex:
+	def __init__(self, markers, maxZoom=14, cellPixels=60):
+		self.markers = markers
+		self.maxZoom = maxZoom
+		self.levels = []
+		positions = [mercatorXY(marker['lat'], marker['lng']) for marker in markers]
+		for zoom in range(maxZoom + 1):
+			cellsPerWorld = 256 * (2 ** zoom) / cellPixels
+			cells = {}
+			for index, (x, y) in enumerate(positions):
+				cellKey = (int(x * cellsPerWorld), int(y * cellsPerWorld))
+				cell = cells.get(cellKey)
+				if cell == None:
+					cells[cellKey] = [1, markers[index]['lat'], markers[index]['lng'], index]
+				else:
+					cell[0] += 1
+					cell[1] += markers[index]['lat']
+					cell[2] += markers[index]['lng']
+			self.levels.append(packCells(cells.values()))
+
+	def query(self, zoom, latmin=-90.0, latmax=90.0, lngmin=-180.0, lngmax=180.0):
+		# Returns {'clusters': [{lat, lng, count}], 'markers': [marker, ...]} for the viewport at this zoom. Past maxZoom every fossil is shown individually.
+		clusters = []
+		markers = []
+		if zoom > self.maxZoom:
+			markers = [marker for marker in self.markers if inViewport(marker['lat'], marker['lng'], latmin, latmax, lngmin, lngmax)]
+			return {'clusters': clusters, 'markers': markers}
+		for count, sumLat, sumLng, index in zip(*self.levels[max(zoom, 0)]):
+			if count == 1:
+				marker = self.markers[index]
+				if inViewport(marker['lat'], marker['lng'], latmin, latmax, lngmin, lngmax):
+					markers.append(marker)
+			elif inViewport(sumLat / count, sumLng / count, latmin, latmax, lngmin, lngmax):
+				clusters.append({'lat': sumLat / count, 'lng': sumLng / count, 'count': count})
+		return {'clusters': clusters, 'markers': markers}
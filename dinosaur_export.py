@@ -0,0 +1,181 @@
+import csv, functools, io, json, math, operator, struct, zlib
+
+# Streaming encoders for search results. Each takes an iterator of fossil rows (FossilRecords, or anything with the
+# fields below as attributes) and yields the encoded output a batch of rows at a time, so a 100k-row export never
+# holds more than one batch in memory. compressChunks() gzip- or brotli-compresses any such stream on the fly.
+#
+# The binary format ("bin") is for analysts who want the rows small and quick to parse:
+#   magic b'DINOFOS\x01', then uvarint field count and per field: uvarint name length, UTF-8 name, type byte (b'f' or b's')
+#   each row: b'\x01', then per field in order: a little-endian float32 (NaN for no value) for 'f' fields; for 's' fields
+#   a uvarint ref: 0 = no value, 1 = a new string follows (uvarint length + UTF-8), n >= 2 = string table entry n - 2
+#   end of rows: b'\x00'
+# New strings join the string table until it holds maxBinaryStrings entries; later new strings are always sent inline.
+# readFossilBinary() decodes it.
+
+exportFloatFields = ('lat', 'lng', 'max_ma', 'min_ma')
+exportStringFields = ('fossilName', 'location', 'age', 'paleoenv', 'geocomments', 'nation', 'state', 'county', 'geologicAge', 'phylum', 'class_', 'order_', 'family', 'genus')
+exportFields = exportFloatFields + exportStringFields
+exportFieldNames = {'class_': 'class', 'order_': 'order'} # Column names as they appear in exports
+binaryMagic = b'DINOFOS\x01'
+maxBinaryStrings = 65536
+
+
+getRowValues = operator.attrgetter(*exportFields)
+
+def iterBatches(rows, batchSize):
+	batch = []
+	for row in rows:
+		batch.append(getRowValues(row))
+		if len(batch) >= batchSize:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def geojsonChunks(rows, batchSize=1000):
+	# A FeatureCollection of Points ([lng, lat], as GeoJSON orders them); fossils without coordinates get a null geometry
+	yield '{"type":"FeatureCollection","features":['
+	separator = ''
+	for batch in iterBatches(rows, batchSize):
+		features = []
+		for values in batch:
+			lat, lng = values[0], values[1]
+			geometry = None
+			if (lat != None) and (lng != None):
+				geometry = {'type': 'Point', 'coordinates': [lng, lat]}
+			properties = {exportFieldNames.get(field, field): value for field, value in zip(exportFields[2:], values[2:])}
+			features.append(json.dumps({'type': 'Feature', 'geometry': geometry, 'properties': properties}, separators=(',', ':')))
+		yield separator + ','.join(features)
+		separator = ','
+	yield ']}'
+
+def csvChunks(rows, batchSize=1000):
+	# Header row, then one row per fossil; missing values are empty cells
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow([exportFieldNames.get(field, field) for field in exportFields])
+	for batch in iterBatches(rows, batchSize):
+		writer.writerows([['' if value == None else value for value in values] for values in batch])
+		yield buffer.getvalue()
+		buffer.seek(0)
+		buffer.truncate()
+	yield buffer.getvalue()
+
+def encodeUvarint(number):
+	encoded = bytearray()
+	while number >= 0x80:
+		encoded.append((number & 0x7f) | 0x80)
+		number >>= 7
+	encoded.append(number)
+	return bytes(encoded)
+
+def binaryChunks(rows, batchSize=1000):
+	header = [binaryMagic, encodeUvarint(len(exportFields))]
+	for field in exportFields:
+		fieldName = exportFieldNames.get(field, field).encode('UTF-8')
+		header += [encodeUvarint(len(fieldName)), fieldName, b'f' if field in exportFloatFields else b's']
+	yield b''.join(header)
+	floatStruct = struct.Struct('<%df' % len(exportFloatFields))
+	stringRefs = {} # string -> its encoded table ref
+	for batch in iterBatches(rows, batchSize):
+		encoded = []
+		for values in batch:
+			encoded.append(b'\x01')
+			encoded.append(floatStruct.pack(*[math.nan if value == None else value for value in values[:len(exportFloatFields)]]))
+			for value in values[len(exportFloatFields):]:
+				if (value == None):
+					encoded.append(b'\x00')
+				elif (value in stringRefs):
+					encoded.append(stringRefs[value])
+				else:
+					if (len(stringRefs) < maxBinaryStrings):
+						stringRefs[value] = encodeUvarint(len(stringRefs) + 2)
+					encodedValue = value.encode('UTF-8')
+					encoded.append(b'\x01' + encodeUvarint(len(encodedValue)) + encodedValue)
+		yield b''.join(encoded)
+	yield b'\x00'
+
+def readUvarint(binaryFile):
+	number = 0
+	shift = 0
+	while True:
+		byte = binaryFile.read(1)[0]
+		number |= (byte & 0x7f) << shift
+		if not (byte & 0x80):
+			return number
+		shift += 7
+
+def readFossilBinary(binaryFile):
+	# Yields each row of a "bin" export as a dict of field name -> value (None where there is none)
+	if (binaryFile.read(len(binaryMagic)) != binaryMagic):
+		raise ValueError('Not a fossil export')
+	fields = []
+	for index in range(readUvarint(binaryFile)):
+		fieldName = binaryFile.read(readUvarint(binaryFile)).decode('UTF-8')
+		fields.append((fieldName, binaryFile.read(1)))
+	floatCount = sum(1 for fieldName, fieldType in fields if fieldType == b'f')
+	floatStruct = struct.Struct('<%df' % floatCount)
+	strings = []
+	while (binaryFile.read(1) == b'\x01'):
+		floats = iter(floatStruct.unpack(binaryFile.read(floatStruct.size)))
+		row = {}
+		for fieldName, fieldType in fields:
+			if (fieldType == b'f'):
+				value = next(floats)
+				row[fieldName] = None if math.isnan(value) else value
+				continue
+			ref = readUvarint(binaryFile)
+			if (ref == 0):
+				row[fieldName] = None
+			elif (ref == 1):
+				row[fieldName] = binaryFile.read(readUvarint(binaryFile)).decode('UTF-8')
+				if (len(strings) < maxBinaryStrings):
+					strings.append(row[fieldName])
+			else:
+				row[fieldName] = strings[ref - 2]
+		yield row
+
+# format -> (mimetype, file extension, encoder)
+exportFormats = {
+	'geojson': ('application/geo+json', 'geojson', geojsonChunks),
+	'csv': ('text/csv; charset=utf-8', 'csv', csvChunks),
+	'bin': ('application/octet-stream', 'bin', binaryChunks),
+	}
+
+
+@functools.lru_cache(maxsize=None)
+def getBrotli():
+	# brotli (pip install brotli) is optional; without it responses are only offered gzip-compressed
+	try:
+		import brotli
+	except ImportError:
+		return None
+	return brotli
+
+def getContentEncodings():
+	# The encodings compressChunks() can produce here, best first
+	if (getBrotli() != None):
+		return ('br', 'gzip')
+	return ('gzip',)
+
+def compressChunks(chunks, encoding, level=6, bufferBytes=16384):
+	# Compresses a stream of str/bytes chunks as they come. Small chunks (template output arrives a few bytes at a time) are gathered up to bufferBytes, and each flush is a sync flush, so the browser can start on the page before it is complete.
+	if (encoding == 'br'):
+		compressor = getBrotli().Compressor(quality=min(level, 11))
+		compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+	else:
+		compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16 + MAX_WBITS: gzip framing
+		compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+	buffered = []
+	bufferedBytes = 0
+	for chunk in chunks:
+		if isinstance(chunk, str):
+			chunk = chunk.encode('UTF-8')
+		buffered.append(chunk)
+		bufferedBytes += len(chunk)
+		if (bufferedBytes >= bufferBytes):
+			yield compress(b''.join(buffered)) + flush()
+			buffered = []
+			bufferedBytes = 0
+	yield compress(b''.join(buffered)) + finish()
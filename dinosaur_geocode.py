@@ -0,0 +1,115 @@
+import collections, csv, re, sqlite3, threading, time
+
+# Geocoding for the location search box. Place strings are normalised, looked up in memory, then in a persistent
+# SQLite store, and only then sent to the providers in order (typically an offline gazetteer, then Google).
+# Successful lookups are written back to both cache layers, so a repeat or known place costs no network round trip.
+
+
+def normalisePlace(place):
+	# "  Bozeman,  MT " and "bozeman, mt" share one cache entry
+	return re.sub(r'\s+', ' ', re.sub(r'\s*,\s*', ', ', place.strip().lower()))
+
+
+class GazetteerProvider:
+	# Offline provider backed by a local CSV file with name,lat,lng columns (a header row is expected). Names are normalised the same way as searches.
+	def __init__(self, path):
+		self.places = {}
+		with open(path, newline='', encoding='UTF-8') as gazetteerFile:
+			for row in csv.DictReader(gazetteerFile):
+				self.places[normalisePlace(row['name'])] = (float(row['lat']), float(row['lng']))
+
+	def geocode(self, place):
+		return self.places.get(normalisePlace(place))
+
+
+class GoogleProvider:
+	# Online provider using https://pypi.python.org/pypi/geocoder. The geocoder package is only imported the first time it is needed.
+	def geocode(self, place):
+		import geocoder
+		g = geocoder.google(place)
+		if (g.json == None) or ('lat' not in g.json):
+			return None
+		return (g.json['lat'], g.json['lng'])
+
+
+class GeocodeStore:
+	# Persistent place -> (lat, lng) table in its own SQLite file, trimmed to the maxEntries most recently used places
+	def __init__(self, path, maxEntries):
+		self.path = path
+		self.maxEntries = maxEntries
+		self.lock = threading.Lock()
+		with self.connect() as connection:
+			connection.execute('create table if not exists places(place text primary key, lat float, lng float, used_at float)')
+			connection.execute('create index if not exists places_used_at on places(used_at)')
+
+	def connect(self):
+		return sqlite3.connect(self.path, timeout=30)
+
+	def get(self, place):
+		with self.lock, self.connect() as connection:
+			row = connection.execute('select lat, lng from places where place = ?', (place,)).fetchone()
+			if row != None:
+				connection.execute('update places set used_at = ? where place = ?', (time.time(), place))
+				return (row[0], row[1])
+		return None
+
+	def set(self, place, latLng):
+		with self.lock, self.connect() as connection:
+			connection.execute('insert or replace into places values (?, ?, ?, ?)', (place, latLng[0], latLng[1], time.time()))
+			connection.execute('delete from places where place not in (select place from places order by used_at desc limit ?)', (self.maxEntries,))
+
+
+class Geocoder:
+	# Memoising front end: in-process LRU -> persistent store -> providers in order. Failed lookups are not cached.
+	def __init__(self, providers, store=None, maxMemoryEntries=1000):
+		self.providers = providers
+		self.store = store
+		self.maxMemoryEntries = maxMemoryEntries
+		self.memory = collections.OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def geocode(self, place):
+		# Returns (lat, lng) for a place string, or None if no provider knows it
+		key = normalisePlace(place)
+		with self.lock:
+			if key in self.memory:
+				self.memory.move_to_end(key)
+				self.hits += 1
+				return self.memory[key]
+		latLng = None
+		if self.store != None:
+			latLng = self.store.get(key)
+		if latLng != None:
+			self.hits += 1
+		else:
+			self.misses += 1
+			for provider in self.providers:
+				latLng = provider.geocode(place)
+				if latLng != None:
+					break
+			if latLng == None:
+				return None
+			if self.store != None:
+				self.store.set(key, latLng)
+		with self.lock:
+			self.memory[key] = latLng
+			while len(self.memory) > self.maxMemoryEntries:
+				self.memory.popitem(last=False)
+		return latLng
+
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses}
+
+
+def createGeocoder(config):
+	# Builds the Geocoder described by the app config: the GAZETTEER_FILE provider first (if set), then Google; persisted at GEOCODE_CACHE_PATH (if set)
+	providers = []
+	if config.get('GAZETTEER_FILE'):
+		providers.append(GazetteerProvider(config['GAZETTEER_FILE']))
+	providers.append(GoogleProvider())
+	store = None
+	if config.get('GEOCODE_CACHE_PATH'):
+		store = GeocodeStore(config['GEOCODE_CACHE_PATH'], config.get('GEOCODE_CACHE_MAX_ENTRIES', 10000))
+	return Geocoder(providers, store)
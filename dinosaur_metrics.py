@@ -0,0 +1,74 @@
+import bisect, threading
+
+# Process-wide counters and timing histograms, rendered in the Prometheus text exposition format for /metrics.
+# Deliberately tiny (no prometheus_client dependency): counters and histograms are keyed by metric name plus a
+# sorted tuple of label pairs, and everything is guarded by one lock since updates are a few additions each.
+
+defaultBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def formatLabels(labels, extra=()):
+	labelPairs = tuple(labels) + tuple(extra)
+	if not labelPairs:
+		return ''
+	return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labelPairs) + '}'
+
+def formatValue(value):
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+	def __init__(self, buckets=defaultBuckets):
+		self.buckets = buckets
+		self.lock = threading.Lock()
+		self.descriptions = {} # name -> (type, help)
+		self.counters = {} # (name, labels) -> value
+		self.histograms = {} # (name, labels) -> [bucket counts, sum, count]
+
+	def describe(self, name, metricType, helpText):
+		self.descriptions[name] = (metricType, helpText)
+
+	def inc(self, name, amount=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + amount
+
+	def observe(self, name, value, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			histogram = self.histograms.get(key)
+			if histogram == None:
+				histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+			position = bisect.bisect_left(self.buckets, value)
+			if position < len(self.buckets):
+				histogram[0][position] += 1
+			histogram[1] += value
+			histogram[2] += 1
+
+	def render(self, gauges=()):
+		# The whole registry as Prometheus text. gauges is a sequence of (name, help, [(labels dict, value), ...]) sampled by the caller at scrape time.
+		lines = []
+		with self.lock:
+			samples = {}
+			for (name, labels), value in self.counters.items():
+				samples.setdefault(name, []).append('%s%s %s' % (name, formatLabels(labels), formatValue(value)))
+			for (name, labels), (bucketCounts, total, count) in self.histograms.items():
+				cumulative = 0
+				for bucket, bucketCount in zip(self.buckets, bucketCounts):
+					cumulative += bucketCount
+					samples.setdefault(name, []).append('%s_bucket%s %d' % (name, formatLabels(labels, [('le', formatValue(bucket))]), cumulative))
+				samples[name].append('%s_bucket%s %d' % (name, formatLabels(labels, [('le', '+Inf')]), count))
+				samples[name].append('%s_sum%s %s' % (name, formatLabels(labels), formatValue(total)))
+				samples[name].append('%s_count%s %d' % (name, formatLabels(labels), count))
+			for name in sorted(samples):
+				metricType, helpText = self.descriptions.get(name, ('untyped', name))
+				lines.append('# HELP %s %s' % (name, helpText))
+				lines.append('# TYPE %s %s' % (name, metricType))
+				lines.extend(samples[name])
+		for name, helpText, gaugeSamples in gauges:
+			lines.append('# HELP %s %s' % (name, helpText))
+			lines.append('# TYPE %s gauge' % name)
+			lines.extend('%s%s %s' % (name, formatLabels(sorted(labels.items())), formatValue(value)) for labels, value in gaugeSamples)
+		return '\n'.join(lines) + '\n'
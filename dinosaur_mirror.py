@@ -0,0 +1,102 @@
+import itertools, sqlite3, threading, time
+
+# Local mirror of PaleoBioDB occurrences for the taxon presets on the search page. Each synced preset (a base_name
+# like "saurischia,ornithischia") keeps the ids of its occurrences in preset_fossils; the occurrences themselves are
+# stored once, keyed by PBDB occurrence number, with the record fields of the paleozoic.db schema (see
+# dinosaur_db_setup.py). Searches for a synced preset can then be answered from here, filtered by geologic interval
+# (max_ma/min_ma index) and lat/lng box (R*Tree), without a PBDB request.
+
+# Compact-vocabulary PBDB field -> mirror column. Records read back from the mirror use the same PBDB field names, so they go through the normal ingest path unchanged.
+mirrorFields = (('lat', 'lat'), ('lng', 'long'), ('tna', 'taxonName'), ('phl', 'trank_phylum'), ('cll', 'trank_class'), ('odl', 'trank_order'), ('fml', 'trank_family'), ('gnl', 'trank_genus'),
+	('cc2', 'nation'), ('stp', 'state'), ('cny', 'county'), ('oei', 'geologicAge'), ('env', 'paleoenv'), ('eag', 'max_ma'), ('lag', 'min_ma'), ('ggc', 'geocomments'))
+
+
+def getOccurrenceNo(record):
+	# PBDB occurrence ids look like "occ:12345" (or a bare number, depending on the vocabulary)
+	return int(str(record['oid']).split(':')[-1])
+
+
+class OccurrenceMirror:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		with self.connect() as connection:
+			connection.execute('create table if not exists fossils(occurrence_no integer primary key, lat float, long float, taxonName text, trank_phylum text, trank_class text, trank_order text, trank_family text, trank_genus text, nation text, state text, county text, geologicAge text, paleoenv text, max_ma float, min_ma float, geocomments text, modified text)')
+			connection.execute('create index if not exists fossils_age on fossils(max_ma, min_ma)')
+			connection.execute('create table if not exists preset_fossils(preset text, occurrence_no integer, primary key(preset, occurrence_no)) without rowid')
+			connection.execute('create table if not exists syncs(preset text primary key, synced_at float, modified_after text, record_count integer)')
+			try:
+				connection.execute('create virtual table if not exists fossils_rtree using rtree(id, minLat, maxLat, minLng, maxLng)')
+				self.spatialIndex = True
+			except sqlite3.OperationalError: # SQLite built without R*Tree: fall back to a plain index on latitude
+				connection.execute('create index if not exists fossils_lat on fossils(lat)')
+				self.spatialIndex = False
+
+	def connect(self):
+		return sqlite3.connect(self.path, timeout=30)
+
+	def lastSync(self, preset):
+		# (synced_at, modified_after) of the preset's last sync, or None if it has never been synced
+		with self.connect() as connection:
+			return connection.execute('select synced_at, modified_after from syncs where preset = ?', (preset,)).fetchone()
+
+	def store(self, preset, records, syncedAt, modifiedAfter, full=False, batchSize=1000):
+		# Upserts PBDB records and adds them to the preset, batchSize records per executemany() and all in one transaction, so a failed sync leaves the mirror as it was. A full sync first forgets the preset's old membership, which is the only way occurrences deleted upstream drop out. Returns the number of records stored.
+		recordCount = 0
+		records = iter(records)
+		with self.lock, self.connect() as connection:
+			if full:
+				connection.execute('delete from preset_fossils where preset = ?', (preset,))
+			while True:
+				fossilRows = []
+				for record in itertools.islice(records, batchSize):
+					fossilRows.append([getOccurrenceNo(record), float(record['lat']), float(record['lng'])] + [record.get(field) for field, column in mirrorFields[2:]] + [record.get('dmd')])
+				if not fossilRows:
+					break
+				connection.executemany('insert or replace into fossils values (%s)' % ', '.join('?' * len(fossilRows[0])), fossilRows)
+				if self.spatialIndex:
+					connection.executemany('insert or replace into fossils_rtree values (?, ?, ?, ?, ?)', [(row[0], row[1], row[1], row[2], row[2]) for row in fossilRows])
+				connection.executemany('insert or ignore into preset_fossils values (?, ?)', [(preset, row[0]) for row in fossilRows])
+				recordCount += len(fossilRows)
+			if full:
+				connection.execute('delete from fossils where occurrence_no not in (select occurrence_no from preset_fossils)')
+				if self.spatialIndex:
+					connection.execute('delete from fossils_rtree where id not in (select occurrence_no from fossils)')
+			presetCount = connection.execute('select count(*) from preset_fossils where preset = ?', (preset,)).fetchone()[0]
+			connection.execute('insert or replace into syncs values (?, ?, ?, ?)', (preset, syncedAt, modifiedAfter, presetCount))
+		return recordCount
+
+	def canServe(self, preset, maxAge):
+		# True if the preset has been synced within the last maxAge seconds
+		lastSync = self.lastSync(preset)
+		return (lastSync != None) and (lastSync[0] >= time.time() - maxAge)
+
+	def query(self, preset, box=None, ageRange=None):
+		# Yields the preset's occurrences as compact-vocabulary PBDB records, in occurrence order. box is (latmin, latmax, lngmin, lngmax); ageRange is (max_ma, min_ma), matched like PBDB's default "major" time rule: at least half of the occurrence's age range must fall inside it.
+		sql = 'select %s from fossils join preset_fossils using (occurrence_no) where preset = ?' % ', '.join('fossils.' + column for field, column in mirrorFields)
+		params = [preset]
+		if box != None:
+			latmin, latmax, lngmin, lngmax = box
+			if self.spatialIndex: # The R*Tree's float32 boxes are only good for candidates (those overlapping the box); the real lat/long columns decide
+				sql += ' and occurrence_no in (select id from fossils_rtree where maxLat >= ? and minLat <= ? and maxLng >= ? and minLng <= ?)'
+				params += [latmin, latmax, lngmin, lngmax]
+			sql += ' and lat between ? and ? and long between ? and ?'
+			params += [latmin, latmax, lngmin, lngmax]
+		if ageRange != None:
+			ageMax, ageMin = ageRange
+			sql += ' and max_ma > ? and min_ma < ? and (min(max_ma, ?) - max(min_ma, ?)) * 2 >= (max_ma - min_ma)'
+			params += [ageMin, ageMax, ageMax, ageMin]
+		sql += ' order by occurrence_no'
+		connection = self.connect()
+		try:
+			for row in connection.execute(sql, params):
+				yield {field: value for (field, column), value in zip(mirrorFields, row) if value != None}
+		finally:
+			connection.close()
+
+
+def createOccurrenceMirror(config):
+	# Builds the OccurrenceMirror at PBDB_MIRROR_PATH, or returns None when the mirror is off
+	if not config.get('PBDB_MIRROR_PATH'):
+		return None
+	return OccurrenceMirror(config['PBDB_MIRROR_PATH'])
@@ -0,0 +1,25 @@
+import os, shutil, sys, tempfile
+import pytest
+
+# The app reads its settings when it is imported, so they are written before any test module imports dinosaur: a throwaway
+# database, no mirror, response cache or geocode store on disk, and a PBDB URL nothing listens on, so a test that reaches
+# for the network fails instead of asking paleobiodb.org.
+rootPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fixturePath = os.path.join(rootPath, 'tests', 'fixtures')
+sys.path.insert(0, rootPath)
+
+from dinosaur_benchmark import configureApp
+
+workPath = tempfile.mkdtemp(prefix='dinosaur-tests-')
+configureApp(workPath, 'http://127.0.0.1:9', None)
+
+import dinosaur
+
+
+@pytest.fixture(scope='session')
+def app():
+	with dinosaur.app.app_context():
+		dinosaur.db.create_all()
+		dinosaur.loadGeoTimeSnapshot()
+		yield dinosaur.app
+	shutil.rmtree(workPath, ignore_errors=True)
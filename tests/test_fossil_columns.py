@@ -0,0 +1,57 @@
+import gzip, json, os
+import pytest
+
+import dinosaur, dinosaur_location
+from conftest import fixturePath, rootPath
+
+# buildFossilColumns() must give exactly what the per-row path (buildFossilRow(), i.e. getfossilName(), getTaxonomy(),
+# getLocation() and getGeologicAge() record by record) gives. occs-sample.json covers the labelling branches: trilobites
+# with and without a genus, birds, records without a genus or a taxon name, British, US and Antarctic localities, places
+# known only from their geological comments, ages under a million years and records with no age or no coordinates.
+# Occurrence fixtures saved by "dinosaur_benchmark.py record" (or generate) are checked too when they are there.
+
+benchmarkFixturePath = os.path.join(rootPath, 'benchmark_fixtures')
+
+def readResponse(path):
+	with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as responseFile:
+		return json.loads(responseFile.read().decode('UTF-8'))['records']
+
+def getResponsePaths():
+	responsePaths = [os.path.join(fixturePath, 'occs-sample.json')]
+	if os.path.exists(os.path.join(benchmarkFixturePath, 'manifest.json')):
+		with open(os.path.join(benchmarkFixturePath, 'manifest.json')) as manifestFile:
+			manifest = json.load(manifestFile)
+		responsePaths += [os.path.join(benchmarkFixturePath, occurrences['file']) for name, occurrences in sorted(manifest['occurrences'].items()) if occurrences['records'] <= 10000]
+	return responsePaths
+
+def clearLabelCaches():
+	# So neither path is handed labels the other one worked out
+	dinosaur.getGeoTimeIndex().ageLabels.clear()
+	dinosaur_location.getLocation.cache_clear()
+
+@pytest.mark.parametrize('responsePath', getResponsePaths(), ids=os.path.basename)
+def test_columns_match_rows(app, responsePath):
+	paleobiodbRecords = readResponse(responsePath)
+	clearLabelCaches()
+	fossilRows = [dinosaur.buildFossilRow(paleobiodbRecord, 'test') for paleobiodbRecord in paleobiodbRecords]
+	clearLabelCaches()
+	fossilColumns = dinosaur.buildFossilColumns(paleobiodbRecords, 'test')
+	assert sorted(fossilColumns) == sorted(fossilRows[0])
+	for name in fossilColumns:
+		assert list(fossilColumns[name]) == [fossilRow[name] for fossilRow in fossilRows], name
+
+def test_sample_labels(app):
+	# A few of the labels spelt out, so a change to the shared label functions can't slip through both paths at once
+	fossilColumns = dinosaur.buildFossilColumns(readResponse(os.path.join(fixturePath, 'occs-sample.json')), 'test')
+	assert fossilColumns['fossilName'][:5] == ['Triceratops', 'Triceratops', 'Tyrannosaurus', 'Diplodocus', 'Titanosauridae']
+	assert fossilColumns['fossilName'][9:12] == ['Trilobite (genus Elrathia)', 'Trilobite (genus Trilobita)', 'Bird (genus Archaeopteryx lithographica)']
+	assert fossilColumns['fossilName'][23] == 'Unknown species'
+	assert fossilColumns['location'][:3] == ['Garfield, Montana', 'Garfield, Montana', 'McCone, Montana']
+	assert fossilColumns['location'][6:8] == ['Isle of Wight, England', 'Isle of Skye, Scotland']
+	assert fossilColumns['location'][14] == 'Antarctica'
+	assert fossilColumns['location'][19:21] == ['coastal exposure, exact bed unknown', 'Location undisclosed']
+	assert fossilColumns['age'][0] == 'Cretaceous period, Mesozoic era (approx. 69.05 million years ago)'
+	assert fossilColumns['age'][12] == 'Quaternary period, Cenozoic era (approx. 70.35 thousand years ago)'
+	assert fossilColumns['age'][15] == 'Ediacaran period, Neoproterozoic era (approx. 588.0 million years ago)'
+	assert fossilColumns['age'][21:23] == ['Geologic age unknown', 'Geologic age unknown'] # No age range, and no interval name
+	assert (fossilColumns['lat'][22], fossilColumns['lng'][22]) == (None, None)
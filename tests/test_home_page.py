@@ -0,0 +1,34 @@
+import concurrent.futures
+
+import dinosaur
+
+# The landing page is rendered once and served with a content ETag. Concurrent first requests must all get the same
+# complete page, and a flashed message must reach only the browser it was meant for, never the cached page.
+
+def getHome(app):
+	response = app.test_client().get('/')
+	return (response.status_code, response.headers.get('ETag'), response.data)
+
+def test_concurrent_first_requests(app):
+	dinosaur.resetHomePage()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+		responses = list(pool.map(lambda index: getHome(app), range(16)))
+	assert len(set(responses)) == 1
+	status, etag, body = responses[0]
+	assert (status, etag.strip('"')) == (200, dinosaur.getHomePage()['etag'])
+	assert body == dinosaur.getHomePage()['body']
+
+def test_not_modified(app):
+	client = app.test_client()
+	etag = client.get('/').headers['ETag']
+	assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+def test_flash_stays_out_of_cache(app):
+	dinosaur.resetHomePage()
+	client = app.test_client()
+	with client.session_transaction() as clientSession:
+		clientSession['_flashes'] = [('message', "Couldn't find the location Atlantis. Please try again.")]
+	assert b'Atlantis' in client.get('/').data
+	status, etag, body = getHome(app)
+	assert b'Atlantis' not in body
+	assert b'Atlantis' not in dinosaur.getHomePage()['body']
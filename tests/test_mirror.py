@@ -0,0 +1,28 @@
+import os
+import pytest
+
+from dinosaur_mirror import OccurrenceMirror
+from conftest import fixturePath
+from test_fossil_columns import readResponse
+
+# The mirror's box queries must agree with the coordinates it stores, edges included (its R*Tree keeps float32 boxes), and
+# a store must round-trip every record it is given.
+
+@pytest.fixture
+def occurrenceMirror(tmp_path):
+	occurrenceMirror = OccurrenceMirror(str(tmp_path / 'mirror.db'))
+	paleobiodbRecords = [record for record in readResponse(os.path.join(fixturePath, 'occs-sample.json')) if 'lat' in record]
+	assert occurrenceMirror.store('sample', paleobiodbRecords, 0.0, '2000-01-01 00:00:00', full=True, batchSize=7) == len(paleobiodbRecords)
+	return occurrenceMirror
+
+def test_store_round_trip(occurrenceMirror):
+	mirrorRecords = list(occurrenceMirror.query('sample'))
+	assert len(mirrorRecords) == 23
+	assert mirrorRecords[0]['tna'] == 'Elrathia kingii' # In occurrence order, not PBDB's
+	assert occurrenceMirror.lastSync('sample') == (0.0, '2000-01-01 00:00:00')
+
+@pytest.mark.parametrize('box', [(43.7, 43.7, -79.9, -79.9), (43.7, 50.72, -79.9, -2.93), (43.70001, 44.0, -80.0, -79.0), (-90.0, 90.0, -180.0, 180.0)])
+def test_box_matches_scan(occurrenceMirror, box):
+	latmin, latmax, lngmin, lngmax = box
+	scanned = [record.get('tna') for record in occurrenceMirror.query('sample') if (latmin <= record['lat'] <= latmax) and (lngmin <= record['lng'] <= lngmax)]
+	assert [record.get('tna') for record in occurrenceMirror.query('sample', box=box)] == scanned
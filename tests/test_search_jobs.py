@@ -0,0 +1,50 @@
+import json, time
+import pytest
+from sqlalchemy import inspect
+
+import dinosaur
+
+# A job whose process died stays 'queued' or 'running' in the shared database; once its heartbeat is older than
+# SEARCH_JOB_STALE_AFTER, polling it (or submitting another search) marks it failed so its browser stops waiting.
+
+def addJob(clientId, status, heartbeatAge):
+	searchJob = dinosaur.SearchJob(clientId, {'searchTaxon': 'dinosauria', 'searchLocation': '', 'searchRadius': 1, 'searchGeoTime': 'allpasteras'})
+	searchJob.status = status
+	searchJob.heartbeat_at = time.time() - heartbeatAge
+	dinosaur.db.session.add(searchJob)
+	dinosaur.db.session.commit()
+	return searchJob.id
+
+@pytest.fixture
+def client(app):
+	client = app.test_client()
+	with client.session_transaction() as clientSession:
+		clientSession['client_id'] = 'test-client'
+	return client
+
+@pytest.mark.parametrize('status', ['queued', 'running'])
+def test_stale_job_fails_when_polled(app, client, status):
+	jobId = addJob('test-client', status, app.config['SEARCH_JOB_STALE_AFTER'] + 1)
+	jobStatus = json.loads(client.get('/searchjob/%s/status' % jobId).data)
+	assert jobStatus['status'] == 'failed'
+	assert jobStatus['message'] == "The search stopped responding. Please try again."
+	assert dinosaur.db.session.get(dinosaur.SearchJob, jobId).finished_at != None
+
+def test_live_job_keeps_running(app, client):
+	jobId = addJob('test-client', 'running', app.config['SEARCH_JOB_STALE_AFTER'] / 2)
+	assert json.loads(client.get('/searchjob/%s/status' % jobId).data)['status'] == 'running'
+
+def test_stale_jobs_swept(app):
+	staleId = addJob('other-client', 'running', app.config['SEARCH_JOB_STALE_AFTER'] + 1)
+	liveId = addJob('other-client', 'queued', 0)
+	dinosaur.failStaleSearchJobs()
+	dinosaur.db.session.commit()
+	dinosaur.db.session.expire_all()
+	assert (dinosaur.db.session.get(dinosaur.SearchJob, staleId).status, dinosaur.db.session.get(dinosaur.SearchJob, liveId).status) == ('failed', 'queued')
+
+def test_migrate_adds_heartbeat(app):
+	with dinosaur.db.engine.begin() as connection:
+		connection.exec_driver_sql('alter table search_job drop column heartbeat_at')
+	dinosaur.db.session.remove()
+	dinosaur.migrate_search_job_table()
+	assert 'heartbeat_at' in [column['name'] for column in inspect(dinosaur.db.engine).get_columns('search_job')]
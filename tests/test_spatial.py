@@ -0,0 +1,30 @@
+import os
+import pytest
+
+import dinosaur
+from conftest import fixturePath
+from test_fossil_columns import readResponse
+
+# fossilsInBox() and fossilsInRadius() on the R*Tree must give what the plain lat/lng column scan gives. The R*Tree keeps
+# float32 boxes, so points exactly on a box's edge (43.7 has no exact float32) are where the two could part ways.
+
+@pytest.fixture(scope='module')
+def sampleSearch(app):
+	with dinosaur.db.engine.connect() as connection:
+		dinosaur.ingestPaleobiodbRecords(connection, readResponse(os.path.join(fixturePath, 'occs-sample.json')), {}, 'spatial')
+		dinosaur.store_staged_fossils(connection, 'spatial')
+	yield 'spatial'
+	dinosaur.clear_db('spatial')
+
+def scanBox(searchId, latmin, latmax, lngmin, lngmax):
+	return [fossil for fossil in dinosaur.loadFossilRecords(searchId) if (fossil.lat != None) and (latmin <= fossil.lat <= latmax) and (lngmin <= fossil.lng <= lngmax)]
+
+@pytest.mark.parametrize('box', [(43.7, 43.7, -79.9, -79.9), (43.7, 50.72, -79.9, -2.93), (-90.0, 90.0, -180.0, 180.0), (43.69999, 43.70001, -80.0, -79.0), (43.70001, 44.0, -80.0, -79.0), (40.0, 43.69999, -80.0, -79.0)])
+def test_box_matches_scan(sampleSearch, box):
+	assert dinosaur.hasSpatialIndex()
+	assert [fossil.id for fossil in dinosaur.fossilsInBox(sampleSearch, *box)] == [fossil.id for fossil in scanBox(sampleSearch, *box)]
+
+def test_box_edges(sampleSearch):
+	assert [fossil.fossilName for fossil in dinosaur.fossilsInBox(sampleSearch, 43.7, 43.7, -79.9, -79.9)] == ['Trilobite (genus Trilobita)']
+	assert dinosaur.fossilsInBox(sampleSearch, 43.70001, 44.0, -80.0, -79.0) == [] # Just above the point
+	assert [fossil.fossilName for fossil in dinosaur.fossilsInBox(sampleSearch, 40.0, 60.0, 170.0, -100.0)] == ['Triceratops', 'Triceratops', 'Tyrannosaurus', 'Diplodocus', 'Ornithomimidae'] # Across the antimeridian
@@ -0,0 +1,35 @@
+import json
+import pytest
+
+import dinosaur
+
+# refresh-timescale must be able to rebuild the snapshot it refreshes: a missing or corrupt one counts as stale (version 0)
+# and is written afresh, instead of stopping the command before it gets to download anything.
+
+@pytest.fixture
+def responsePath(app, tmp_path):
+	# A saved intervals/list.json?scale=1 response holding the bundled timescale
+	intervalRecords = []
+	for interval_no, level, interval_name, color, max_ma, min_ma, parent_no in dinosaur.readGeoTimeSnapshot(app.config['GEOTIME_SNAPSHOT'])['intervals']:
+		intervalRecord = {'oid': 'int:%d' % interval_no, 'lvl': level, 'nam': interval_name, 'col': color, 'eag': max_ma, 'lag': min_ma}
+		if (parent_no != None):
+			intervalRecord['pid'] = 'int:%d' % parent_no
+		intervalRecords.append(intervalRecord)
+	responsePath = tmp_path / 'intervals.json'
+	responsePath.write_text(json.dumps({'records': intervalRecords}))
+	return str(responsePath)
+
+@pytest.mark.parametrize('snapshotText', [None, '', '{"version": 3, "intervals": [', '{"version": 3, "fetched_at": 0, "sha256": "0", "intervals": []}'], ids=['missing', 'empty', 'truncated', 'checksum'])
+def test_refresh_rewrites_unusable_snapshot(app, responsePath, tmp_path, monkeypatch, snapshotText):
+	snapshotPath = tmp_path / 'geotime.json'
+	if (snapshotText != None):
+		snapshotPath.write_text(snapshotText)
+	monkeypatch.setitem(app.config, 'GEOTIME_SNAPSHOT', str(snapshotPath))
+	result = app.test_cli_runner().invoke(args=['refresh-timescale', '--from-file', responsePath])
+	assert result.exit_code == 0, result.output
+	assert 'rewriting it' in result.output
+	snapshot = dinosaur.readGeoTimeSnapshot(str(snapshotPath))
+	assert snapshot['version'] == 1
+	assert snapshot['intervals'] == dinosaur.readGeoTimeRows(responsePath)
+	result = app.test_cli_runner().invoke(args=['refresh-timescale', '--from-file', responsePath])
+	assert 'not refreshing' in result.output # Now fresh